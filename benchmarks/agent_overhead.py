@@ -0,0 +1,213 @@
+"""Benchmark the overhead of the sweep agent and of finalize against a local tracking store.
+
+A local sqlite (or file) tracking store is filled with synthetic sweeps of increasing size, after which each stage of
+the agent loop and of finalize is timed. Results are written as JSON, such that runs of the benchmark on different
+releases can be compared. The local artifact cache is kept in the temporary directory of the benchmark, and the
+`*_cold` stages start every repetition with an empty cache.
+
+Usage:
+    python benchmarks/agent_overhead.py --sizes 100 1000 10000 --output benchmarks/results.json
+
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+from collections.abc import Callable
+from datetime import UTC, datetime
+from importlib.metadata import version
+from pathlib import Path
+
+import mlflow
+import numpy as np
+import yaml
+from mlflow import MlflowClient
+from mlflow.entities import Metric, RunTag
+from mlflow.utils.mlflow_tags import MLFLOW_PARENT_RUN_ID
+
+from mlflow_sweep.artifacts import CACHE_DIR_ENV
+from mlflow_sweep.commands import determine_sweep, finalize_command, init_command
+from mlflow_sweep.models import SweepConfig
+from mlflow_sweep.sampler import SweepSampler
+from mlflow_sweep.sweepstate import SweepState
+
+METRIC = "accuracy"
+
+PARAMETERS = {
+    "learning_rate": {"values": np.round(np.geomspace(1e-4, 1e-1, 50), 6).tolist()},
+    "batch_size": {"values": [16, 32, 64, 128]},
+    "layers": {"min": 1, "max": 8},
+}
+
+
+def create_sweep(directory: Path, num_runs: int, num_steps: int, seed: int = 0) -> str:
+    """Create a sweep with num_runs finished child runs, each logging num_steps values of the metric."""
+    config = {
+        "command": "python train.py --lr ${learning_rate} --batch-size ${batch_size} --layers ${layers}",
+        "experiment_name": "benchmark",
+        "sweep_name": f"benchmark-{num_runs}",
+        "method": "random",
+        "metric": {"name": METRIC, "goal": "maximize"},
+        "parameters": PARAMETERS,
+        "run_cap": 10 * num_runs + 10,
+    }
+    config_path = directory / f"sweep-{num_runs}.yaml"
+    config_path.write_text(yaml.safe_dump(config))
+    with contextlib.redirect_stdout(io.StringIO()):
+        init_command(config_path)
+    sweep_id = mlflow.active_run().info.run_id  # ty: ignore[possibly-unbound-attribute]
+    experiment_id = mlflow.active_run().info.experiment_id  # ty: ignore[possibly-unbound-attribute]
+    mlflow.end_run()
+
+    client = MlflowClient()
+    sweepstate = SweepState(sweep_id)
+    rng = np.random.default_rng(seed)
+    start = int(time.time() * 1000) - 1000 * num_runs
+    for i in range(num_runs):
+        sweep_run_id = f"benchmark-{i}"
+        proposal = {
+            "learning_rate": float(rng.choice(PARAMETERS["learning_rate"]["values"])),
+            "batch_size": int(rng.choice(PARAMETERS["batch_size"]["values"])),
+            "layers": int(rng.integers(1, 9)),
+            "run": i + 1,
+            "sweep_run_id": sweep_run_id,
+        }
+        sweepstate.ledger.append(proposal)
+        run = client.create_run(
+            experiment_id,
+            start_time=start + 1000 * i,
+            tags={MLFLOW_PARENT_RUN_ID: sweep_id, "mlflow.sweepRunId": sweep_run_id},
+        )
+        values = np.cumsum(rng.random(num_steps)) / num_steps
+        client.log_batch(
+            run.info.run_id,
+            metrics=[Metric(METRIC, float(v), start + 1000 * i + step, step) for step, v in enumerate(values)],
+            tags=[RunTag("benchmark", "true")],
+        )
+        client.set_terminated(run.info.run_id, end_time=start + 1000 * i + 900)
+    return sweep_id
+
+
+def measure(function: Callable, repeat: int, setup: Callable | None = None) -> list[float]:
+    """Time repeated calls of a function, each preceded by an untimed call of setup if given."""
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def benchmark_sweep(sweep_id: str, repeat: int, finalize: bool, directory: Path) -> dict[str, list[float]]:
+    """Time each stage of the agent loop and of finalize on an existing sweep.
+
+    Cold stages use a new artifact cache in `directory` for every repetition, such that they include downloading the
+    ledger, like an agent starting on a new machine.
+    """
+    timings: dict[str, list[float]] = {}
+    sweep = determine_sweep(sweep_id)
+    config = SweepConfig.from_sweep(sweep)
+
+    def empty_cache():
+        os.environ[CACHE_DIR_ENV] = tempfile.mkdtemp(dir=directory)
+
+    cache_dir = os.environ[CACHE_DIR_ENV]
+    timings["determine_sweep"] = measure(lambda: determine_sweep(sweep_id), repeat)
+    timings["config_from_sweep"] = measure(lambda: SweepConfig.from_sweep(sweep), repeat)
+    timings["get_parameters_cold"] = measure(lambda: SweepState(sweep_id).get_parameters(), repeat, empty_cache)
+    timings["get_all_cold"] = measure(lambda: SweepState(sweep_id).get_all(), repeat, empty_cache)
+    timings["get_all_with_metric_cold"] = measure(
+        lambda: SweepState(sweep_id).get_all(with_metric=METRIC), repeat, empty_cache
+    )
+    os.environ[CACHE_DIR_ENV] = cache_dir
+
+    sweepstate = SweepState(sweep_id)
+    sweepstate.get_all(with_metric=METRIC)
+    timings["get_all_warm"] = measure(sweepstate.get_all, repeat)
+    timings["get_all_with_metric_warm"] = measure(lambda: sweepstate.get_all(with_metric=METRIC), repeat)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for method in ("random", "grid", "bayes"):
+            sampler = SweepSampler(config.model_copy(update={"method": method}), sweepstate)
+            timings[f"propose_{method}_first"] = measure(lambda sampler=sampler: sampler.propose_batch(1), 1)
+            timings[f"propose_{method}"] = measure(lambda sampler=sampler: sampler.propose_batch(1), repeat)
+        timings["propose_bayes_batch_8"] = measure(lambda: sampler.propose_batch(8), repeat)
+
+    if finalize:
+        with tempfile.TemporaryDirectory() as workdir, contextlib.chdir(workdir):
+
+            def run_finalize():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    finalize_command(sweep_id)
+                mlflow.end_run()
+
+            timings["finalize"] = measure(run_finalize, 1)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000], help="Number of child runs per sweep")
+    parser.add_argument("--steps", type=int, default=10, help="Number of logged metric values per child run")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of repetitions of each timed stage")
+    parser.add_argument("--store", choices=["sqlite", "file"], default="sqlite", help="Type of local tracking store")
+    parser.add_argument("--no-finalize", action="store_true", help="Skip timing of finalize")
+    parser.add_argument("--output", type=Path, default=Path("benchmarks/results.json"), help="Output JSON file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        # The benchmark must neither read from nor write to the artifact cache of the user
+        os.environ[CACHE_DIR_ENV] = str(directory / "cache")
+        if args.store == "sqlite":
+            mlflow.set_tracking_uri(f"sqlite:///{directory / 'mlflow.db'}")
+        else:
+            os.environ["MLFLOW_ALLOW_FILE_STORE"] = "true"
+            mlflow.set_tracking_uri(f"file://{directory / 'mlruns'}")
+
+        for size in args.sizes:
+            start = time.perf_counter()
+            sweep_id = create_sweep(directory, size, args.steps)
+            print(f"Created sweep with {size} runs in {time.perf_counter() - start:.1f}s")
+
+            for stage, durations in benchmark_sweep(sweep_id, args.repeat, not args.no_finalize, directory).items():
+                results.append(
+                    {
+                        "num_runs": size,
+                        "stage": stage,
+                        "median_seconds": statistics.median(durations),
+                        "min_seconds": min(durations),
+                        "seconds": durations,
+                    }
+                )
+                print(f"{size:>8} {stage:<28} {statistics.median(durations):10.4f}s")
+
+    output = {
+        "metadata": {
+            "created": datetime.now(UTC).isoformat(),
+            "mlflow_sweep": version("mlflow-sweep"),
+            "mlflow": version("mlflow"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "store": args.store,
+            "steps": args.steps,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(output, indent=2))
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
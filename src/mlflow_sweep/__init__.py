@@ -6,8 +6,7 @@ def cli():
     import click
     from mlflow.cli import cli as mlflow_cli
 
-    from mlflow_sweep.commands import finalize_command, init_command, run_command
-
+    # The commands are imported when invoked, such that other mlflow commands and --help do not pay for loading them
     @mlflow_cli.group()
     def sweep():
         """MLflow Sweep CLI commands."""
@@ -15,9 +14,16 @@ def cli():
 
     @sweep.command("init")
     @click.argument("config_path", type=click.Path(exists=True, dir_okay=False))
-    def init(config_path):
+    @click.option(
+        "--queue",
+        is_flag=True,
+        help="Compute all proposals of a random or grid sweep up front and let agents claim them from a queue",
+    )
+    def init(config_path, queue):
         """Initialize a new sweep configuration."""
-        init_command(config_path)
+        from mlflow_sweep.commands import init_command
+
+        init_command(config_path, queue=queue)
 
     @sweep.command("run")
     @click.option(
@@ -26,9 +32,49 @@ def cli():
         type=str,
         help="ID of the sweep to run (optional if not specified will use the most recent initialized sweep)",
     )
-    def run(sweep_id):
+    @click.option(
+        "--parallel",
+        default=1,
+        type=click.IntRange(min=1),
+        help="Number of trials to run in parallel by this agent",
+    )
+    @click.option(
+        "--controller",
+        default=None,
+        type=str,
+        help="Address of a sweep controller (host:port or unix:/path) to request proposals from",
+    )
+    @click.option(
+        "--timeout",
+        default=None,
+        type=click.FloatRange(min=0, min_open=True),
+        help="Wall-clock seconds after which a trial is terminated, overrides the timeout of the sweep config",
+    )
+    def run(sweep_id, parallel, controller, timeout):
         """Start a sweep agent."""
-        run_command(sweep_id)
+        from mlflow_sweep.commands import run_command
+
+        run_command(sweep_id, parallel=parallel, controller=controller, timeout=timeout)
+
+    @sweep.command("controller")
+    @click.option(
+        "--sweep-id",
+        default="",
+        type=str,
+        help="ID of the sweep to serve (optional if not specified will use the most recent initialized sweep)",
+    )
+    @click.option(
+        "--address",
+        default="127.0.0.1:5005",
+        type=str,
+        show_default=True,
+        help="Address to listen on, host:port or unix:/path/to/socket",
+    )
+    def controller(sweep_id, address):
+        """Serve proposals of a sweep to many agents."""
+        from mlflow_sweep.commands import controller_command
+
+        controller_command(sweep_id, address=address)
 
     @sweep.command("finalize")
     @click.option(
@@ -37,8 +83,69 @@ def cli():
         type=str,
         help="ID of the sweep to finalize (optional if not specified will use the most recent initialized sweep)",
     )
-    def finalize(sweep_id):
+    @click.option(
+        "--n-estimators",
+        default=100,
+        type=click.IntRange(min=1),
+        help="Number of trees of the random forest used for parameter importance",
+    )
+    @click.option(
+        "--n-repeats",
+        default=30,
+        type=click.IntRange(min=1),
+        help="Number of times each parameter is permuted for permutation importance",
+    )
+    @click.option(
+        "--n-jobs",
+        default=-1,
+        type=int,
+        help="Number of cores used for parameter importance, -1 uses all cores",
+    )
+    @click.option(
+        "--max-rows",
+        default=None,
+        type=click.IntRange(min=2),
+        help="Maximum number of runs used for parameter importance, larger sweeps are subsampled",
+    )
+    @click.option(
+        "--time-budget",
+        default=None,
+        type=click.FloatRange(min=0, min_open=True),
+        help="Approximate number of seconds parameter importance may take, larger sweeps are subsampled",
+    )
+    @click.option(
+        "--method",
+        default="forest",
+        type=click.Choice(["forest", "fanova", "linear"]),
+        help="Method for parameter importance, fanova and linear are faster for very large sweeps",
+    )
+    @click.option(
+        "--force",
+        is_flag=True,
+        help="Recompute everything, even if no runs have finished since the last finalize",
+    )
+    @click.option(
+        "--large-sweep-threshold",
+        default=None,
+        type=click.IntRange(min=0),
+        help="Number of runs above which plots are rendered with WebGL and the timeline packs runs into lanes",
+    )
+    def finalize(
+        sweep_id, n_estimators, n_repeats, n_jobs, max_rows, time_budget, method, force, large_sweep_threshold
+    ):
         """Finalize a sweep."""
-        finalize_command(sweep_id)
+        from mlflow_sweep.commands import finalize_command
+
+        finalize_command(
+            sweep_id,
+            n_estimators=n_estimators,
+            n_repeats=n_repeats,
+            n_jobs=n_jobs,
+            max_rows=max_rows,
+            time_budget=time_budget,
+            method=method,
+            force=force,
+            large_sweep_threshold=large_sweep_threshold,
+        )
 
     return mlflow_cli()
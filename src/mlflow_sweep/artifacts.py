@@ -0,0 +1,61 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from mlflow import MlflowClient
+from mlflow.store.artifact.artifact_repository_registry import get_artifact_repository
+
+# Environment variable to override the directory of the local artifact cache
+CACHE_DIR_ENV = "MLFLOW_SWEEP_CACHE_DIR"
+
+
+def get_cache_dir() -> Path:
+    """Directory of the local artifact cache, `~/.cache/mlflow_sweep` unless overridden by MLFLOW_SWEEP_CACHE_DIR."""
+    return Path(os.environ.get(CACHE_DIR_ENV, Path.home() / ".cache" / "mlflow_sweep"))
+
+
+def cache_path(run_id: str, artifact_path: str) -> Path:
+    """Location of an artifact in the local cache, addressed by a hash of its run ID and artifact path."""
+    key = hashlib.sha256(f"{run_id}/{artifact_path}".encode()).hexdigest()
+    return get_cache_dir() / key[:2] / key
+
+
+def load_text_artifact(run_id: str, artifact_path: str, artifact_uri: str | None = None, cache: bool = False) -> str:
+    """Read a text artifact of a run through the artifact repository of MLflow.
+
+    The artifact is downloaded with the artifact repository matching the artifact URI of the run, such that local
+    file stores as well as S3 and other object stores are supported. Artifacts that are never overwritten, like the
+    sweep config and the records of the proposal ledger, can be kept in a local cache. The cache is keyed by run ID
+    and artifact path only, such that an artifact that is overwritten would be served stale from it.
+
+    Args:
+        run_id: The ID of the run the artifact belongs to.
+        artifact_path: Path of the artifact relative to the artifact root of the run.
+        artifact_uri: Artifact root of the run, looked up from the run if not provided.
+        cache: Whether to read from and write to the local cache, only for artifacts that are never overwritten.
+
+    Returns:
+        The content of the artifact.
+
+    Examples:
+        >>> config = load_text_artifact("sweep_run_id", "sweep_config.yaml")  # doctest: +SKIP
+
+    """
+    cached = cache_path(run_id, artifact_path)
+    if cache and cached.exists():
+        return cached.read_text()
+
+    if artifact_uri is None:
+        artifact_uri = MlflowClient().get_run(run_id).info.artifact_uri
+    with tempfile.TemporaryDirectory() as tmpdir:
+        local_path = get_artifact_repository(artifact_uri).download_artifacts(artifact_path, dst_path=tmpdir)
+        text = Path(local_path).read_text()
+
+    if cache:
+        # Write to a temporary file first, such that concurrent readers never see a partially written file
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=cached.parent, delete=False) as file:
+            file.write(text)
+        Path(file.name).replace(cached)
+    return text
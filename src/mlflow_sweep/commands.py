@@ -1,59 +1,74 @@
 import os
 import shutil
-import subprocess
 import tempfile
+import time
 import uuid
 from pathlib import Path
 
 import mlflow
-import numpy as np
-import pandas as pd
 import yaml
 from mlflow.entities import Run
+from mlflow.exceptions import MlflowException
 from rich import print as rprint
 from rich.console import Console
 from rich.table import Table
 
-from mlflow_sweep.models import SweepConfig
-from mlflow_sweep.plotting import plot_metric_vs_time, plot_parameter_importance_and_correlation, plot_trial_timeline
+from mlflow_sweep.controller import ControllerClient, serve
+from mlflow_sweep.coordinator import COORDINATOR_DB_ENV, SlotCoordinator, get_coordinator_path
+from mlflow_sweep.executor import TrialExecutor, TrialSource
+from mlflow_sweep.models import FinalizeState, SweepConfig, SweepMethodEnum
 from mlflow_sweep.sampler import SweepSampler
 from mlflow_sweep.sweepstate import SweepState
-from mlflow_sweep.utils import calculate_feature_importance_and_correlation, current_time_convert
+from mlflow_sweep.workqueue import QUEUE_TAG, ProposalQueue
+
+# Artifact of the sweep run that contains the figures created by finalize
+REPORT_ARTIFACT = "sweep_report.html"
+
+# Artifact of the sweep run with the data of all runs shown in the report
+RUNS_ARTIFACT = "sweep_runs.csv"
 
 
 def determine_sweep(sweep_id: str) -> Run:
     """Determine the sweep to use.
     If a sweep_id is provided, it will be used. Otherwise, the most recent sweep will be selected."""
+    if sweep_id:
+        try:
+            sweep = mlflow.get_run(sweep_id)
+        except MlflowException as e:
+            raise ValueError(f"No sweep found with sweep_id: {sweep_id}") from e
+        if sweep.data.tags.get("sweep") != "True":
+            raise ValueError(f"No sweep found with sweep_id: {sweep_id}")
+        return sweep
 
+    # Let the tracking store select the most recent sweep instead of scanning all sweeps
     sweeps: list[Run] = mlflow.search_runs(  # ty: ignore[invalid-assignment]
         search_all_experiments=True,
         filter_string="tag.sweep = 'True'",
+        order_by=["attributes.start_time DESC"],
+        max_results=1,
         output_format="list",
     )
+    if not sweeps:
+        raise ValueError("No sweeps found, initialize a sweep with `mlflow sweep init` first")
+    return sweeps[0]
 
-    if sweep_id:
-        for sweep in sweeps:
-            if sweep.info.run_id == sweep_id:
-                break
-        else:
-            raise ValueError(f"No sweep found with sweep_id: {sweep_id}")
-    else:
-        sweep = max(sweeps, key=lambda x: x.info.start_time)  # Get the most recent sweep
-
-    return sweep
 
-
-def init_command(config_path: Path) -> None:
+def init_command(config_path: Path, queue: bool = False) -> None:
     """Start a sweep from a config.
 
     Args:
         config_path (Path): Path to the sweep configuration file.
+        queue (bool): Whether to materialize all proposals of a random or grid sweep in a `ProposalQueue`, which
+            agents claim from instead of proposing runs themselves.
 
     """
     with Path(config_path).open() as file:
         config = yaml.safe_load(file)
 
     config = SweepConfig(**config)  # validate the config
+    config.template.validate()  # new sweeps refer to environment variables as $NAME
+    if queue and config.method not in (SweepMethodEnum.random, SweepMethodEnum.grid):
+        raise ValueError(f"Only random and grid sweeps can be queued, got {config.method.value}")
     rprint("[bold blue]Initializing sweep with configuration:[/bold blue]")
     rprint(config)
 
@@ -66,79 +81,230 @@ def init_command(config_path: Path) -> None:
         shutil.copy(config_path, tmp_config_path)
         mlflow.log_artifact(str(tmp_config_path))
 
+    if queue:
+        proposals = SweepSampler(config, SweepState(sweep_id=run.info.run_id)).materialize()
+        ProposalQueue(run.info.run_id).put(proposals)
+        mlflow.set_tag(QUEUE_TAG, True)
+        rprint(f"[bold blue]Queued {len(proposals)} proposals in {get_coordinator_path()}[/bold blue]")
+
     rprint(f"[bold green]Sweep initialized with ID: {run.info.run_id}[/bold green]")
 
 
-def run_command(sweep_id: str = "") -> None:
-    """Run a sweep agent."""
-    sweep = determine_sweep(sweep_id)
+def run_command(
+    sweep_id: str = "", parallel: int = 1, controller: str | None = None, timeout: float | None = None
+) -> None:
+    """Run a sweep agent.
 
-    config = SweepConfig.from_sweep(sweep)
-    runstate = SweepState(sweep_id=sweep.info.run_id)
-    sweep_sampler = SweepSampler(config, runstate)
+    Args:
+        sweep_id (str): ID of the sweep to run, the most recent sweep is used if not provided.
+        parallel (int): Number of trials the agent keeps running at the same time.
+        controller (str | None): Address of a sweep controller to request proposals from, instead of sampling in
+            this agent, see `controller_command`.
+        timeout (float | None): Wall-clock seconds after which the trials of this agent are terminated, overrides the
+            `timeout` of the sweep config. Trials with a value of the `timeout_parameter` of the sweep use that value.
 
-    mlflow.set_experiment(experiment_id=sweep.info.experiment_id)
-    mlflow.start_run(run_id=sweep.info.run_id)
+    """
+    agent_id = str(uuid.uuid4())  # Unique ID for this agent
+    if controller is not None:
+        # A thin agent, the controller samples and tracks the sweep for all agents
+        client = ControllerClient(controller, agent_id=agent_id)
+        sweep_sampler: TrialSource = client
+        sweep_run_id, prune_interval, trial_timeout = client.sweep_id, client.prune_interval, client.trial_timeout
+        timeout_parameter = client.timeout_parameter
+    else:
+        sweep = determine_sweep(sweep_id)
+
+        config = SweepConfig.from_sweep(sweep)
+        runstate = SweepState(sweep_id=sweep.info.run_id)
+        # Trial slots are reserved through a coordinator shared by all agents, such that the run cap is never overshot
+        coordinator = SlotCoordinator(sweep.info.run_id, config.run_cap, agent_id=agent_id)
+        sweep_sampler = SweepSampler(config, runstate, coordinator, open_queue(sweep, agent_id))
+        sweep_run_id = sweep.info.run_id
+        early_terminate = config.early_terminate
+        prune_interval = early_terminate.check_interval if early_terminate is not None else None
+        trial_timeout = config.timeout
+        timeout_parameter = config.timeout_parameter
+
+        mlflow.set_experiment(experiment_id=sweep.info.experiment_id)
+        mlflow.start_run(run_id=sweep.info.run_id)
 
     # Set an environment variable to link runs in the sweep
     # This will be picked up by the custom SweepRunContextProvider
     global_env = os.environ.copy()
-    global_env["SWEEP_PARENT_RUN_ID"] = sweep.info.run_id
-    global_env["SWEEP_AGENT_ID"] = str(uuid.uuid4())  # Unique ID for this agent
-
-    while True:
-        output = sweep_sampler.propose_next()
-        if output is None:
-            rprint("[bold red]No more runs can be proposed or run cap reached.[/bold red]")
-            break
-        command, data = output
-        mlflow.log_table(
-            data={k: [v] for k, v in data.items()},
-            artifact_file="proposed_parameters.json",
-        )
-        rprint(f"[bold blue]Executed command:[/bold blue] \n[italic]{command}[/italic]")
-        rprint(50 * "─")
-        local_env = global_env.copy()
-        local_env["SWEEP_RUN_ID"] = data["sweep_run_id"]
-        subprocess.run(command, shell=True, env=local_env, check=True)
-        rprint(50 * "─")
+    global_env["SWEEP_PARENT_RUN_ID"] = sweep_run_id
+    global_env["SWEEP_AGENT_ID"] = agent_id
+
+    executor = TrialExecutor(
+        sweep_sampler,
+        env=global_env,
+        parallel=parallel,
+        prune_interval=prune_interval,
+        agent_id=agent_id,
+        timeout=timeout if timeout is not None else trial_timeout,
+        timeout_parameter=timeout_parameter,
+    )
+    executor.run()
+
+
+def controller_command(sweep_id: str = "", address: str = "127.0.0.1:5005") -> None:
+    """Serve proposals of a sweep to agents started with `mlflow sweep run --controller`.
+
+    Args:
+        sweep_id (str): ID of the sweep to serve, the most recent sweep is used if not provided.
+        address (str): Address to listen on, `host:port` or `unix:/path/to/socket`.
 
+    """
+    sweep = determine_sweep(sweep_id)
+    config = SweepConfig.from_sweep(sweep)
+    runstate = SweepState(sweep_id=sweep.info.run_id)
+    coordinator = SlotCoordinator(sweep.info.run_id, config.run_cap, agent_id="controller")
+    serve(SweepSampler(config, runstate, coordinator, open_queue(sweep, "controller")), runstate, address)
+
+
+def open_queue(sweep: Run, agent_id: str) -> ProposalQueue | None:
+    """The proposal queue of a sweep initialized with `--queue`, None for other sweeps."""
+    if sweep.data.tags.get(QUEUE_TAG) != "True":
+        return None
+    queue = ProposalQueue(sweep.info.run_id, agent_id=agent_id)
+    if not queue.exists():
+        raise ValueError(
+            f"Proposal queue of sweep {sweep.info.run_id} not found in {queue.path}, agents on other hosts than the "
+            f"one that initialized the sweep need to share the database through {COORDINATOR_DB_ENV}"
+        )
+    return queue
+
+
+def finalize_command(
+    sweep_id: str = "",
+    n_estimators: int = 100,
+    n_repeats: int = 30,
+    n_jobs: int = -1,
+    max_rows: int | None = None,
+    time_budget: float | None = None,
+    method: str = "forest",
+    force: bool = False,
+    large_sweep_threshold: int | None = None,
+) -> None:
+    """Finalize a sweep.
+
+    The state of the last finalize is stored on the sweep run, including the finished runs it processed. Only the runs
+    that ended since and the runs that are still active are fetched. If none of the finished runs is new and the
+    settings are the same, nothing is recomputed unless `force` is set. Otherwise the report is redrawn, and the
+    parameter importance is refit only if runs with the metric were added or its settings changed. Sweeps with more
+    runs than `large_sweep_threshold` are plotted with WebGL and a lane-packed timeline. The remaining options control
+    the parameter importance analysis, see `calculate_feature_importance_with_settings`.
+    """
+    # The analysis stack is only needed here, importing it lazily keeps the startup of the other commands fast
+    import numpy as np
+    import pandas as pd
+
+    from mlflow_sweep.plotting import (
+        LARGE_SWEEP_THRESHOLD,
+        plot_metric_vs_time,
+        plot_parameter_importance_and_correlation,
+        plot_trial_timeline,
+        render_report,
+    )
+    from mlflow_sweep.utils import (
+        calculate_feature_importance_with_settings,
+        current_time_convert,
+        describe_importance_settings,
+    )
 
-def finalize_command(sweep_id: str = "") -> None:
-    """Finalize a sweep."""
     sweep = determine_sweep(sweep_id)
     config = SweepConfig.from_sweep(sweep)
+    metric = config.metric
     runstate = SweepState(sweep_id=sweep.info.run_id)
-    all_runs = runstate.get_all()
+
+    if large_sweep_threshold is None:
+        large_sweep_threshold = LARGE_SWEEP_THRESHOLD
+    importance_settings = {
+        "n_estimators": n_estimators,
+        "n_repeats": n_repeats,
+        "n_jobs": n_jobs,
+        "max_rows": max_rows,
+        "time_budget": time_budget,
+        "method": method,
+    }
+    settings = {**importance_settings, "large_sweep_threshold": large_sweep_threshold}
+    state = FinalizeState() if force else FinalizeState.load(sweep)
+    finished_since = runstate.get_finished_since(state.watermark)
+    if state.is_current(finished_since, settings):
+        rprint("[bold green]No runs have finished since the last finalize, nothing to update.[/bold green]")
+        return
+    new_runs = state.update(finished_since, metric)
+
+    # Finished runs are kept in the state, only the runs that are still active are fetched on every finalize
+    columns = ["run", "status", "start_time", "end_time", *([metric.name] if metric is not None else [])]
+    rows = state.runs + [FinalizeState.row(run, metric) for run in runstate.get_active()]
+    runs = pd.DataFrame(rows, columns=[*columns, *config.parameters])
+    runs["end_time"] = runs["end_time"].astype("Int64")
+    rprint(f"[bold blue]Finalizing {len(new_runs)} newly finished runs, {len(state.runs)} in total[/bold blue]")
 
     mlflow.set_experiment(experiment_id=sweep.info.experiment_id)
     mlflow.start_run(run_id=sweep.info.run_id)
 
+    now = int(time.time() * 1000)
     data = pd.DataFrame(
         {
-            "start": [current_time_convert(run.start_time) for run in all_runs],
-            "end": [current_time_convert(run.end_time) for run in all_runs],
-            "run": [run.id for run in all_runs],
-            "status": [run.state for run in all_runs],
+            "start": runs["start_time"].map(current_time_convert),
+            "end": runs["end_time"].fillna(now).map(current_time_convert),  # running runs end now
+            "run": runs["run"],
+            "status": runs["status"],
         }
     )
     data.sort_values(by="start", inplace=True)
-    fig = plot_trial_timeline(df=data)
-    fig.write_html("run_timeline.html")
-    mlflow.log_artifact("run_timeline.html")
-    Path("run_timeline.html").unlink(missing_ok=True)
-
-    if config.metric is not None:
-        metric_values = np.array([run.summary_metrics.get(config.metric.name) for run in all_runs])
-        parameter_values = {
-            param_name: np.array([run.config[param_name]["value"] for run in all_runs])
-            for param_name in config.parameters
-        }
-
-        features = calculate_feature_importance_and_correlation(metric_values, parameter_values)
+    # The figures are rendered into a single report in memory, which is uploaded once finalize is done
+    figures = {"Run timeline": plot_trial_timeline(df=data, large_sweep_threshold=large_sweep_threshold)}
+    notes = [f"{len(state.runs)} of {len(rows)} runs have finished."]
+
+    # Only finished runs that reported the metric can be analyzed
+    scored = [row for row in state.runs if row.get(metric.name) is not None] if metric is not None else []
+    if metric is not None and state.statistics.count > 0:
+        statistics = state.statistics
+        summary = (
+            f"best {statistics.best:.4f} ({statistics.best_run}), "
+            f"mean {statistics.mean:.4f} ± {statistics.std:.4f} over {statistics.count} runs"
+        )
+        rprint(f"[bold blue]{metric.name}:[/bold blue] {summary}")
+        notes.append(f"{metric.name}: {summary}")
+
+    if metric is not None and len(scored) > 1:
+        metric_values = np.array([row[metric.name] for row in scored])
+        # The importance is only refit if runs with the metric were added or the analysis is configured differently
+        refit = (
+            not state.importance
+            or any(state.settings.get(key) != value for key, value in importance_settings.items())
+            or any(run.summary_metrics.get(metric.name) is not None for run in new_runs)
+        )
+        if refit:
+            parameter_values = {
+                param_name: np.array([row.get(param_name) for row in scored]) for param_name in config.parameters
+            }
+            features, importance = calculate_feature_importance_with_settings(
+                metric_values,
+                parameter_values,
+                n_estimators=n_estimators,
+                n_repeats=n_repeats,
+                n_jobs=n_jobs,
+                max_rows=max_rows,
+                time_budget=time_budget,
+                method=method,
+            )
+            state.importance = {"settings": importance, "parameters": features}
+            mlflow.log_dict(state.importance, "parameter_importance.json")
+        else:
+            rprint("[bold blue]No runs with the metric were added, the parameter importance is unchanged.[/bold blue]")
+            features, importance = state.importance["parameters"], state.importance["settings"]
 
         # Create the table
-        table = Table(title=f"Feature Importance and Correlation for {config.metric.name}", show_lines=True)
+        caption = describe_importance_settings(importance)
+        notes.append(f"Parameter importance: {caption}")
+        table = Table(
+            title=f"Feature Importance and Correlation for {metric.name}",
+            caption=caption,
+            show_lines=True,
+        )
 
         # Add columns
         table.add_column("Parameter", style="bold magenta")
@@ -147,15 +313,10 @@ def finalize_command(sweep_id: str = "") -> None:
         table.add_column("Pearson", justify="right")
         table.add_column("Spearman", justify="right")
 
-        # Add rows
+        # Add rows, scores that were not calculated are None
         for param, stats in features.items():
-            table.add_row(
-                param,
-                f"{stats['importance']:.4f}",
-                f"{stats['permutation_importance']:.4f}",
-                f"{stats['pearson']:.4f}",
-                f"{stats['spearman']:.4f}",
-            )
+            scores = (stats[key] for key in ("importance", "permutation_importance", "pearson", "spearman"))
+            table.add_row(param, *(f"{score:.4f}" if score is not None else "-" for score in scores))
 
         # Print using rich console
         console = Console()
@@ -163,17 +324,27 @@ def finalize_command(sweep_id: str = "") -> None:
 
         data = pd.DataFrame(
             {
-                "created": [current_time_convert(run.start_time) for run in all_runs],
-                config.metric.name: [run.summary_metrics.get(config.metric.name) for run in all_runs],
+                "created": [current_time_convert(row["start_time"]) for row in scored],
+                metric.name: metric_values,
             }
         )
 
-        fig = plot_metric_vs_time(data, time_col="created", metric_col=config.metric.name)
-        fig.write_html("metric_vs_time.html")
-        mlflow.log_artifact("metric_vs_time.html")
-        Path("metric_vs_time.html").unlink(missing_ok=True)
+        figures[f"{metric.name} over time"] = plot_metric_vs_time(
+            data, time_col="created", metric_col=metric.name, large_sweep_threshold=large_sweep_threshold
+        )
+        figures["Parameter importance and correlation"] = plot_parameter_importance_and_correlation(
+            features, metric_name=metric.name
+        )
+    elif metric is not None:
+        rprint(
+            "[bold yellow]At least two finished runs with the metric are needed to analyze parameters.[/bold yellow]"
+        )
+
+    report = render_report(figures, title=f"Sweep report: {config.sweep_name}", notes=notes)
+    mlflow.log_text(report, REPORT_ARTIFACT)
+
+    # The plots of large sweeps are aggregated, so the data behind them is exported next to the report without loss
+    mlflow.log_text(runs.to_csv(index=False), RUNS_ARTIFACT)
 
-        fig = plot_parameter_importance_and_correlation(features, metric_name=config.metric.name)
-        fig.write_html("parameter_importance_and_correlation.html")
-        mlflow.log_artifact("parameter_importance_and_correlation.html")
-        Path("parameter_importance_and_correlation.html").unlink(missing_ok=True)
+    state.settings = settings
+    mlflow.log_dict(state.model_dump(), FinalizeState.ARTIFACT)
@@ -0,0 +1,320 @@
+import asyncio
+import json
+import socket
+import sqlite3
+import time
+from typing import NamedTuple
+
+from mlflow.exceptions import MlflowException
+from rich import print as rprint
+
+from mlflow_sweep.sampler import SweepSampler
+from mlflow_sweep.sweepstate import SweepState
+
+# Seconds the controller waits for more `next` requests, such that they are served by a single proposal batch
+BATCH_WINDOW = 0.05
+
+# Prefix of addresses that refer to a Unix socket instead of a TCP host and port
+UNIX_PREFIX = "unix:"
+
+# Errors of a request that are returned to the agent, e.g. malformed requests or failures of the tracking server
+REQUEST_ERRORS = (KeyError, TypeError, ValueError, RuntimeError, OSError, sqlite3.Error, MlflowException)
+
+
+class RemoteRun(NamedTuple):
+    """A running trial that the controller proposes to stop, identified like an `ExtendedSweepRun`."""
+
+    id: str
+    sweep_run_id: str
+
+
+def parse_address(address: str) -> tuple[str, int] | str:
+    """Parse the address of a controller, either `host:port` or `unix:/path/to/socket`.
+
+    Examples:
+        >>> parse_address("127.0.0.1:5005")
+        ('127.0.0.1', 5005)
+        >>> parse_address("unix:/tmp/sweep.sock")
+        '/tmp/sweep.sock'
+    """
+    if address.startswith(UNIX_PREFIX):
+        return address.removeprefix(UNIX_PREFIX)
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid controller address {address!r}, expected host:port or unix:/path/to/socket")
+    return host, int(port)
+
+
+class SweepController:
+    """Service that proposes trials for many agents from a single in-memory sweep state.
+
+    Agents connect over TCP or a Unix socket and exchange one JSON object per line. The controller holds the only
+    `SweepSampler` and `SweepState` of the sweep, such that the tracking server is polled once per proposal batch
+    instead of once per agent:
+
+    - `hello` returns the sweep ID, the interval at which agents should ask for trials to stop, the timeout of the
+      trials and the parameter overriding it per trial.
+    - `next` returns up to `k` proposals. Requests arriving within `batch_window` seconds are served from one batch,
+      and the proposals are recorded in the ledger before they are returned.
+    - `stops` returns the running trials to terminate early, computed at most once per `stop_interval` seconds.
+    - `release` gives back the slots of proposals that an agent failed to launch, see `SweepSampler.release`.
+    - `heartbeat`, `leave`, `reclaim` and `requeue` forward the heartbeats of agents and the reclamation of the
+      trials of dead agents to the sweep state and the sampler, see `TrialExecutor.heartbeat`.
+    - `report` records events of trials, a trial reported as pruned is marked as such on its MLflow run and a
+      completed trial is passed on to `SweepSampler.complete`.
+
+    Calls to the sampler and the sweep state are serialized and run in a worker thread, such that the event loop keeps
+    accepting requests while MLflow is queried.
+
+    Args:
+        sampler: The sampler proposing new trials.
+        sweepstate: The state of the sweep, shared with the sampler.
+        batch_window: Seconds to collect `next` requests before proposing a batch.
+        stop_interval: Minimum seconds between computations of the trials to stop, the interval of the early
+            termination config if not provided.
+
+    """
+
+    def __init__(
+        self,
+        sampler: SweepSampler,
+        sweepstate: SweepState,
+        batch_window: float = BATCH_WINDOW,
+        stop_interval: float | None = None,
+    ) -> None:
+        early_terminate = sampler.config.early_terminate
+        self.sampler = sampler
+        self.sweepstate = sweepstate
+        self.batch_window = batch_window
+        self.prune_interval = early_terminate.check_interval if early_terminate is not None else None
+        self.trial_timeout = sampler.config.timeout
+        self.timeout_parameter = sampler.config.timeout_parameter
+        self.stop_interval = stop_interval if stop_interval is not None else (self.prune_interval or 0.0)
+        self._lock = asyncio.Lock()
+        self._batch: asyncio.Task | None = None
+        self._requested = 0
+        self._stops: list[RemoteRun] = []
+        self._stops_at = float("-inf")
+
+    async def start(self, address: str) -> asyncio.AbstractServer:
+        """Start serving on an address, see `parse_address`."""
+        parsed = parse_address(address)
+        if isinstance(parsed, str):
+            return await asyncio.start_unix_server(self.handle_connection, path=parsed)
+        return await asyncio.start_server(self.handle_connection, *parsed)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer the requests of one agent until it disconnects."""
+        try:
+            while line := await reader.readline():
+                try:
+                    response = {"ok": True, **await self.dispatch(json.loads(line))}
+                except REQUEST_ERRORS as e:
+                    # Errors are returned to the agent instead of closing its connection
+                    response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def dispatch(self, request: dict) -> dict:
+        """Handle a single request."""
+        op = request.get("op")
+        if op == "hello":
+            return {
+                "sweep_id": self.sweepstate.sweep_id,
+                "prune_interval": self.prune_interval,
+                "trial_timeout": self.trial_timeout,
+                "timeout_parameter": self.timeout_parameter,
+            }
+        if op == "next":
+            return {"proposals": await self.next(int(request.get("k", 1)))}
+        if op == "stops":
+            return {"runs": [run._asdict() for run in await self.stops()]}
+        if op == "heartbeat":
+            async with self._lock:
+                await asyncio.to_thread(self.sweepstate.heartbeat, request["agent_id"])
+            return {}
+        if op == "leave":
+            async with self._lock:
+                await asyncio.to_thread(self.sweepstate.remove_heartbeat, request["agent_id"])
+            return {}
+        if op == "reclaim":
+            async with self._lock:
+                proposals = await asyncio.to_thread(
+                    self.sweepstate.reclaim_stale, request["timeout"], request.get("agent_id")
+                )
+            return {"proposals": proposals}
+        if op == "requeue":
+            async with self._lock:
+                self.sampler.requeue(request["proposal"])
+            return {}
+        if op == "release":
+            async with self._lock:
+                await asyncio.to_thread(self.sampler.release, request["proposals"])
+            return {}
+        if op == "report":
+            await self.report(request["event"], **{k: v for k, v in request.items() if k not in ("op", "event")})
+            return {}
+        raise ValueError(f"Unknown operation {op!r}")
+
+    async def next(self, k: int) -> list[list]:
+        """Wait for the proposals of a request, collected with the other requests of the same batch window.
+
+        Each request is served the slice of the batch at the offset it was requested at. If the sampler fails, every
+        request of the batch fails with its error.
+        """
+        if self._batch is None:
+            self._batch = asyncio.create_task(self._propose_requested())
+        batch, offset = self._batch, self._requested
+        self._requested += k
+        # Shielded, such that an agent disconnecting does not cancel the batch of the other agents
+        proposals = await asyncio.shield(batch)
+        return proposals[offset : offset + k]
+
+    async def _propose_requested(self) -> list[list]:
+        await asyncio.sleep(self.batch_window)
+        async with self._lock:
+            k, self._requested, self._batch = self._requested, 0, None
+            return await asyncio.to_thread(self._propose, k)
+
+    def _propose(self, k: int) -> list[list]:
+        proposals = self.sampler.propose_batch(k)
+        for i, (_, proposal) in enumerate(proposals):
+            try:
+                self.sweepstate.ledger.append(proposal)
+            except BaseException:
+                self.sampler.release([p for _, p in proposals[i:]])
+                raise
+        return [list(proposal) for proposal in proposals]
+
+    async def stops(self) -> list[RemoteRun]:
+        """The running trials to terminate early, shared by all agents asking within the stop interval."""
+        async with self._lock:
+            if time.monotonic() - self._stops_at >= self.stop_interval:
+                runs = await asyncio.to_thread(self.sampler.propose_stops)
+                self._stops = [RemoteRun(run.id, run.sweep_run_id) for run in runs]
+                self._stops_at = time.monotonic()
+            return self._stops
+
+    async def report(self, event: str, **fields) -> None:
+        """Record an event of a trial.
+
+        Events are `launched` with the `sweep_run_id` and `agent_id` of the trial, `pruned` with its MLflow `run_id`,
+        `timeout` with its `sweep_run_id`, or `completed` with its `proposal` and final `status`.
+        """
+        if event == "launched":
+            rprint(f"Trial {fields['sweep_run_id']} launched by agent {fields.get('agent_id')}")
+        elif event == "pruned":
+            async with self._lock:
+                await asyncio.to_thread(self.sweepstate.mark_pruned, fields["run_id"])
+        elif event == "timeout":
+            async with self._lock:
+                await asyncio.to_thread(self.sweepstate.mark_timed_out, fields["sweep_run_id"])
+        elif event == "completed":
+            async with self._lock:
+                await asyncio.to_thread(self.sampler.complete, fields["proposal"], fields["status"])
+        else:
+            raise ValueError(f"Unknown event {event!r}")
+
+
+class ControllerClient:
+    """Thin agent side of a `SweepController`, used by the executor in place of a `SweepSampler`.
+
+    Args:
+        address: Address of the controller, see `parse_address`.
+        agent_id: ID of the agent, reported with the trials it launches.
+        timeout: Seconds to wait for a response of the controller.
+
+    """
+
+    def __init__(self, address: str, agent_id: str | None = None, timeout: float = 600.0) -> None:
+        self.agent_id = agent_id
+        parsed = parse_address(address)
+        if isinstance(parsed, str):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(timeout)
+            self.socket.connect(parsed)
+        else:
+            self.socket = socket.create_connection(parsed, timeout=timeout)
+        self.file = self.socket.makefile("rwb")
+        info = self.call("hello")
+        self.sweep_id: str = info["sweep_id"]
+        self.prune_interval: float | None = info["prune_interval"]
+        self.trial_timeout: float | None = info["trial_timeout"]
+        self.timeout_parameter: str | None = info["timeout_parameter"]
+
+    def call(self, op: str, **kwargs) -> dict:
+        """Send a request to the controller and return its response."""
+        self.file.write(json.dumps({"op": op, **kwargs}).encode() + b"\n")
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("The sweep controller closed the connection")
+        response = json.loads(line)
+        if not response.pop("ok"):
+            raise RuntimeError(f"Sweep controller failed to handle {op!r}: {response['error']}")
+        return response
+
+    def close(self) -> None:
+        self.file.close()
+        self.socket.close()
+
+    def propose_batch(self, k: int) -> list[tuple[str | list[str], dict]]:
+        """Request up to k proposals, see `SweepSampler.propose_batch`."""
+        return [(command, proposal) for command, proposal in self.call("next", k=k)["proposals"]]
+
+    def propose_stops(self) -> list[RemoteRun]:
+        """Request the running trials to terminate early, see `SweepSampler.propose_stops`."""
+        return [RemoteRun(run["id"], run["sweep_run_id"]) for run in self.call("stops")["runs"]]
+
+    def mark_pruned(self, run_id: str) -> None:
+        """Report a trial that was terminated early, see `SweepState.mark_pruned`."""
+        self.call("report", event="pruned", run_id=run_id)
+
+    def mark_timed_out(self, sweep_run_id: str) -> None:
+        """Report a trial that exceeded its timeout, see `SweepState.mark_timed_out`."""
+        self.call("report", event="timeout", sweep_run_id=sweep_run_id)
+
+    def heartbeat(self, agent_id: str) -> None:
+        """Publish a heartbeat of this agent, see `SweepState.heartbeat`."""
+        self.call("heartbeat", agent_id=agent_id)
+
+    def remove_heartbeat(self, agent_id: str) -> None:
+        """Remove the heartbeat of this agent, see `SweepState.remove_heartbeat`."""
+        self.call("leave", agent_id=agent_id)
+
+    def reclaim_stale(self, timeout: float, agent_id: str | None = None) -> list[dict]:
+        """Reclaim the trials of dead agents, see `SweepState.reclaim_stale`."""
+        return self.call("reclaim", timeout=timeout, agent_id=agent_id)["proposals"]
+
+    def requeue(self, proposal: dict) -> None:
+        """Propose a reclaimed trial again, see `SweepSampler.requeue`."""
+        self.call("requeue", proposal=proposal)
+
+    def release(self, proposals: list[dict]) -> None:
+        """Give back the slots of proposals that were not launched, see `SweepSampler.release`."""
+        self.call("release", proposals=proposals)
+
+    def record_launch(self, proposal: dict) -> None:
+        """Report that the trial of a proposal was launched.
+
+        Proposals are recorded in the ledger by the controller when they are handed out, launches are only reported.
+        """
+        self.call("report", event="launched", sweep_run_id=proposal["sweep_run_id"], agent_id=self.agent_id)
+
+    def complete(self, proposal: dict, status: str) -> None:
+        """Report the final status of a trial, see `SweepSampler.complete`."""
+        self.call("report", event="completed", proposal=proposal, status=status)
+
+
+def serve(sampler: SweepSampler, sweepstate: SweepState, address: str) -> None:
+    """Run a controller on an address until interrupted."""
+
+    async def main() -> None:
+        server = await SweepController(sampler, sweepstate).start(address)
+        rprint(f"[bold green]Sweep controller of {sweepstate.sweep_id} listening on {address}[/bold green]")
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
@@ -0,0 +1,157 @@
+import itertools
+import os
+import sqlite3
+import time
+from collections.abc import Iterable
+from contextlib import closing
+from pathlib import Path
+
+from mlflow_sweep.artifacts import get_cache_dir
+
+# Environment variable to override the SQLite database used to coordinate the agents of a sweep
+COORDINATOR_DB_ENV = "MLFLOW_SWEEP_COORDINATOR_DB"
+
+# Seconds to wait for the lock of another agent before giving up
+LOCK_TIMEOUT = 30.0
+
+# Seconds after which a reserved slot whose trial was not recorded in the ledger is handed out again
+RESERVATION_TIMEOUT = 600.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS slots (
+    sweep_id TEXT NOT NULL,
+    run INTEGER NOT NULL,
+    agent_id TEXT,
+    reserved_at REAL NOT NULL,
+    used INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (sweep_id, run)
+)
+"""
+
+
+def get_coordinator_path() -> Path:
+    """Location of the coordinator database, in the artifact cache unless overridden by MLFLOW_SWEEP_COORDINATOR_DB."""
+    return Path(os.environ.get(COORDINATOR_DB_ENV, get_cache_dir() / "coordinator.db"))
+
+
+class SlotCoordinator:
+    """Hand out numbered trial slots of a sweep atomically to all agents sharing a SQLite database.
+
+    Every trial needs a slot before it is proposed. Slots are reserved in a single write transaction, such that agents
+    running at the same time never receive the same run number and never reserve more slots than the run cap in total.
+    Agents on one host share the database in the local cache, agents on several hosts can point
+    MLFLOW_SWEEP_COORDINATOR_DB to a database on storage that supports file locking.
+
+    Agents that do not share the database only see the trials of each other through the proposal ledger. The run
+    numbers recorded there are passed to `reserve` and are never handed out again, such that such agents skip the
+    trials that other agents already launched. A slot that is not recorded in the ledger within `reservation_timeout`
+    seconds was reserved by an agent that stopped before launching its trial, and is handed out again.
+
+    Args:
+        sweep_id: The ID of the parent sweep run.
+        run_cap: Maximum number of slots of the sweep.
+        agent_id: ID of the agent, recorded with its reservations.
+        path: Path of the database, see `get_coordinator_path` if not provided.
+        reservation_timeout: Seconds after which a slot whose run number is not used in the ledger expires.
+
+    Examples:
+        >>> import tempfile
+        >>> coordinator = SlotCoordinator("sweep", run_cap=3, path=Path(tempfile.mkdtemp()) / "coordinator.db")
+        >>> coordinator.reserve(2)
+        [1, 2]
+        >>> coordinator.reserve(2)
+        [3]
+        >>> coordinator.reserve(1)
+        []
+        >>> coordinator.release([2])
+        >>> coordinator.reserve(2)
+        [2]
+        >>> other = SlotCoordinator("sweep", run_cap=3, path=Path(tempfile.mkdtemp()) / "coordinator.db")
+        >>> other.reserve(2, used=[1, 3])
+        [2]
+    """
+
+    def __init__(
+        self,
+        sweep_id: str,
+        run_cap: int,
+        agent_id: str | None = None,
+        path: Path | None = None,
+        reservation_timeout: float = RESERVATION_TIMEOUT,
+    ) -> None:
+        self.sweep_id = sweep_id
+        self.run_cap = run_cap
+        self.agent_id = agent_id
+        self.reservation_timeout = reservation_timeout
+        self.path = Path(path) if path is not None else get_coordinator_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.execute(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Transactions are managed explicitly, such that a reservation holds the write lock from read to insert
+        return sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, isolation_level=None)
+
+    def reserve(self, k: int, used: Iterable[int] = ()) -> list[int]:
+        """Reserve up to k slots, numbered with the lowest run numbers that are neither reserved nor used.
+
+        Run numbers of released or expired slots are handed out again, such that a slot that was given back after a
+        failed proposal is still proposed in the sweep.
+
+        Args:
+            k: Number of slots to reserve.
+            used: Run numbers of the trials recorded in the proposal ledger, including those proposed by agents with
+                another database or before the coordinator was introduced. They count towards the run cap and their
+                slots never expire.
+
+        Returns:
+            The run numbers of the reserved slots in ascending order, fewer than k if the run cap is reached.
+
+        """
+        used = set(used)
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")  # take the write lock before reading, so no other agent interleaves
+            try:
+                connection.executemany(
+                    "INSERT INTO slots (sweep_id, run, agent_id, reserved_at, used) VALUES (?, ?, NULL, ?, 1) "
+                    "ON CONFLICT (sweep_id, run) DO UPDATE SET used = 1",
+                    [(self.sweep_id, run, time.time()) for run in sorted(used)],
+                )
+                connection.execute(
+                    "DELETE FROM slots WHERE sweep_id = ? AND used = 0 AND reserved_at < ?",
+                    (self.sweep_id, time.time() - self.reservation_timeout),
+                )
+                taken = {
+                    run for (run,) in connection.execute("SELECT run FROM slots WHERE sweep_id = ?", (self.sweep_id,))
+                }
+                n = max(min(k, self.run_cap - len(taken)), 0)
+                runs = list(itertools.islice((run for run in itertools.count(1) if run not in taken), n))
+                self._insert(connection, runs)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return runs
+
+    def _insert(self, connection: sqlite3.Connection, runs: list[int]) -> None:
+        connection.executemany(
+            "INSERT INTO slots (sweep_id, run, agent_id, reserved_at) VALUES (?, ?, ?, ?)",
+            [(self.sweep_id, run, self.agent_id, time.time()) for run in runs],
+        )
+
+    def release(self, runs: list[int]) -> None:
+        """Give back reserved slots that were not used, such that they no longer count towards the run cap.
+
+        Released run numbers were never used by a launched trial, and are handed out again by the next reservation.
+        """
+        if not runs:
+            return
+        with closing(self._connect()) as connection:
+            connection.executemany(
+                "DELETE FROM slots WHERE sweep_id = ? AND run = ?", [(self.sweep_id, run) for run in runs]
+            )
+
+    def reserved(self) -> int:
+        """Number of slots reserved in the sweep."""
+        with closing(self._connect()) as connection:
+            return connection.execute("SELECT COUNT(*) FROM slots WHERE sweep_id = ?", (self.sweep_id,)).fetchone()[0]
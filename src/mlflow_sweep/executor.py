@@ -0,0 +1,327 @@
+import contextlib
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import time
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from typing import Protocol
+
+from rich import print as rprint
+
+# Seconds a terminated trial is given to shut down before it is killed
+KILL_TIMEOUT = 10.0
+
+# Seconds between heartbeats of an agent
+HEARTBEAT_INTERVAL = 30.0
+
+# Seconds without a heartbeat after which the trials of an agent are reclaimed
+STALE_TIMEOUT = 300.0
+
+
+class RunToStop(Protocol):
+    """A running trial that the sampler proposes to stop, identified by its MLflow run and sweep run IDs."""
+
+    @property
+    def id(self) -> str: ...
+
+    @property
+    def sweep_run_id(self) -> str: ...
+
+
+class TrialSource(Protocol):
+    """What the executor needs from the sweep, implemented by `SweepSampler` and by `ControllerClient`."""
+
+    def propose_batch(self, k: int) -> list[tuple[str | list[str], dict]]: ...
+
+    def release(self, proposals: list[dict]) -> None: ...
+
+    def requeue(self, proposal: dict) -> None: ...
+
+    def record_launch(self, proposal: dict) -> None: ...
+
+    def complete(self, proposal: dict, status: str) -> None: ...
+
+    def propose_stops(self) -> Sequence[RunToStop]: ...
+
+    def mark_pruned(self, run_id: str) -> None: ...
+
+    def mark_timed_out(self, sweep_run_id: str) -> None: ...
+
+    def heartbeat(self, agent_id: str) -> None: ...
+
+    def remove_heartbeat(self, agent_id: str) -> None: ...
+
+    def reclaim_stale(self, timeout: float, agent_id: str | None = None) -> list[dict]: ...
+
+
+@dataclass
+class Trial:
+    """A trial subprocess launched by the executor.
+
+    Attributes:
+        command (str | list[str]): The command that was executed, an argument list if run without a shell.
+        proposal (dict): The proposed parameters of the trial.
+        process (subprocess.Popen): The running trial process.
+        started (float): Monotonic time at which the trial was launched.
+        pruned_at (float | None): Monotonic time at which the trial was terminated early, if it was.
+        timeout (float | None): Wall-clock seconds after which the trial is terminated, None for no limit.
+        timed_out_at (float | None): Monotonic time at which the trial was terminated for exceeding its timeout.
+        run_id (str | None): MLflow run ID of the trial, known once it has been terminated early.
+    """
+
+    command: str | list[str]
+    proposal: dict
+    process: subprocess.Popen
+    started: float = field(default_factory=time.monotonic)
+    pruned_at: float | None = None
+    timeout: float | None = None
+    timed_out_at: float | None = None
+    run_id: str | None = None
+
+    @property
+    def sweep_run_id(self) -> str:
+        return self.proposal["sweep_run_id"]
+
+    @property
+    def terminated_at(self) -> float | None:
+        """Monotonic time at which the trial was asked to shut down, if it was."""
+        return self.pruned_at if self.pruned_at is not None else self.timed_out_at
+
+
+class TrialExecutor:
+    """Run trials of a sweep in a pool of local subprocess slots.
+
+    The executor keeps up to `parallel` trials in flight. Whenever slots free up, new proposals for all of them are
+    requested from the sampler in one batch, and all slots share the sampler and its sweep state. If a trial
+    fails, no further trials are launched and the failure is raised once the trials still in flight have finished.
+
+    If early termination is enabled, the sampler is asked every `prune_interval` seconds which running trials should
+    be stopped. Each trial runs in its own process group, such that terminating a trial also stops the processes it
+    started on POSIX systems. Terminated trials are recorded as pruned runs instead of failures. In the same way,
+    trials running for longer than `timeout` seconds are terminated and recorded as killed runs, and the agent moves
+    on. If `timeout_parameter` is given, the value of that parameter in the proposal of a trial is its timeout instead.
+
+    If the executor has an agent ID, it publishes a heartbeat every `heartbeat_interval` seconds. Trials of agents
+    whose last heartbeat is older than `stale_timeout` are reclaimed and proposed again, such that trials of agents
+    that crashed or were preempted do not keep counting towards the run cap. Once no trials are left in flight, the
+    heartbeat of the agent is removed again, such that heartbeats do not pile up over the lifetime of a sweep.
+
+    Args:
+        sampler (TrialSource): The sampler proposing new trials and recording their outcome, a `SweepSampler` or a
+            `ControllerClient`.
+        env (dict): Environment of the trial processes, `SWEEP_RUN_ID` is set per trial.
+        parallel (int): Number of trials to run at the same time.
+        poll_interval (float): Maximum time in seconds between checks of the running trials.
+        prune_interval (float | None): Seconds between checks for trials to terminate early, None to disable.
+        kill_timeout (float): Seconds a terminated trial is given to shut down before it is killed.
+        agent_id (str | None): ID of the agent publishing heartbeats, None to disable heartbeats.
+        heartbeat_interval (float): Seconds between heartbeats.
+        stale_timeout (float): Seconds without a heartbeat after which the trials of an agent are reclaimed.
+        timeout (float | None): Wall-clock seconds after which a trial is terminated, None for no limit.
+        timeout_parameter (str | None): Parameter whose value is the timeout of each trial, overriding `timeout`.
+    """
+
+    def __init__(
+        self,
+        sampler: TrialSource,
+        env: dict[str, str],
+        parallel: int = 1,
+        poll_interval: float = 1.0,
+        prune_interval: float | None = None,
+        kill_timeout: float = KILL_TIMEOUT,
+        agent_id: str | None = None,
+        heartbeat_interval: float = HEARTBEAT_INTERVAL,
+        stale_timeout: float = STALE_TIMEOUT,
+        timeout: float | None = None,
+        timeout_parameter: str | None = None,
+    ) -> None:
+        if parallel < 1:
+            raise ValueError(f"Number of parallel trials must be at least 1, got {parallel}")
+        self.sampler = sampler
+        self.env = env
+        self.parallel = parallel
+        self.poll_interval = poll_interval
+        self.prune_interval = prune_interval
+        self.kill_timeout = kill_timeout
+        self.agent_id = agent_id
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_timeout = stale_timeout
+        self.timeout = timeout
+        self.timeout_parameter = timeout_parameter
+        self.last_prune = time.monotonic()
+        self.last_heartbeat = float("-inf")
+        self.trials: dict[str, Trial] = {}
+        self.exhausted = False
+        self.failure: subprocess.CalledProcessError | None = None
+
+    def run(self) -> None:
+        """Run trials until the sampler is exhausted, then wait for the trials in flight."""
+        try:
+            self._run()
+        finally:
+            if self.agent_id is not None and self.last_heartbeat > float("-inf") and not self.trials:
+                # Trials still in flight are reclaimed by the other agents once the heartbeat is stale
+                self.sampler.remove_heartbeat(self.agent_id)
+        if self.failure is not None:
+            raise self.failure
+
+    def _run(self) -> None:
+        while True:
+            if self.agent_id is not None and time.monotonic() - self.last_heartbeat >= self.heartbeat_interval:
+                self.heartbeat()
+            free = self.parallel - len(self.trials)
+            if free > 0 and not self.exhausted and self.failure is None:
+                # Fill all free slots from a single snapshot of the sweep state
+                proposals = self.sampler.propose_batch(free)
+                for i, (command, proposal) in enumerate(proposals):
+                    try:
+                        self.launch(command, proposal)
+                    except BaseException:
+                        # Proposals that were not launched must not keep their slots
+                        self.sampler.release([p for _, p in proposals[i:]])
+                        raise
+                if len(proposals) < free:
+                    rprint("[bold red]No more runs can be proposed or run cap reached.[/bold red]")
+                    self.exhausted = True
+
+            if not self.trials:
+                break
+            for trial in self.wait():
+                self.finish(trial)
+            if self.prune_interval is not None and time.monotonic() - self.last_prune >= self.prune_interval:
+                self.prune()
+            self.expire()
+            self.kill_overdue()
+
+    def launch(self, command: str | list[str], proposal: dict) -> Trial:
+        """Record a proposal in the ledger and start its trial process.
+
+        Commands given as a string are run through the shell, argument lists are executed directly.
+        """
+        timeout = self.trial_timeout(proposal)
+        self.sampler.record_launch(proposal)
+        rprint(
+            f"[bold blue]Executed command:[/bold blue] \n[italic]"
+            f"{command if isinstance(command, str) else shlex.join(command)}[/italic]"
+        )
+        rprint(50 * "─")
+        env = self.env.copy()
+        env["SWEEP_RUN_ID"] = proposal["sweep_run_id"]
+        process = subprocess.Popen(command, shell=isinstance(command, str), env=env, **self.process_group_options())
+        trial = Trial(command=command, proposal=proposal, process=process, timeout=timeout)
+        self.trials[trial.sweep_run_id] = trial
+        return trial
+
+    def trial_timeout(self, proposal: dict) -> float | None:
+        """Timeout of the trial of a proposal, the value of the timeout parameter if it is set."""
+        if self.timeout_parameter is None or proposal.get(self.timeout_parameter) is None:
+            return self.timeout
+        timeout = float(proposal[self.timeout_parameter])
+        if timeout <= 0:
+            raise ValueError(f"Timeout parameter '{self.timeout_parameter}' must be positive, got {timeout}")
+        return timeout
+
+    def wait(self) -> list[Trial]:
+        """Wait until at least one trial has finished or the poll interval has passed.
+
+        Returns:
+            The trials that have finished.
+        """
+        oldest = next(iter(self.trials.values()))
+        with contextlib.suppress(subprocess.TimeoutExpired):
+            oldest.process.wait(timeout=self.poll_interval)
+        return [trial for trial in self.trials.values() if trial.process.poll() is not None]
+
+    def heartbeat(self) -> None:
+        """Publish a heartbeat and propose the trials of agents that stopped sending heartbeats again."""
+        self.last_heartbeat = time.monotonic()
+        self.sampler.heartbeat(self.agent_id)  # ty: ignore[invalid-argument-type]
+        reclaimed = self.sampler.reclaim_stale(self.stale_timeout, self.agent_id)
+        for proposal in reclaimed:
+            rprint(f"[bold yellow]Reclaimed trial {proposal.get('run')} of an agent without heartbeat[/bold yellow]")
+            self.sampler.requeue(proposal)
+        if reclaimed:
+            self.exhausted = False  # the reclaimed trials can be run even if the sampler was exhausted before
+
+    def prune(self) -> None:
+        """Terminate the trials of this executor that the sampler proposes to stop early.
+
+        Trials of other agents are left to their own agent.
+        """
+        self.last_prune = time.monotonic()
+        for run in self.sampler.propose_stops():
+            trial = self.trials.get(run.sweep_run_id)
+            if trial is None or trial.terminated_at is not None:
+                continue
+            rprint(f"[bold yellow]Terminating trial {trial.proposal.get('run')} early[/bold yellow]")
+            trial.run_id = run.id
+            trial.pruned_at = time.monotonic()
+            self.terminate(trial)
+
+    def expire(self) -> None:
+        """Terminate the trials that have been running for longer than their timeout."""
+        now = time.monotonic()
+        for trial in self.trials.values():
+            if trial.timeout is None or trial.terminated_at is not None or now - trial.started <= trial.timeout:
+                continue
+            rprint(f"[bold yellow]Terminating trial {trial.proposal.get('run')} after {trial.timeout}s[/bold yellow]")
+            trial.timed_out_at = now
+            self.terminate(trial)
+
+    def kill_overdue(self) -> None:
+        """Kill terminated trials that did not shut down within the kill timeout."""
+        now = time.monotonic()
+        for trial in self.trials.values():
+            if trial.terminated_at is not None and now - trial.terminated_at > self.kill_timeout:
+                self.kill(trial)
+
+    @staticmethod
+    def process_group_options() -> dict:
+        """Options of `subprocess.Popen` that start a trial in its own process group."""
+        if sys.platform == "win32":
+            return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+        # A new session makes the trial the leader of a process group, which can be terminated as a whole
+        return {"start_new_session": True}
+
+    @staticmethod
+    def terminate(trial: Trial) -> None:
+        """Ask a trial and the processes it started to shut down.
+
+        On Windows there are no process group signals, such that only the trial process itself is terminated.
+        """
+        if sys.platform == "win32":
+            trial.process.terminate()
+            return
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(trial.process.pid, signal.SIGTERM)
+
+    @staticmethod
+    def kill(trial: Trial) -> None:
+        """Kill a trial and the processes it started, see `terminate`."""
+        if sys.platform == "win32":
+            trial.process.kill()
+            return
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(trial.process.pid, signal.SIGKILL)
+
+    def finish(self, trial: Trial) -> None:
+        """Free the slot of a finished trial and record whether it failed, was terminated early or timed out."""
+        del self.trials[trial.sweep_run_id]
+        rprint(50 * "─")
+        if trial.pruned_at is not None:
+            self.sampler.mark_pruned(trial.run_id)
+            self.sampler.complete(trial.proposal, "pruned")
+            return
+        if trial.timed_out_at is not None:
+            # A hung trial is not a failure of the sweep, the agent moves on to the next proposal
+            self.sampler.mark_timed_out(trial.sweep_run_id)
+            self.sampler.complete(trial.proposal, "timeout")
+            return
+        returncode = trial.process.returncode
+        self.sampler.complete(trial.proposal, "finished" if returncode == 0 else "failed")
+        if returncode != 0 and self.failure is None:
+            rprint(f"[bold red]Trial {trial.proposal.get('run')} failed with exit code {returncode}[/bold red]")
+            self.failure = subprocess.CalledProcessError(returncode, trial.command)
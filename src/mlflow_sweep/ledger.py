@@ -0,0 +1,150 @@
+import contextlib
+import json
+from collections.abc import Iterable
+from pathlib import Path
+
+from mlflow import MlflowClient
+
+from mlflow_sweep.artifacts import load_text_artifact
+
+# Artifact directory on the parent sweep run holding one small record per proposal
+LEDGER_DIR = "proposals"
+
+# Table artifact that older versions rewrote on every proposal
+LEGACY_TABLE = "proposed_parameters.json"
+
+
+def _to_builtin(value):
+    """Convert numpy scalars and other non-JSON types to builtin python types."""
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+class ProposalLedger:
+    """Append-only ledger of the parameters proposed in a sweep.
+
+    Every proposal is written as its own small JSON artifact named after its sweep run id on the parent sweep run.
+    Appending is therefore O(1) and safe when several agents propose at the same time, and readers only load the
+    records they have not seen before. Records are read through the artifact repository of MLflow and cached
+    locally, since a record is never changed once written.
+
+    Args:
+        sweep_id: The ID of the parent sweep run.
+        client: The MLflow client to use, a new client is created if not provided.
+
+    """
+
+    def __init__(self, sweep_id: str, client: MlflowClient | None = None) -> None:
+        self.sweep_id = sweep_id
+        self.client = client or MlflowClient()
+        self._entries: dict[str, dict] = {}
+        self._artifact_uri: str | None = None
+        self._legacy_loaded = False
+
+    def append(self, proposal: dict) -> None:
+        """Record a proposal in the ledger.
+
+        Args:
+            proposal: The proposed parameters, must contain a unique `sweep_run_id`.
+
+        """
+        self.client.log_text(
+            run_id=self.sweep_id,
+            text=json.dumps(proposal, default=_to_builtin),
+            artifact_file=f"{LEDGER_DIR}/{proposal['sweep_run_id']}.json",
+        )
+        self._entries[proposal["sweep_run_id"]] = proposal
+
+    def read_new(self) -> list[dict]:
+        """Load the records that were appended since the last read.
+
+        The ledger directory is listed to discover records of other agents, records that were loaded before are not
+        downloaded again.
+
+        Returns:
+            The new proposals sorted by their run number.
+
+        """
+        new = self._read_legacy()
+        for artifact in self.client.list_artifacts(self.sweep_id, LEDGER_DIR):
+            sweep_run_id = Path(artifact.path).stem
+            if sweep_run_id in self._entries:
+                continue
+            new.append(
+                json.loads(load_text_artifact(self.sweep_id, artifact.path, self._get_artifact_uri(), cache=True))
+            )
+
+        for proposal in new:
+            self._entries[proposal["sweep_run_id"]] = proposal
+        return sorted(new, key=lambda p: p.get("run", 0))
+
+    def read(self, sweep_run_ids: Iterable[str]) -> list[dict]:
+        """Load the records of the given sweep run ids that have not been loaded yet.
+
+        The records are downloaded directly from their artifact path instead of listing the whole ledger, such that
+        looking up the proposals of newly seen child runs costs one request per run. Sweep run ids without a record,
+        e.g. of child runs that were not proposed by the sweep, are skipped.
+
+        Returns:
+            The new proposals sorted by their run number.
+
+        """
+        new = self._read_legacy()
+        for proposal in new:
+            self._entries[proposal["sweep_run_id"]] = proposal
+        for sweep_run_id in dict.fromkeys(sweep_run_ids):
+            if sweep_run_id in self._entries:
+                continue
+            # Artifact repositories raise different errors for missing files
+            with contextlib.suppress(Exception):
+                path = f"{LEDGER_DIR}/{sweep_run_id}.json"
+                self._entries[sweep_run_id] = json.loads(
+                    load_text_artifact(self.sweep_id, path, self._get_artifact_uri(), cache=True)
+                )
+                new.append(self._entries[sweep_run_id])
+        return sorted(new, key=lambda p: p.get("run", 0))
+
+    def read_all(self) -> list[dict]:
+        """Load all records in the ledger.
+
+        Returns:
+            All proposals sorted by their run number.
+
+        """
+        self.read_new()
+        return sorted(self._entries.values(), key=lambda p: p.get("run", 0))
+
+    def get(self, sweep_run_id: str) -> dict | None:
+        """Get a proposal that has already been loaded by its sweep run id."""
+        return self._entries.get(sweep_run_id)
+
+    def __iter__(self):
+        return iter(list(self._entries.values()))
+
+    def __contains__(self, sweep_run_id: str) -> bool:
+        return sweep_run_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get_artifact_uri(self) -> str:
+        """Artifact root of the parent sweep run."""
+        if self._artifact_uri is None:
+            self._artifact_uri = self.client.get_run(self.sweep_id).info.artifact_uri
+        return self._artifact_uri  # ty: ignore[invalid-return-type]
+
+    def _read_legacy(self) -> list[dict]:
+        """Records of the legacy table that were not loaded yet, the table is only read by the first read."""
+        if self._legacy_loaded:
+            return []
+        self._legacy_loaded = True
+        return [p for p in self._read_legacy_table() if p["sweep_run_id"] not in self._entries]
+
+    def _read_legacy_table(self) -> list[dict]:
+        """Read proposals from the table written by older versions of the sweep agent."""
+        if LEGACY_TABLE not in [a.path for a in self.client.list_artifacts(self.sweep_id)]:
+            return []
+        # The table was rewritten on every proposal, so it is not cached
+        table: dict = json.loads(load_text_artifact(self.sweep_id, LEGACY_TABLE, self._get_artifact_uri()))
+        return [dict(zip(table["columns"], row)) for row in table["data"]]
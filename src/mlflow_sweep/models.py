@@ -1,11 +1,20 @@
+import math
 import warnings
 from enum import Enum
-from pathlib import Path
+from typing import ClassVar, Literal
 
 import yaml
 from mlflow.entities import Run
+from mlflow.exceptions import MlflowException
 from mlflow.utils.name_utils import _generate_random_name
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, ValidationError
+from rich import print as rprint
+
+from mlflow_sweep.artifacts import load_text_artifact
+from mlflow_sweep.template import CommandTemplate, parameter_names
+
+# Status shown for runs that were terminated early
+RUN_STATUS_PRUNED = "pruned"
 
 with warnings.catch_warnings():
     # sweep dependency still uses V1 API of pydantic, so we need to ignore the warning about config keys
@@ -17,7 +26,9 @@ with warnings.catch_warnings():
 
         id: str
         start_time: int
-        end_time: int
+        end_time: int | None = None  # not set while the run is active
+        sweep_run_id: str | None = None  # ID assigned to the trial by the agent
+        pruned: bool = False  # stopped early by the early termination scheduler
 
 
 class SweepMethodEnum(str, Enum):
@@ -57,6 +68,74 @@ class MetricConfig(BaseModel):
     goal: GoalEnum = Field(..., description="Goal for the metric (e.g., 'maximize', 'minimize')")
 
 
+class BayesConfig(BaseModel):
+    """Configuration of the surrogate model used by bayesian sweeps.
+
+    Attributes:
+        nu (float): Smoothness of the Matern kernel of the Gaussian process, one of 0.5, 1.5 or 2.5.
+        refit_every (int): Number of new observations after which the kernel hyperparameters are re-optimized, in
+            between new observations are added to the surrogate incrementally.
+        num_candidates (int): Number of random candidates on which the acquisition function is evaluated.
+
+    Examples:
+        >>> config = BayesConfig(refit_every=25)
+        >>> config.refit_every
+        25
+        >>> config.nu
+        1.5
+    """
+
+    model_config = ConfigDict(extra="forbid")
+
+    nu: float = Field(1.5, description="Smoothness of the Matern kernel, one of 0.5, 1.5 or 2.5")
+    refit_every: int = Field(10, ge=1, description="Number of new observations between refits of the kernel")
+    num_candidates: int = Field(1000, ge=1, description="Number of candidates to evaluate the acquisition function on")
+
+    def model_post_init(self, context):
+        """Validate that the Matern kernel has a closed form for the smoothness."""
+        if self.nu not in (0.5, 1.5, 2.5):
+            raise ValueError(f"Smoothness nu of the Matern kernel must be one of 0.5, 1.5 or 2.5, got {self.nu}")
+
+
+class EarlyTerminateConfig(BaseModel):
+    """Configuration of the early termination of poorly performing trials with Hyperband.
+
+    The brackets of Hyperband are either given by `min_iter`, the first step at which trials are compared, or by
+    `max_iter` and `s`, the last step and the number of brackets before it. At every bracket only the best `1/eta`
+    fraction of the trials continue, the others are terminated. Steps refer to the logged values of the metric.
+
+    Attributes:
+        type (str): Type of early termination, only "hyperband" is supported.
+        min_iter (int | None): First step at which trials are compared.
+        max_iter (int | None): Last step at which trials are compared.
+        s (int | None): Number of brackets, required together with `max_iter`.
+        eta (float): Factor between the steps of consecutive brackets.
+        check_interval (float): Seconds between checks of the running trials of an agent.
+
+    Examples:
+        >>> config = EarlyTerminateConfig(min_iter=3)
+        >>> config.eta
+        3.0
+        >>> config = EarlyTerminateConfig(max_iter=27, s=2, eta=3)
+        >>> config.max_iter, config.s
+        (27, 2)
+    """
+
+    model_config = ConfigDict(extra="forbid")
+
+    type: Literal["hyperband"] = Field("hyperband", description="Type of early termination")
+    min_iter: int | None = Field(None, ge=1, description="First step at which trials are compared")
+    max_iter: int | None = Field(None, ge=1, description="Last step at which trials are compared")
+    s: int | None = Field(None, ge=1, description="Number of brackets before max_iter")
+    eta: float = Field(3.0, gt=1, description="Factor between the steps of consecutive brackets")
+    check_interval: float = Field(10.0, gt=0, description="Seconds between checks of the running trials")
+
+    def model_post_init(self, context):
+        """Validate that the brackets are defined."""
+        if self.min_iter is None and (self.max_iter is None or self.s is None):
+            raise ValueError("Early termination requires either min_iter, or max_iter and s")
+
+
 class SweepConfig(BaseModel):
     """Configuration for a sweep in MLflow.
 
@@ -68,6 +147,12 @@ class SweepConfig(BaseModel):
         metric (MetricConfig | None): Configuration for the metric to track.
         parameters (dict[str, dict]): List of parameters to sweep over.
         run_cap (int): Maximum number of runs to execute in the sweep.
+        seed (int | None): Seed for random and bayesian search, such that the proposed parameters are reproducible.
+        bayes (BayesConfig): Configuration of the surrogate model used by bayesian sweeps.
+        shell (bool): Whether to run the command through the shell, otherwise it is executed as an argument list.
+        early_terminate (EarlyTerminateConfig | None): Configuration of the early termination of poor trials.
+        timeout (float | None): Wall-clock seconds after which a trial is terminated, None for no limit.
+        timeout_parameter (str | None): Sweep parameter whose value is the timeout of each trial, overriding `timeout`.
 
     Examples:
         >>> params = {"learning_rate": {"distribution": "uniform", "min": 0.0001, "max": 0.1}}
@@ -97,18 +182,45 @@ class SweepConfig(BaseModel):
     metric: MetricConfig | None = Field(None, description="Configuration for the metric to track")
     parameters: dict[str, dict] = Field(..., description="List of parameters to sweep over")
     run_cap: int = Field(10, description="Maximum number of runs to execute in the sweep")
+    seed: int | None = Field(None, description="Seed for random and bayesian search")
+    bayes: BayesConfig = Field(default_factory=BayesConfig, description="Configuration of the bayesian surrogate")
+    shell: bool = Field(True, description="Run the command through the shell, otherwise as an argument list")
+    early_terminate: EarlyTerminateConfig | None = Field(None, description="Early termination of poor trials")
+    timeout: float | None = Field(None, gt=0, description="Wall-clock seconds after which a trial is terminated")
+    timeout_parameter: str | None = Field(None, description="Sweep parameter whose value is the timeout of each trial")
+
+    _template: CommandTemplate | None = PrivateAttr(None)
 
     def model_post_init(self, context):
         """Validate the sweep configuration after initialization."""
         if self.method == SweepMethodEnum.bayes and self.metric is None:
             raise ValueError("Bayesian sweeps require a metric configuration.")
+        if self.early_terminate is not None and self.metric is None:
+            raise ValueError("Early termination requires a metric configuration.")
+        if self.timeout_parameter is not None and self.timeout_parameter not in self.parameters:
+            raise ValueError(f"Timeout parameter '{self.timeout_parameter}' is not a parameter of the sweep.")
+        self._template = CommandTemplate(self.command, parameter_names(self.parameters))
+
+    @property
+    def template(self) -> CommandTemplate:
+        """The command compiled into a template that renders the command of a trial.
+
+        The template is compiled against the parameters when the config is created, it is only compiled again if the
+        command has been changed since. Placeholders that do not match any parameter are left unrendered, see
+        `CommandTemplate.validate` to reject them.
+        """
+        if self._template is None or self._template.template != self.command:
+            self._template = CommandTemplate(self.command, parameter_names(self.parameters))
+        return self._template
 
     @classmethod
     def from_sweep(cls, sweep: Run) -> "SweepConfig":
         """Create a SweepConfig instance from an MLflow Run object.
 
-        This method extracts the sweep configuration from the artifacts of an MLflow Run
-        by loading the sweep_config.yaml file from the run's artifact directory.
+        This method loads the sweep_config.yaml file from the artifacts of the MLflow Run through the artifact
+        repository of MLflow, such that remote artifact stores are supported. The file is cached locally, as the
+        configuration of a sweep never changes. Sweeps created before placeholders were validated may refer to
+        environment variables as `${NAME}`, they are left for the shell to expand with a warning.
 
         Args:
             sweep (Run): An MLflow Run object containing sweep configuration artifacts.
@@ -117,7 +229,7 @@ class SweepConfig(BaseModel):
             SweepConfig: A validated SweepConfig instance constructed from the run's artifacts.
 
         Raises:
-            FileNotFoundError: If the sweep_config.yaml file cannot be found in the run artifacts.
+            MlflowException: If the sweep_config.yaml file cannot be found in the run artifacts.
             ValueError: If the loaded configuration is invalid or missing required fields.
 
         Examples:
@@ -127,13 +239,14 @@ class SweepConfig(BaseModel):
             >>> config.method  # doctest: +SKIP
             <SweepMethodEnum.random: 'random'>
         """
-        artifact_uri = sweep.info.artifact_uri.replace("file://", "")
-        config_file_path = Path(artifact_uri) / "sweep_config.yaml"
-
-        with Path.open(config_file_path) as file:
-            config = yaml.safe_load(file)
-
-        return cls(**config)  # Validate the config
+        text = load_text_artifact(sweep.info.run_id, "sweep_config.yaml", sweep.info.artifact_uri, cache=True)
+        config = cls(**yaml.safe_load(text))  # Validate the config
+        if config.template.unknown:
+            rprint(
+                f"[bold yellow]Command placeholders {config.template.unknown} do not match any parameter of the sweep "
+                "and are left unrendered.[/bold yellow]"
+            )
+        return config
 
 
 class MetricHistory(BaseModel):
@@ -158,3 +271,128 @@ class MetricHistory(BaseModel):
 
     run_id: str = Field(..., description="Run IDs associated with the metric history")
     metrics: list[dict] = Field(..., description="List of metric dicts for the run")
+
+
+class MetricStatistics(BaseModel):
+    """Running statistics of the metric of a sweep, updated one run at a time.
+
+    The mean and variance are updated with Welford's online algorithm, such that runs only have to be seen once.
+
+    Attributes:
+        count (int): Number of runs with a value of the metric.
+        mean (float): Mean of the metric.
+        m2 (float): Sum of squared differences from the mean.
+        best (float | None): Best value of the metric according to the goal of the sweep.
+        best_run (str | None): ID of the run with the best value.
+
+    Examples:
+        >>> stats = MetricStatistics()
+        >>> for run_id, value in [("a", 1.0), ("b", 3.0), ("c", 2.0)]:
+        ...     stats.update(run_id, value, GoalEnum.minimize)
+        >>> stats.count, stats.mean, stats.std, stats.best_run
+        (3, 2.0, 1.0, 'a')
+    """
+
+    count: int = Field(0, description="Number of runs with a value of the metric")
+    mean: float = Field(0.0, description="Mean of the metric")
+    m2: float = Field(0.0, description="Sum of squared differences from the mean")
+    best: float | None = Field(None, description="Best value of the metric")
+    best_run: str | None = Field(None, description="ID of the run with the best value")
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation of the metric."""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def update(self, run_id: str, value: float, goal: GoalEnum) -> None:
+        """Add the metric value of a run to the statistics."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if self.best is None or (value > self.best if goal == GoalEnum.maximize else value < self.best):
+            self.best, self.best_run = value, run_id
+
+
+class FinalizeState(BaseModel):
+    """Aggregate state of the last finalize of a sweep, stored as an artifact of the sweep run.
+
+    The state records the latest end time of the processed runs, such that a later finalize only fetches the runs that
+    ended since, and can skip all work if none of them is new and the settings are unchanged. The rows of the processed
+    runs in the report are kept as well, together with the last parameter importance, such that finished runs are never
+    fetched again and the importance is only refit if runs with the metric were added or its settings changed.
+
+    Attributes:
+        watermark (int): Latest end time of the processed runs in milliseconds.
+        runs (list[dict]): Rows of the processed runs in the report, see `row`.
+        statistics (MetricStatistics): Running statistics of the metric over the processed runs.
+        settings (dict): Settings of the parameter importance analysis and of the report of the last finalize.
+        importance (dict): Parameter importance of the last finalize, with its `settings` and `parameters`.
+
+    Examples:
+        >>> state = FinalizeState()
+        >>> state.is_current([], {"method": "forest"})
+        False
+    """
+
+    ARTIFACT: ClassVar[str] = "finalize_state.json"
+
+    watermark: int = Field(0, description="Latest end time of the processed runs in milliseconds")
+    runs: list[dict] = Field(default_factory=list, description="Rows of the processed runs in the report")
+    statistics: MetricStatistics = Field(default_factory=MetricStatistics, description="Statistics of the metric")
+    settings: dict = Field(default_factory=dict, description="Settings of the analysis and the report")
+    importance: dict = Field(default_factory=dict, description="Parameter importance of the last finalize")
+
+    @property
+    def processed(self) -> list[str]:
+        """IDs of the processed runs."""
+        return [row["run"] for row in self.runs]
+
+    @classmethod
+    def load(cls, sweep: Run) -> "FinalizeState":
+        """Load the state of the last finalize from the sweep run, or an empty state if the sweep was never finalized.
+
+        The artifact is overwritten by every finalize, so it is always read from the artifact store.
+        """
+        try:
+            text = load_text_artifact(sweep.info.run_id, cls.ARTIFACT, sweep.info.artifact_uri)
+            return cls.model_validate_json(text)
+        except (MlflowException, ValidationError):
+            return cls()
+
+    def is_current(self, runs: list[ExtendedSweepRun], settings: dict) -> bool:
+        """Whether the state already covers the given finished runs and analysis settings."""
+        processed = set(self.processed)
+        return self.settings == settings and all(run.id in processed for run in runs)
+
+    def update(self, runs: list[ExtendedSweepRun], metric: MetricConfig | None) -> list[ExtendedSweepRun]:
+        """Add the finished runs that were not processed before, with their rows in the report.
+
+        Args:
+            runs: Finished runs of the sweep, at least those that ended after the watermark.
+            metric: The metric of the sweep, if any.
+
+        Returns:
+            The runs that were added.
+        """
+        processed = set(self.processed)
+        new = [run for run in runs if run.id not in processed]
+        for run in new:
+            if metric is not None and (value := run.summary_metrics.get(metric.name)) is not None:
+                self.statistics.update(run.id, value, metric.goal)
+            self.runs.append(self.row(run, metric))
+            self.watermark = max(self.watermark, run.end_time or 0)
+        return new
+
+    @staticmethod
+    def row(run: ExtendedSweepRun, metric: MetricConfig | None) -> dict:
+        """Row of a run in the report, with its status, start and end time, metric value and parameters."""
+        row = {
+            "run": run.id,
+            "status": RUN_STATUS_PRUNED if run.pruned else run.state,
+            "start_time": run.start_time,
+            "end_time": run.end_time,
+        }
+        if metric is not None:
+            row[metric.name] = run.summary_metrics.get(metric.name)
+        return row | {name: value["value"] for name, value in run.config.items()}
@@ -1,17 +1,34 @@
+import heapq
+import html
+
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 from plotly.subplots import make_subplots
 
+# Number of runs above which plots switch to WebGL rendering and the timeline packs runs into shared lanes
+LARGE_SWEEP_THRESHOLD = 1000
+
 
-def plot_metric_vs_time(dataframe: pd.DataFrame, time_col: str = "created", metric_col: str = "accuracy") -> go.Figure:
+def plot_metric_vs_time(
+    dataframe: pd.DataFrame,
+    time_col: str = "created",
+    metric_col: str = "accuracy",
+    large_sweep_threshold: int = LARGE_SWEEP_THRESHOLD,
+) -> go.Figure:
     """
     Plots a metric vs. time using Plotly, with a line showing the best-so-far metric value.
 
+    Above `large_sweep_threshold` points the figure is rendered with WebGL (`Scattergl`), which keeps it responsive in
+    the browser for sweeps with thousands of runs.
+
     Parameters:
         dataframe (pd.DataFrame): DataFrame containing the data.
         time_col (str): Column name for timestamps (default is 'created').
         metric_col (str): Column name for the metric being plotted (default is 'accuracy').
+        large_sweep_threshold (int): Number of points above which the figure is rendered with WebGL.
 
     Returns:
         plotly.graph_objects.Figure: The generated interactive Plotly figure.
@@ -36,6 +53,7 @@ def plot_metric_vs_time(dataframe: pd.DataFrame, time_col: str = "created", metr
     # Calculate best-so-far metric value
     df.sort_values(by=time_col, inplace=True)
     df["best_so_far"] = df[metric_col].cummax()
+    large = len(df) > large_sweep_threshold
 
     # Scatter plot of all points
     fig = px.scatter(
@@ -45,12 +63,13 @@ def plot_metric_vs_time(dataframe: pd.DataFrame, time_col: str = "created", metr
         color=metric_col,
         title=f"{metric_col} v. {time_col}",
         labels={time_col: time_col.capitalize(), metric_col: metric_col.capitalize()},
-        size=[10] * len(df),  # Fixed size for all points
+        render_mode="webgl" if large else "svg",
     )
+    fig.update_traces(marker={"size": 5 if large else 20})  # Fixed size for all points
 
     # Add line for best-so-far
     fig.add_trace(
-        go.Scatter(
+        (go.Scattergl if large else go.Scatter)(
             x=df[time_col],
             y=df["best_so_far"],
             mode="lines+markers",
@@ -179,10 +198,15 @@ def plot_trial_timeline(
     status_col: str = "status",
     color_map: dict | None = None,
     title: str = "Timeline Plot",
+    large_sweep_threshold: int = LARGE_SWEEP_THRESHOLD,
 ) -> go.Figure:
     """
     Creates a Plotly timeline plot for trial runs.
 
+    Up to `large_sweep_threshold` runs every run gets its own row. Larger sweeps are drawn with WebGL and the runs are
+    packed into lanes, where runs that do not overlap in time share a lane, such that the number of rows equals the
+    largest number of runs that were active at the same time.
+
     Parameters:
     - df: DataFrame containing trial data.
     - start_col: Name of the column containing start timestamps.
@@ -191,6 +215,7 @@ def plot_trial_timeline(
     - status_col: Name of the column specifying trial status.
     - color_map: Optional dict to specify colors for statuses.
     - title: Title of the plot.
+    - large_sweep_threshold: Number of runs above which runs are packed into lanes and drawn with WebGL.
 
     Example:
         >>> import pandas as pd
@@ -216,6 +241,9 @@ def plot_trial_timeline(
     zero_duration = df[start_col] == df[end_col]
     df.loc[zero_duration, end_col] += pd.Timedelta(seconds=1)
 
+    if len(df) > large_sweep_threshold:
+        return _plot_packed_timeline(df, start_col, end_col, run_col, status_col, color_map, title)
+
     # Create timeline plot
     fig = px.timeline(df, x_start=start_col, x_end=end_col, y=run_col, color=status_col, color_discrete_map=color_map)
 
@@ -224,3 +252,105 @@ def plot_trial_timeline(
     )
 
     return fig
+
+
+def pack_lanes(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    Assigns intervals to as few lanes as possible, such that intervals in the same lane do not overlap.
+
+    Intervals are assigned in order of their start to the lane that has been free for the longest time.
+
+    Example:
+        >>> pack_lanes(np.array([0, 1, 2, 3]), np.array([2, 3, 4, 5])).tolist()
+        [0, 1, 0, 1]
+    """
+    lanes = np.zeros(len(starts), dtype=int)
+    free: list[tuple] = []  # (end of the last interval, lane) for every lane
+    for i in np.argsort(starts, kind="stable"):
+        if free and free[0][0] <= starts[i]:
+            _, lane = heapq.heappop(free)
+        else:
+            lane = len(free)
+        lanes[i] = lane
+        heapq.heappush(free, (ends[i], lane))
+    return lanes
+
+
+def _plot_packed_timeline(
+    df: pd.DataFrame, start_col: str, end_col: str, run_col: str, status_col: str, color_map: dict, title: str
+) -> go.Figure:
+    """Timeline of a large sweep with one WebGL line trace per status, where each run is a segment in its lane."""
+    lanes = pack_lanes(df[start_col].to_numpy(), df[end_col].to_numpy())
+    palette = px.colors.qualitative.Plotly
+    fig = go.Figure()
+    for i, (status, group) in enumerate(df.groupby(status_col, sort=True)):
+        n = len(group)
+        # Segments are separated by gaps, such that all runs with the same status are drawn by a single trace
+        x = np.empty(3 * n, dtype=object)
+        x[0::3], x[1::3], x[2::3] = group[start_col].to_numpy(), group[end_col].to_numpy(), None
+        y = np.empty(3 * n, dtype=object)
+        y[0::3] = y[1::3] = lanes[df.index.get_indexer(group.index)]
+        y[2::3] = None
+        text = np.repeat(group[run_col].astype(str).to_numpy(), 3)
+        fig.add_trace(
+            go.Scattergl(
+                x=x,
+                y=y,
+                text=text,
+                mode="lines",
+                name=str(status),
+                line={"color": color_map.get(status, palette[i % len(palette)]), "width": 4},
+                hovertemplate="%{text}<br>%{x}<extra>" + html.escape(str(status)) + "</extra>",
+            )
+        )
+
+    fig.update_layout(
+        title=title,
+        xaxis_title="Datetime",
+        yaxis_title="Lane",
+        yaxis_autorange="reversed",
+        template="plotly_white",
+        legend_title_text=status_col,
+    )
+    return fig
+
+
+def render_report(
+    figures: dict[str, go.Figure],
+    title: str = "Sweep Report",
+    notes: list[str] | None = None,
+    include_plotlyjs: bool | str = True,
+) -> str:
+    """
+    Renders several figures into a single HTML report in memory.
+
+    The plotly.js bundle is included only once, with the first figure, instead of once per figure.
+
+    Parameters:
+        figures (dict[str, go.Figure]): Figures to include, keyed by the heading of their section.
+        title (str): Title of the report.
+        notes (list[str] | None): Lines of text shown below the title.
+        include_plotlyjs (bool | str): How plotly.js is included, see `plotly.io.to_html`. Use "cdn" to load it from
+            the plotly CDN instead of embedding it.
+
+    Returns:
+        str: The HTML document.
+
+    Example:
+        >>> import plotly.graph_objects as go
+        >>> figures = {"A": go.Figure(go.Bar(y=[1, 2])), "B": go.Figure(go.Bar(y=[3, 4]))}
+        >>> report = render_report(figures, title="My sweep", include_plotlyjs="cdn")
+        >>> report.count("<h2>"), report.count("cdn.plot.ly")
+        (2, 1)
+    """
+    sections = []
+    for i, (heading, fig) in enumerate(figures.items()):
+        div = pio.to_html(fig, full_html=False, include_plotlyjs=include_plotlyjs if i == 0 else False)
+        sections.append(f"<section><h2>{html.escape(heading)}</h2>{div}</section>")
+    paragraphs = "".join(f"<p>{html.escape(note)}</p>" for note in notes or [])
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        f"<title>{html.escape(title)}</title>"
+        "<style>body{font-family:sans-serif;margin:2em}section{margin-bottom:2em}</style>"
+        f"</head><body><h1>{html.escape(title)}</h1>{paragraphs}{''.join(sections)}</body></html>"
+    )
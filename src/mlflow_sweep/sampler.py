@@ -1,15 +1,20 @@
+import json
 import uuid
 import warnings
-from re import sub
 
-from sklearn.exceptions import ConvergenceWarning
+from rich import print as rprint
 
-from mlflow_sweep.models import SweepConfig
+from mlflow_sweep.coordinator import SlotCoordinator
+from mlflow_sweep.models import ExtendedSweepRun, SweepConfig, SweepMethodEnum
+from mlflow_sweep.search import IN_FLIGHT_STATES, BayesSearch, GridSearch, RandomSearch
 from mlflow_sweep.sweepstate import SweepState
+from mlflow_sweep.template import PLACEHOLDER
+from mlflow_sweep.workqueue import ProposalQueue
 
 with warnings.catch_warnings():
+    # sweep dependency still uses V1 API of pydantic, so we need to ignore the warning about config keys
     warnings.filterwarnings("ignore", category=UserWarning, message="Valid config keys have changed in V2.*")
-    import sweeps as sweep_module
+    from sweeps import stop_runs
 
 
 class SweepSampler:
@@ -18,35 +23,264 @@ class SweepSampler:
     Args:
         config (SweepConfig): The sweep configuration containing the command and parameters.
         sweepstate (SweepState): Class managing the state of the sweep, including previous runs and metrics.
+        coordinator (SlotCoordinator | None): Coordinator handing out trial slots shared by all agents of the sweep.
+            Without it, the run cap is checked against a snapshot of the ledger and can be overshot by agents
+            proposing at the same time. Agents that do not share its database only skip the run numbers of each
+            other that are already recorded in the ledger.
+        queue (ProposalQueue | None): Queue of the proposals materialized at init, which are claimed instead of
+            proposing new runs.
     """
 
-    def __init__(self, config: SweepConfig, sweepstate: SweepState) -> None:
+    def __init__(
+        self,
+        config: SweepConfig,
+        sweepstate: SweepState,
+        coordinator: SlotCoordinator | None = None,
+        queue: ProposalQueue | None = None,
+    ) -> None:
         self.config = config
         self.sweepstate = sweepstate
+        self.coordinator = coordinator
+        self.queue = queue
+        self.retries: list[tuple[str | list[str], dict]] = []
+        self.grid = GridSearch(config.parameters) if config.method == SweepMethodEnum.grid else None
+        self.random = RandomSearch(config.parameters, config.seed) if config.method == SweepMethodEnum.random else None
+        self.bayes = (
+            BayesSearch(
+                config.parameters,
+                metric_name=config.metric.name,  # ty: ignore[possibly-unbound-attribute]
+                goal=config.metric.goal,  # ty: ignore[possibly-unbound-attribute]
+                nu=config.bayes.nu,
+                refit_every=config.bayes.refit_every,
+                num_candidates=config.bayes.num_candidates,
+                seed=config.seed,
+            )
+            if config.method == SweepMethodEnum.bayes
+            else None
+        )
 
-    def propose_next(self) -> tuple[str, dict] | None:
+    def propose_next(self) -> tuple[str | list[str], dict] | None:
         """Propose the next run command and parameters based on the sweep configuration and state."""
-        previous_runs = self.sweepstate.get_all(with_metric=self.config.metric.name if self.config.metric else "")
-        if len(previous_runs) >= self.config.run_cap:
-            return None  # Stop proposing new runs if the cap is reached
+        proposals = self.propose_batch(1)
+        return proposals[0] if proposals else None
 
-        with warnings.catch_warnings():
-            warnings.filterwarnings(
-                "ignore", category=ConvergenceWarning, message="The optimal value found for dimension 0 of parameter.*"
-            )
-            sweep_config = sweep_module.next_run(sweep_config=self.config.model_dump(), runs=previous_runs)
+    def propose_batch(self, k: int) -> list[tuple[str | list[str], dict]]:
+        """Propose up to k distinct runs from a single snapshot of the sweep state.
+
+        Random search draws all k configurations in one vectorized call and grid search takes the grid points at the
+        indices of the run numbers of the proposals, skipping points already in the ledger. Neither of them loads the
+        history of previous runs. Bayesian search adds the runs finished since the last call to its surrogate and
+        proposes the batch one at a time, where each earlier proposal is added as a fantasized observation with the
+        worst metric value seen so far (constant liar), such that the proposals of a batch spread out instead of
+        collapsing onto the same point.
+        If the proposals were materialized in a queue, the next k pending entries are claimed instead. Trials put
+        back with `requeue` are proposed before any new ones. If proposing fails, the reserved slots are given back.
+
+        Args:
+            k: Number of runs to propose.
+
+        Returns:
+            A list of (command, parameters) tuples, where the command is an argument list if the sweep does not use
+            the shell. Fewer than k if the run cap is reached or the grid is exhausted.
+
+        """
+        if self.queue is not None:
+            return self.queue.claim(k)  # neither the run history nor the ledger is needed
+
+        # Retried trials keep the slot of the trial they replace
+        retries, self.retries = self.retries[:k], self.retries[k:]
+        k -= len(retries)
+        if k == 0:
+            slots = []
+        elif self.coordinator is not None:
+            # The run numbers are reserved atomically across the agents sharing the coordinator and identify the
+            # trials. Run numbers in the ledger are skipped, they include those of agents with another database.
+            used = [proposal["run"] for proposal in self.sweepstate.ledger.read_all() if "run" in proposal]
+            slots = self.coordinator.reserve(k, used)
+        else:
+            # Every proposal is recorded in the ledger, also those of trials that have not started a run yet
+            num_previous_runs = len(self.sweepstate.get_parameters()) + len(retries)
+            slots = list(range(num_previous_runs + 1, self.config.run_cap + 1))[:k]
+        if not slots:
+            return retries
+
+        try:
+            proposals = self._to_proposals(slots, self._suggest(slots))
+        except BaseException:
+            # Give the slots back, otherwise they count towards the run cap without ever being proposed
+            self.retries = retries + self.retries
+            if self.coordinator is not None:
+                self.coordinator.release(slots)
+            raise
+        if self.coordinator is not None:
+            self.coordinator.release(slots[len(proposals) :])  # e.g. the grid is exhausted
+        return retries + proposals
+
+    def _suggest(self, slots: list[int]) -> list[dict]:
+        """Suggest the configurations of the runs with the given run numbers."""
+        if self.grid is not None:
+            return self._suggest_grid(self.grid, slots)
+        if self.random is not None:
+            return self.random.sample(len(slots), runs=[run - 1 for run in slots])
+        if self.bayes is not None:
+            runs = self.sweepstate.get_all(with_metric=self.bayes.metric_name)
+            self.bayes.update(runs)
+            pending = [run.config for run in runs if run.state in IN_FLIGHT_STATES]
+            pending += [run.config for run in self.sweepstate.get_pending()]
+            return self.bayes.propose(len(slots), pending)
+        raise ValueError(f"Unsupported sweep method {self.config.method}")
+
+    def _suggest_grid(self, grid: GridSearch, slots: list[int]) -> list[dict]:
+        """Grid points of the runs with the given run numbers, skipping points that are already in the ledger.
+
+        The point of a run is the one at the index of its run number, such that agents sharing a coordinator never
+        propose the same point and no history is needed. Only if that point was proposed already, e.g. by an agent
+        with another coordinator database or before the sweep used run numbers as grid indices, the first point that
+        was not proposed yet is taken instead.
+        """
+        # The ledger was loaded when the slots were reserved
+        proposed = {
+            self._parameters_key({k: v for k, v in proposal.items() if k not in ("run", "sweep_run_id")})
+            for proposal in self.sweepstate.ledger
+        }
+        proposed_before = len(proposed)
+        suggestions = []
+        for run in slots:
+            index = run - 1
+            if index < len(grid) and self._grid_key(grid[index]) in proposed:
+                index = next((i for i in range(len(grid)) if self._grid_key(grid[i]) not in proposed), len(grid))
+            if index >= len(grid):
+                break  # the grid is exhausted
+            proposed.add(self._grid_key(grid[index]))
+            suggestions.append(grid[index])
+        rprint(f"[bold blue]Grid search:[/bold blue] {proposed_before + len(suggestions)}/{len(grid)} points proposed")
+        return suggestions
+
+    @classmethod
+    def _grid_key(cls, point: dict) -> str:
+        """Key of a grid point in the format of a SweepRun config, see `_parameters_key`."""
+        return cls._parameters_key({k: v["value"] for k, v in point.items()})
+
+    @staticmethod
+    def _parameters_key(parameters: dict) -> str:
+        """Key identifying a set of parameter values, independent of the order of the parameters."""
+        return json.dumps(parameters, sort_keys=True, default=str)
+
+    def release(self, proposals: list[dict]) -> None:
+        """Give back the slots of proposals whose trials were not launched, such that they are proposed again."""
+        if self.queue is not None:
+            for proposal in proposals:
+                self.queue.requeue(proposal)
+        elif self.coordinator is not None:
+            self.coordinator.release([proposal["run"] for proposal in proposals])
+
+    def materialize(self) -> list[tuple[str | list[str], dict]]:
+        """All proposals of a random or grid sweep, computed up front to fill a `ProposalQueue`.
+
+        Grid search proposes the first `run_cap` points of the grid, random search draws `run_cap` configurations,
+        which are the same as proposed one at a time if the sweep is seeded.
 
-        if sweep_config is None:
-            return None  # Grid search is exhausted or no more runs can be proposed
-        proposed_parameters = {k: v["value"] for k, v in sweep_config.config.items()}
-        command = self.replace_dollar_signs(self.config.command, proposed_parameters)
-        proposed_parameters["run"] = len(previous_runs) + 1  # Increment run count for this sweep
-        proposed_parameters["sweep_run_id"] = str(uuid.uuid4())  # Unique ID for this run
-        return command, proposed_parameters
+        Returns:
+            The (command, parameters) tuples numbered from 1.
+
+        """
+        if self.grid is not None:
+            suggestions = [self.grid[index] for index in range(min(self.config.run_cap, len(self.grid)))]
+        elif self.random is not None:
+            suggestions = self.random.sample(self.config.run_cap)
+        else:
+            raise ValueError(f"Proposals of {self.config.method} sweeps depend on previous runs and cannot be queued")
+        return self._to_proposals(list(range(1, len(suggestions) + 1)), suggestions)
+
+    def record_launch(self, proposal: dict) -> None:
+        """Record the proposal of a trial that is launched in the ledger of the sweep."""
+        self.sweepstate.ledger.append(proposal)
+
+    def complete(self, proposal: dict, status: str) -> None:
+        """Record the final status of the trial of a proposal, which marks its entry in the queue as done."""
+        if self.queue is not None:
+            self.queue.complete(proposal["run"], status)
+
+    def mark_pruned(self, run_id: str) -> None:
+        """Mark the run of a trial that was terminated early, see `SweepState.mark_pruned`."""
+        self.sweepstate.mark_pruned(run_id)
+
+    def mark_timed_out(self, sweep_run_id: str) -> None:
+        """Mark the run of a trial that exceeded its timeout, see `SweepState.mark_timed_out`."""
+        self.sweepstate.mark_timed_out(sweep_run_id)
+
+    def heartbeat(self, agent_id: str) -> None:
+        """Publish a heartbeat of an agent, see `SweepState.heartbeat`."""
+        self.sweepstate.heartbeat(agent_id)
+
+    def remove_heartbeat(self, agent_id: str) -> None:
+        """Remove the heartbeat of an agent, see `SweepState.remove_heartbeat`."""
+        self.sweepstate.remove_heartbeat(agent_id)
+
+    def reclaim_stale(self, timeout: float, agent_id: str | None = None) -> list[dict]:
+        """Reclaim the trials of agents without a recent heartbeat, see `SweepState.reclaim_stale`."""
+        return self.sweepstate.reclaim_stale(timeout, agent_id)
+
+    def requeue(self, proposal: dict) -> None:
+        """Propose the parameters of a trial that was reclaimed from a dead agent again, under a new sweep run ID.
+
+        Queued sweeps put the entry back in the queue, such that any agent can claim it. Otherwise the trial is
+        proposed by this sampler before any new trials.
+        """
+        proposal = {**proposal, "sweep_run_id": str(uuid.uuid4())}
+        if self.queue is not None:
+            self.queue.requeue(proposal)
+            return
+        parameters = {k: v for k, v in proposal.items() if k not in ("run", "sweep_run_id")}
+        self.retries.append((self._render(parameters), proposal))
+
+    def _render(self, parameters: dict) -> str | list[str]:
+        """Render the command of a trial, as an argument list if the sweep does not use the shell."""
+        return (
+            self.config.template.render(parameters)
+            if self.config.shell
+            else self.config.template.render_argv(parameters)
+        )
+
+    def _to_proposals(self, slots: list[int], suggestions: list[dict]) -> list[tuple[str | list[str], dict]]:
+        """Render the command of each suggestion and number it with a slot of the sweep."""
+        proposals = []
+        for run, suggestion in zip(slots, suggestions):
+            proposed_parameters = {k: v["value"] for k, v in suggestion.items()}
+            command = self._render(proposed_parameters)
+            proposed_parameters["run"] = run  # Number of the slot of this run in the sweep
+            proposed_parameters["sweep_run_id"] = str(uuid.uuid4())  # Unique ID for this run
+            proposals.append((command, proposed_parameters))
+        return proposals
+
+    def propose_stops(self) -> list[ExtendedSweepRun]:
+        """Running trials that should be terminated early according to the early termination scheduler.
+
+        The intermediate values of the metric of all runs are compared at the brackets of Hyperband, and running
+        trials that are not among the best `1/eta` at their latest bracket are returned.
+
+        Returns:
+            The runs to terminate, empty if early termination is not configured.
+
+        """
+        early_terminate = self.config.early_terminate
+        if early_terminate is None or self.config.metric is None:
+            return []
+        sweep_config = {
+            "method": self.config.method.value,
+            "metric": {"name": self.config.metric.name, "goal": self.config.metric.goal.value},
+            "parameters": self.config.parameters,
+            "early_terminate": early_terminate.model_dump(exclude_none=True, exclude={"check_interval"}),
+        }
+        # The runs to stop are a subset of the given runs, which are extended runs
+        return stop_runs(  # ty: ignore[invalid-return-type]
+            sweep_config, self.sweepstate.get_all(with_metric=self.config.metric.name)
+        )
 
     @staticmethod
     def replace_dollar_signs(string: str, parameters: dict) -> str:
-        """Replace ${parameter} with the actual parameter values."""
-        for key, value in parameters.items():
-            string = sub(rf"\${{{key}}}", str(value), string)
-        return string
+        """Replace ${parameter} with the actual parameter values, placeholders without a value are kept as is.
+
+        Trial commands are rendered with the compiled `SweepConfig.template`, this is kept for backwards compatibility.
+        """
+        return PLACEHOLDER.sub(lambda m: str(parameters[m[1]]) if m[1] in parameters else m[0], string)
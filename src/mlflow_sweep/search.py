@@ -0,0 +1,417 @@
+import contextlib
+import copy
+import math
+import warnings
+from collections.abc import Sequence
+
+import numpy as np
+from scipy import stats
+from scipy.linalg import cho_solve, cholesky, solve_triangular
+from scipy.optimize import minimize
+
+with warnings.catch_warnings():
+    # sweep dependency still uses V1 API of pydantic, so we need to ignore the warning about config keys
+    warnings.filterwarnings("ignore", category=UserWarning, message="Valid config keys have changed in V2.*")
+    from sweeps import RunState
+    from sweeps.params import HyperParameter, HyperParameterSet
+
+
+def _to_config(paths: list[list[str]], values: list) -> dict:
+    """Build a SweepRun config from parameter values, equivalent to `HyperParameterSet.to_config`.
+
+    Args:
+        paths: Names of the parameters split at the nesting delimiter.
+        values: The values of the parameters.
+
+    Returns:
+        The config, where nested parameters are combined into a dictionary under their top level name.
+    """
+    config: dict = {}
+    for path, value in zip(paths, values, strict=True):
+        if isinstance(value, dict | list):
+            value = copy.deepcopy(value)
+        if len(path) == 1:
+            config[path[0]] = {"value": value}
+            continue
+        node = config.setdefault(path[0], {"value": {}})["value"]
+        for key in path[1:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = value
+    return config
+
+
+class GridSearch:
+    """Grid over the parameters of a sweep that is enumerated lazily by index.
+
+    Parameters are ordered the same way as in the sweeps library, such that the grid points are proposed in the same
+    order, with the last parameter varying fastest. Since any point can be computed directly from its index, the
+    point of a run follows from its run number alone and the size of the grid is known up front.
+
+    Args:
+        parameters (dict[str, dict]): The parameters section of the sweep configuration.
+
+    Examples:
+        >>> grid = GridSearch({"lr": {"values": [0.1, 0.01]}, "layers": {"min": 1, "max": 3}})
+        >>> len(grid)
+        6
+        >>> grid[0]
+        {'layers': {'value': 1}, 'lr': {'value': 0.1}}
+        >>> grid[5]
+        {'layers': {'value': 3}, 'lr': {'value': 0.01}}
+    """
+
+    def __init__(self, parameters: dict[str, dict]) -> None:
+        self.params = HyperParameterSet.from_config(parameters)
+        self.paths = [param.name.split(HyperParameterSet.NESTING_DELIMITER) for param in self.params]
+        self.values: list[Sequence] = [self._grid_values(param) for param in self.params]
+        self.size = math.prod(len(values) for values in self.values)
+
+    @staticmethod
+    def _grid_values(param: HyperParameter) -> Sequence:
+        """Get the values of a parameter along its grid axis."""
+        if param.type == HyperParameter.CONSTANT:
+            return [param.config["value"]]
+        if param.type == HyperParameter.CATEGORICAL:
+            return param.config["values"]
+        if param.type == HyperParameter.INT_UNIFORM:
+            return range(param.config["min"], param.config["max"] + 1)
+        if param.type == HyperParameter.Q_UNIFORM:
+            return np.arange(param.config["min"], param.config["max"], param.config["q"]).tolist()
+        raise ValueError(
+            f"Parameter {param.name} is a disallowed type with grid search. Grid search requires all parameters "
+            f"to be categorical, constant, int_uniform, or q_uniform. Specification of probabilities for "
+            f"categorical parameters is disallowed in grid search"
+        )
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, index: int) -> dict:
+        """Get the grid point at the given index in the format of a SweepRun config."""
+        if not 0 <= index < self.size:
+            raise IndexError(f"Grid index {index} out of range for grid of size {self.size}")
+        point = []
+        for values in reversed(self.values):
+            index, position = divmod(index, len(values))
+            point.append(values[position])
+        return _to_config(self.paths, point[::-1])
+
+
+class RandomSearch:
+    """Random search that samples many configurations of a sweep in one vectorized call.
+
+    All distributions supported by the sweeps library can be used. Uniform draws are generated for all
+    configurations at once and mapped through the percentage point function of each parameter, so no run history
+    is needed. If a seed is given, the draws of each run are determined by the seed and the run number alone, such
+    that a sweep is reproducible independent of how proposals are split into batches or across agents.
+
+    Args:
+        parameters (dict[str, dict]): The parameters section of the sweep configuration.
+        seed (int | None): Seed of the random number generator, fresh entropy is used if not provided.
+
+    Examples:
+        >>> search = RandomSearch({"lr": {"min": 0.0, "max": 1.0}, "layers": {"values": [1, 2, 3]}}, seed=0)
+        >>> configs = search.sample(1000)
+        >>> len(configs)
+        1000
+        >>> sorted(configs[0])
+        ['layers', 'lr']
+        >>> search.sample(2, start=5) == search.sample(10)[5:7]
+        True
+    """
+
+    def __init__(self, parameters: dict[str, dict], seed: int | None = None) -> None:
+        self.params = HyperParameterSet.from_config(parameters)
+        self.paths = [param.name.split(HyperParameterSet.NESTING_DELIMITER) for param in self.params]
+        self.seed = seed
+        self.rng = np.random.default_rng()
+
+    def sample(self, n: int, start: int = 0, runs: Sequence[int] | None = None) -> list[dict]:
+        """Sample n configurations in the format of a SweepRun config.
+
+        Args:
+            n: Number of configurations to sample.
+            start: Number of runs proposed before, used to derive the draws of each run when seeded.
+            runs: Zero-based indices of the runs to sample for when seeded, `range(start, start + n)` if not provided.
+
+        Returns:
+            The sampled configurations.
+        """
+        if self.seed is None:
+            uniforms = self.rng.random((n, len(self.params)))
+        else:
+            runs = range(start, start + n) if runs is None else runs
+            uniforms = np.array(
+                [np.random.default_rng([self.seed, run]).random(len(self.params)) for run in runs]
+            ).reshape(n, len(self.params))
+        columns = [self._column(param, uniforms[:, i], n) for i, param in enumerate(self.params)]
+
+        return [_to_config(self.paths, list(row)) for row in zip(*columns, strict=True)]
+
+    @staticmethod
+    def _column(param: HyperParameter, uniforms: np.ndarray, n: int) -> list:
+        """Map uniform draws to n values of a parameter as builtin python types."""
+        if param.type == HyperParameter.CONSTANT:
+            return [param.config["value"]] * n
+        if param.type == HyperParameter.CATEGORICAL_PROB:
+            # The vectorized branch of `HyperParameter.ppf` picks the wrong category, so the inverse cdf is done here
+            cdf = np.cumsum(param.config["probabilities"])
+            indices = np.minimum(np.searchsorted(cdf, uniforms, side="right"), len(cdf) - 1)
+            return [param.config["values"][i] for i in indices.tolist()]
+        values = param.ppf(uniforms)
+        return values.tolist() if isinstance(values, np.ndarray) else list(values)
+
+
+# Marker of parameters missing from a config, since None is a valid value of categorical parameters
+_MISSING = object()
+
+# Jitter added to the diagonal of the kernel matrix, the same as used by the sweeps library
+GAUSSIAN_PROCESS_NUGGET = 1e-7
+STD_NUMERICAL_STABILITY_EPSILON = 1e-6
+
+# Bounds of the kernel length scale, values at the bounds indicate a bad fit of the surrogate
+LENGTH_SCALE_BOUNDS = (1e-5, 1e5)
+
+# Run states with a final metric value and run states that are still being evaluated
+OBSERVED_STATES = (RunState.finished, RunState.failed, RunState.crashed, RunState.killed)
+IN_FLIGHT_STATES = (RunState.running, RunState.pending, RunState.preempting, RunState.preempted)
+
+
+def matern(a: np.ndarray, b: np.ndarray, length_scale: float, nu: float) -> np.ndarray:
+    """Matern kernel between the rows of a and b with unit amplitude."""
+    sq_dist = (a**2).sum(axis=1)[:, None] + (b**2).sum(axis=1)[None, :] - 2 * a @ b.T
+    r = np.sqrt(np.maximum(sq_dist, 0.0)) / length_scale
+    if nu == 0.5:
+        return np.exp(-r)
+    if nu == 1.5:
+        return (1.0 + math.sqrt(3) * r) * np.exp(-math.sqrt(3) * r)
+    if nu == 2.5:
+        return (1.0 + math.sqrt(5) * r + 5.0 / 3.0 * r**2) * np.exp(-math.sqrt(5) * r)
+    raise ValueError(f"Matern kernel only supports nu in (0.5, 1.5, 2.5), got {nu}")
+
+
+class BayesSearch:
+    """Bayesian search with a Gaussian process surrogate that is kept alive between proposals.
+
+    The surrogate follows the one of the sweeps library: a Matern kernel on parameters normalized by their cdf and
+    expected improvement over randomly drawn candidates. Instead of refitting it from the whole history for every
+    proposal, new observations are added with a rank-one update of the Cholesky factor of the kernel matrix, which
+    costs O(n^2). The length scale of the kernel is only re-optimized every `refit_every` observations, warm-started
+    from its current value. Runs still in flight and earlier proposals of the same batch are added as fantasized
+    observations to a copy of the factor, such that a batch spreads out over the search space.
+
+    Args:
+        parameters (dict[str, dict]): The parameters section of the sweep configuration.
+        metric_name (str): Name of the metric to optimize.
+        goal (str): Either "maximize" or "minimize".
+        nu (float): Smoothness of the Matern kernel, one of 0.5, 1.5 or 2.5.
+        refit_every (int): Number of new observations after which the kernel hyperparameters are re-optimized.
+        num_candidates (int): Number of random candidates the acquisition function is evaluated on.
+        max_refit_samples (int): Maximum number of observations used to optimize the kernel hyperparameters.
+        seed (int | None): Seed of the random number generator.
+    """
+
+    def __init__(
+        self,
+        parameters: dict[str, dict],
+        metric_name: str,
+        goal: str = "maximize",
+        nu: float = 1.5,
+        refit_every: int = 10,
+        num_candidates: int = 1000,
+        max_refit_samples: int = 500,
+        seed: int | None = None,
+    ) -> None:
+        self.params = HyperParameterSet.from_config(parameters)
+        if len(self.params.searchable_params) == 0:
+            raise ValueError("Need at least one searchable parameter for bayes search.")
+        self.paths = [param.name.split(HyperParameterSet.NESTING_DELIMITER) for param in self.params]
+        self.metric_name = metric_name
+        self.goal = goal
+        self.nu = nu
+        self.refit_every = refit_every
+        self.num_candidates = num_candidates
+        self.max_refit_samples = max_refit_samples
+        self.rng = np.random.default_rng(seed)
+
+        dim = len(self.params.searchable_params)
+        self.length_scale = 1.0
+        self.X = np.empty((0, dim))
+        self.values = np.empty(0)  # metric values, negated for maximization such that lower is better, NaN if missing
+        self.L = np.empty((0, 0))  # lower Cholesky factor of the kernel matrix of X
+        self.observed: set[str] = set()
+        self.since_refit = 0  # observations added since the kernel hyperparameters were last optimized
+        self.fitted = False
+
+    def update(self, runs: list) -> None:
+        """Add the runs that have reached a final state since the last update as observations.
+
+        Runs without a value of the metric and failed runs are stored without a value, see `y` for how they are
+        imputed.
+
+        Args:
+            runs: The runs of the sweep as ExtendedSweepRun objects.
+        """
+        for run in runs:
+            if run.id in self.observed or run.state not in OBSERVED_STATES:
+                continue
+            value = None
+            if run.state == RunState.finished:
+                with contextlib.suppress(ValueError):
+                    extremum = run.metric_extremum(self.metric_name, kind="maximum" if self.maximize else "minimum")
+                    if np.isfinite(extremum):
+                        value = -extremum if self.maximize else extremum
+            self.observed.add(run.id)
+            self.observe(self.normalize(run.config), value)
+
+    @property
+    def y(self) -> np.ndarray:
+        """The observed values, where runs without a value get the worst value of all observed runs.
+
+        The values are imputed whenever the surrogate is fit instead of when a run is observed, like in the sweeps
+        library, such that a failed run never looks better than runs finishing after it.
+        """
+        y = self.values.copy()
+        missing = np.isnan(y)
+        if missing.any() and not missing.all():
+            y[missing] = y[~missing].max()
+        return y
+
+    @property
+    def maximize(self) -> bool:
+        return self.goal == "maximize"
+
+    def normalize(self, config: dict) -> np.ndarray:
+        """Map the parameter values of a SweepRun config to the unit hypercube through their cdf."""
+        x = np.zeros(len(self.params.searchable_params))
+        for param, path in zip(self.params, self.paths, strict=True):
+            if param.name not in self.params.param_names_to_index:
+                continue
+            value = config.get(path[0], {}).get("value", _MISSING)
+            for key in path[1:]:
+                value = value.get(key, _MISSING) if isinstance(value, dict) else _MISSING
+            categorical = param.type in (HyperParameter.CATEGORICAL, HyperParameter.CATEGORICAL_PROB)
+            if value is _MISSING or (value is None and not categorical):
+                continue  # None is a valid category, e.g. `max_features: [sqrt, log2, null]`
+            if param.type == HyperParameter.CATEGORICAL_PROB:
+                # Center of the interval of the category, `HyperParameter.cdf` expects an index but returns its end
+                cdf = np.cumsum(param.config["probabilities"])
+                index = param.config["values"].index(value)
+                x[self.params.param_names_to_index[param.name]] = (cdf[index] + (cdf[index - 1] if index else 0)) / 2
+                continue
+            if param.type == HyperParameter.CATEGORICAL:
+                value = param.value_to_idx(value)
+            x[self.params.param_names_to_index[param.name]] = param.cdf(value)
+        return x
+
+    def observe(self, x: np.ndarray, y: float | None) -> None:
+        """Add an observation of the minimized objective at the normalized point x, None if it has no value."""
+        self.L = self._extend(self.L, self.X, x)
+        self.X = np.vstack([self.X, x])
+        self.values = np.append(self.values, np.nan if y is None else y)
+        self.since_refit += 1
+
+    def _extend(self, L: np.ndarray, X: np.ndarray, x: np.ndarray) -> np.ndarray:
+        """Rank-one update of the Cholesky factor L of the kernel matrix of X with the point x."""
+        k = matern(X, x[None, :], self.length_scale, self.nu)[:, 0]
+        ell = solve_triangular(L, k, lower=True) if len(k) else k
+        diagonal = math.sqrt(max(1.0 + GAUSSIAN_PROCESS_NUGGET - ell @ ell, GAUSSIAN_PROCESS_NUGGET))
+        extended = np.zeros((len(L) + 1, len(L) + 1))
+        extended[:-1, :-1] = L
+        extended[-1, :-1] = ell
+        extended[-1, -1] = diagonal
+        return extended
+
+    def refit(self) -> None:
+        """Optimize the length scale of the kernel, warm-started from its current value, and refactorize."""
+        X, y = self.X, self._normalized_y()
+        if len(X) > self.max_refit_samples:
+            indices = self.rng.choice(len(X), size=self.max_refit_samples, replace=False)
+            X, y = X[indices], y[indices]
+
+        def negative_log_marginal_likelihood(log_length_scale: np.ndarray) -> float:
+            K = matern(X, X, math.exp(log_length_scale[0]), self.nu) + GAUSSIAN_PROCESS_NUGGET * np.eye(len(X))
+            try:
+                L = cholesky(K, lower=True)
+            except np.linalg.LinAlgError:
+                return np.inf
+            alpha = cho_solve((L, True), y)
+            return 0.5 * y @ alpha + np.log(np.diag(L)).sum()
+
+        bounds = [tuple(math.log(b) for b in LENGTH_SCALE_BOUNDS)]
+        result = minimize(
+            negative_log_marginal_likelihood, x0=[math.log(self.length_scale)], method="L-BFGS-B", bounds=bounds
+        )
+        self.length_scale = math.exp(result.x[0])
+        K = matern(self.X, self.X, self.length_scale, self.nu) + GAUSSIAN_PROCESS_NUGGET * np.eye(len(self.X))
+        self.L = cholesky(K, lower=True)
+        self.since_refit = 0
+        self.fitted = True
+
+    def _normalized_y(self) -> np.ndarray:
+        y = self.y
+        if len(y) == 1:
+            return y - y[0]
+        return (y - y.mean()) / (y.std() + STD_NUMERICAL_STABILITY_EPSILON)
+
+    def propose(self, k: int, pending: list[dict] | None = None) -> list[dict]:
+        """Propose k configurations in the format of a SweepRun config.
+
+        Args:
+            k: Number of configurations to propose.
+            pending: Configs of runs that are still in flight, fantasized with the predicted metric value.
+
+        Returns:
+            The proposed configurations.
+        """
+        if len(self.X) < 2 or np.isnan(self.values).all():
+            # Too few observations or no run with a value of the metric yet
+            return [self._decode(x) for x in self.rng.random((k, self.X.shape[1]))]
+        if not self.fitted or self.since_refit >= self.refit_every:
+            self.refit()
+
+        y_norm = self._normalized_y()
+        best = y_norm.min()
+        lie = y_norm.max()  # earlier proposals of the batch are fantasized with the worst observed value
+        L, X, y = self.L, self.X, y_norm
+        for config in pending or []:
+            x = self.normalize(config)
+            mean, _ = self._predict(L, X, y, x[None, :])
+            L, X, y = self._extend(L, X, x), np.vstack([X, x]), np.append(y, mean)
+
+        at_bounds = np.isclose(self.length_scale, LENGTH_SCALE_BOUNDS).any()
+        proposals = []
+        for _ in range(k):
+            candidates = self.rng.random((self.num_candidates, X.shape[1]))
+            if at_bounds:
+                # Bad fit of the surrogate, fall back to a random sample like the sweeps library
+                x = candidates[0]
+            else:
+                mean, std = self._predict(L, X, y, candidates)
+                z = (best - mean) / (std + STD_NUMERICAL_STABILITY_EPSILON)
+                expected_improvement = (best - mean) * stats.norm.cdf(z) + std * stats.norm.pdf(z)
+                x = candidates[np.argmax(expected_improvement)]
+            proposals.append(self._decode(x))
+            L, X, y = self._extend(L, X, x), np.vstack([X, x]), np.append(y, lie)
+        return proposals
+
+    def _predict(
+        self, L: np.ndarray, X: np.ndarray, y: np.ndarray, candidates: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Posterior mean and standard deviation of the normalized objective at the candidates."""
+        K = matern(X, candidates, self.length_scale, self.nu)
+        alpha = cho_solve((L, True), y)
+        v = solve_triangular(L, K, lower=True)
+        variance = np.maximum(1.0 - (v**2).sum(axis=0), 0.0)
+        return K.T @ alpha, np.sqrt(variance)
+
+    def _decode(self, x: np.ndarray) -> dict:
+        """Map a point of the unit hypercube back to a SweepRun config."""
+        values = []
+        for param in self.params:
+            if param.type == HyperParameter.CONSTANT:
+                values.append(param.config["value"])
+                continue
+            value = param.ppf(x[self.params.param_names_to_index[param.name]])
+            values.append(value.item() if isinstance(value, np.generic) else value)
+        return _to_config(self.paths, values)
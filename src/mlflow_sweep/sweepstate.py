@@ -1,17 +1,21 @@
-import json
+import time
 import warnings
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 import mlflow
 from mlflow import MlflowClient
-from mlflow.entities import Run
+from mlflow.entities import Metric, Run
+from mlflow.store.tracking.rest_store import RestStore
+from mlflow.utils.rest_utils import http_request, verify_rest_response
+from mlflow.utils.search_utils import SearchUtils
 
+from mlflow_sweep.ledger import ProposalLedger
 from mlflow_sweep.models import ExtendedSweepRun, MetricHistory
 
 with warnings.catch_warnings():
     # sweep dependency still uses V1 API of pydantic, so we need to ignore the warning about config keys
     warnings.filterwarnings("ignore", category=UserWarning, message="Valid config keys have changed in V2.*")
-    from sweeps import RunState
+    from sweeps import RunState, SweepRun
 
 
 def status_mapping(mlflow_status: str) -> RunState:
@@ -27,10 +31,190 @@ def status_mapping(mlflow_status: str) -> RunState:
     return RunState.killed
 
 
+# MLflow statuses of runs that can still change and therefore need to be refetched on every refresh
+ACTIVE_STATUSES = ("RUNNING", "SCHEDULED")
+
+# Runs are fetched from slightly before the watermark to tolerate clock skew between agents on different hosts
+WATERMARK_SLACK_MS = 60_000
+
+# Maximum number of run ids in a single `attributes.run_id IN (...)` filter
+MAX_RUN_IDS_PER_SEARCH = 100
+
+
+# Tag of a child run that was stopped early by the early termination scheduler
+PRUNED_TAG = "sweep.pruned"
+
+# Tag of a child run that was terminated because it exceeded the timeout of the sweep
+TIMED_OUT_TAG = "sweep.timedOut"
+
+# Prefix of the tags on the parent sweep run holding the time of the last heartbeat of each agent
+HEARTBEAT_TAG_PREFIX = "sweep.heartbeat."
+
+# Prefix of the tags on the parent sweep run marking trials that were reclaimed from a dead agent
+RECLAIMED_TAG_PREFIX = "sweep.reclaimed."
+
+# Tag of a child run that was killed because its agent stopped sending heartbeats
+RECLAIMED_TAG = "sweep.reclaimed"
+
+# Limits of the bulk metric history endpoint of the MLflow tracking server
+MAX_RUN_IDS_PER_HISTORY_REQUEST = 100
+MAX_HISTORY_RESULTS = 25000
+
+# Number of concurrent requests when the store has no bulk interface
+HISTORY_FALLBACK_WORKERS = 8
+
+
+def load_metric_histories(client: MlflowClient, run_ids: list[str], metric_key: str) -> dict[str, list[Metric]]:
+    """Load the history of a metric for many runs using as few requests as possible.
+
+    Database-backed stores are queried directly through their bulk SQL query and remote tracking servers through the
+    bulk history endpoint, each for up to 100 runs at a time. Other stores fall back to concurrent per-run requests.
+
+    Args:
+        client: The MLflow client to use.
+        run_ids: The MLflow run IDs to load the history for.
+        metric_key: Name of the metric.
+
+    Returns:
+        A dictionary mapping each run ID to its metric history sorted by timestamp and step.
+
+    """
+    histories: dict[str, list[Metric]] = {run_id: [] for run_id in run_ids}
+    store = client._tracking_client.store
+
+    if hasattr(store, "get_metric_history_bulk"):
+
+        def fetch(chunk: list[str]) -> list[tuple[str, Metric]]:
+            metrics = store.get_metric_history_bulk(
+                run_ids=chunk, metric_key=metric_key, max_results=MAX_HISTORY_RESULTS
+            )
+            return [(m.run_id, m) for m in metrics]
+
+    elif isinstance(store, RestStore):
+        endpoint = "/ajax-api/2.0/mlflow/metrics/get-history-bulk"
+
+        def fetch(chunk: list[str]) -> list[tuple[str, Metric]]:
+            response = http_request(
+                host_creds=store.get_host_creds(),
+                endpoint=endpoint,
+                method="GET",
+                params={"run_id": chunk, "metric_key": metric_key, "max_results": MAX_HISTORY_RESULTS},
+            )
+            metrics = verify_rest_response(response, endpoint).json().get("metrics", [])
+            return [(m["run_id"], Metric(m["key"], m["value"], m["timestamp"], m.get("step", 0))) for m in metrics]
+
+    else:
+        with ThreadPoolExecutor(max_workers=HISTORY_FALLBACK_WORKERS) as pool:
+            results = pool.map(lambda run_id: client.get_metric_history(run_id, key=metric_key), run_ids)
+            histories.update(zip(run_ids, results))
+        return histories
+
+    pending = sorted(run_ids)
+    while pending:
+        chunk = pending[:MAX_RUN_IDS_PER_HISTORY_REQUEST]
+        metrics = fetch(chunk)
+        if len(metrics) < MAX_HISTORY_RESULTS:
+            for run_id, metric in metrics:
+                histories[run_id].append(metric)
+            pending = pending[len(chunk) :]
+            continue
+        # Results are truncated and sorted by run id, so only the last run in the response may be incomplete
+        last = metrics[-1][0]
+        for run_id, metric in metrics:
+            if run_id != last:
+                histories[run_id].append(metric)
+        if last == chunk[0]:
+            histories[last] = client.get_metric_history(last, key=metric_key)
+            pending = pending[1:]
+        else:
+            pending = pending[pending.index(last) :]
+    return histories
+
+
+def _same_point(a: Metric, b: Metric) -> bool:
+    """Whether two metric points are the same logged value."""
+    return (a.timestamp, a.step, a.value) == (b.timestamp, b.step, b.value)
+
+
+class MetricHistoryCursor:
+    """Incremental reader of the history of one metric for many runs.
+
+    The cursor remembers how many points it has read for each run, and on every poll only requests the points logged
+    since, starting one point early to verify that the history was only appended to. If it was not, or if the tracking
+    store ignored the offset, the full history is used instead. All runs are read in a single pass per poll: runs that
+    were never read are loaded in bulk with `load_metric_histories` and the others are read concurrently.
+
+    Args:
+        client: The MLflow client to use.
+        metric_key: Name of the metric.
+
+    """
+
+    def __init__(self, client: MlflowClient, metric_key: str):
+        self.client = client
+        self.metric_key = metric_key
+        self.histories: dict[str, list[Metric]] = {}
+
+    def poll(self, run_ids: list[str]) -> dict[str, list[Metric]]:
+        """Read the points logged since the previous poll of each run.
+
+        Args:
+            run_ids: The MLflow run IDs to poll.
+
+        Returns:
+            A dictionary mapping each run ID to its new points, the full history is available in `histories`.
+
+        """
+        unseen = [run_id for run_id in run_ids if run_id not in self.histories]
+        seen = [run_id for run_id in run_ids if run_id in self.histories]
+
+        new = load_metric_histories(self.client, unseen, self.metric_key) if unseen else {}
+        self.histories.update(new)
+        if seen:
+            with ThreadPoolExecutor(max_workers=HISTORY_FALLBACK_WORKERS) as pool:
+                new.update(zip(seen, pool.map(self._read_new, seen)))
+        return new
+
+    def _read_new(self, run_id: str) -> list[Metric]:
+        """Read the points of a run after the ones that have already been read."""
+        history = self.histories[run_id]
+        offset = max(len(history) - 1, 0)
+        points = list(
+            self.client._tracking_client.store.get_metric_history(
+                run_id, self.metric_key, page_token=SearchUtils.create_page_token(offset) if offset else None
+            )
+        )
+        if not history or (points and _same_point(points[0], history[offset])):
+            added = points[1:] if history else points
+            history.extend(added)
+            return added
+
+        # The store ignored the offset or earlier points changed, so the response or a new read is the full history
+        if points and len(points) >= len(history) and _same_point(points[0], history[0]):
+            full = points
+        else:
+            full = self.client.get_metric_history(run_id, key=self.metric_key)
+        added = full[len(history) :]
+        history[:] = full
+        return added
+
+
+def sweep_run_key(run: Run) -> str:
+    """Key used to index a child run, the sweepRunId tag set by the agent or the MLflow run ID as fallback."""
+    return run.data.tags.get("mlflow.sweepRunId") or run.info.run_id
+
+
+def is_reclaimed(run: Run) -> bool:
+    """Whether a child run was killed because the agent running its trial stopped sending heartbeats."""
+    return run.data.tags.get(RECLAIMED_TAG) == "true"
+
+
 class SweepState:
     """Class to manage the state of a sweep in MLflow.
 
     The SweepState class provides methods to retrieve, save, and manage SweepRuns associated with a given sweep_id.
+    Child runs are kept in an in-memory index keyed by their `mlflow.sweepRunId` tag, such that each refresh only
+    fetches runs created since the last watermark and runs that are still active.
 
     Args:
         sweep_id: The ID of the sweep to manage.
@@ -39,42 +223,249 @@ class SweepState:
     def __init__(self, sweep_id: str):
         self.sweep_id = sweep_id
         self.client = MlflowClient()
+        self._runs: dict[str, Run] = {}
+        self._watermark: int | None = None
+        self.ledger = ProposalLedger(sweep_id, self.client)
+        self._sweep_runs: dict[tuple[str, str, bool], ExtendedSweepRun] = {}
+        self._cursors: dict[str, MetricHistoryCursor] = {}
 
-    def get_all(self, with_metric: str = "") -> list[ExtendedSweepRun]:
-        """Retrieve all SweepRuns associated with the sweep_id."""
-        mlflow_runs: list[Run] = mlflow.search_runs(  # ty: ignore[invalid-assignment]
-            search_all_experiments=True,
-            filter_string=f"tag.mlflow.parentRunId = '{self.sweep_id}'",
-            output_format="list",
-        )
+    def refresh(self) -> list[Run]:
+        """Update the in-memory index of child runs.
 
-        parameters = self.get_parameters()
-        if with_metric != "":
-            metric_history = []
-            for run in mlflow_runs:
-                history = MetricHistory(
-                    run_id=run.data.tags.get("mlflow.sweepRunId"),
-                    metrics=[
-                        {with_metric: v.value} for v in self.client.get_metric_history(run.info.run_id, key=with_metric)
-                    ],
+        Only runs started after the last watermark and runs that were RUNNING or SCHEDULED at the previous refresh
+        are fetched from MLflow. Cached sweep runs of the changed runs are dropped and the proposals of new runs are
+        looked up in the ledger, such that `get_all` sees every change, also of refreshes made by other methods.
+
+        Returns:
+            The runs that were added or updated by this refresh.
+
+        """
+        filter_string = f"tag.mlflow.parentRunId = '{self.sweep_id}'"
+        if self._watermark is not None:
+            filter_string += f" AND attributes.start_time >= {self._watermark - WATERMARK_SLACK_MS}"
+        fetched = self._search(filter_string)
+
+        seen = {run.info.run_id for run in fetched}
+        active = [
+            run.info.run_id
+            for run in self._runs.values()
+            if run.info.status in ACTIVE_STATUSES and run.info.run_id not in seen
+        ]
+        for i in range(0, len(active), MAX_RUN_IDS_PER_SEARCH):
+            run_ids = ", ".join(f"'{run_id}'" for run_id in active[i : i + MAX_RUN_IDS_PER_SEARCH])
+            fetched += self._search(f"attributes.run_id IN ({run_ids})")
+
+        changed = []
+        for run in fetched:
+            key = sweep_run_key(run)
+            previous = self._runs.get(key)
+            if previous is not None and previous.info.status not in ACTIVE_STATUSES:
+                continue  # terminal runs never change
+            self._runs[key] = run
+            changed.append(run)
+            if self._watermark is None or run.info.start_time > self._watermark:
+                self._watermark = run.info.start_time
+
+        keys = {sweep_run_key(run) for run in changed}
+        if keys:
+            self._sweep_runs = {k: v for k, v in self._sweep_runs.items() if k[0] not in keys}
+        self.ledger.read([key for key in keys if key not in self.ledger])
+        return changed
+
+    def get_all(self, with_metric: str = "", summary_only: bool = False) -> list[ExtendedSweepRun]:
+        """Retrieve all SweepRuns associated with the sweep_id.
+
+        Runs that did not change since the previous call are served from the in-memory index without any further
+        requests to MLflow. Metric histories of the remaining runs are read through a `MetricHistoryCursor`, which
+        loads new runs in bulk and only requests the points logged since the previous call for the others.
+
+        Runs of trials that were reclaimed from dead agents are left out, their trial is proposed again under a new
+        sweep run ID and their KILLED status says nothing about its parameters.
+
+        Args:
+            with_metric: Name of a metric whose history should be attached to each run.
+            summary_only: If True, the history only contains the latest value of the metric taken from the run
+                summary, which requires no additional requests.
+
+        """
+        self.refresh()
+        # Skip runs not proposed by this sweep and runs of reclaimed trials
+        keys = [key for key in sorted(self._runs) if key in self.ledger and not is_reclaimed(self._runs[key])]
+        missing = [key for key in keys if (key, with_metric, summary_only) not in self._sweep_runs]
+
+        histories: dict[str, MetricHistory | None] = dict.fromkeys(missing)
+        if with_metric != "" and summary_only:
+            for key in missing:
+                metrics = self._runs[key].data.metrics
+                histories[key] = MetricHistory(
+                    run_id=key, metrics=[{with_metric: metrics[with_metric]}] if with_metric in metrics else []
                 )
-                metric_history.append(history)
+        elif with_metric != "" and missing:
+            # Runs that changed are polled together, only the points logged since the previous call are requested
+            run_ids = {self._runs[key].info.run_id: key for key in missing}
+            cursor = self._cursors.setdefault(with_metric, MetricHistoryCursor(self.client, with_metric))
+            cursor.poll(list(run_ids))
+            for run_id, key in run_ids.items():
+                histories[key] = MetricHistory(
+                    run_id=key, metrics=[{with_metric: v.value} for v in cursor.histories[run_id]]
+                )
+
+        for key, history in histories.items():
+            self._sweep_runs[key, with_metric, summary_only] = self.convert_from_mlflow_runinfo_to_sweep_run(
+                self._runs[key], self.ledger.get(key), history
+            )
+        return [self._sweep_runs[key, with_metric, summary_only] for key in keys]
+
+    def get_finished_since(self, end_time: int) -> list[ExtendedSweepRun]:
+        """Retrieve the runs of the sweep that reached a final state at or after the given end time.
+
+        Only the runs that ended since, with a slack for clock skew, are requested from MLflow, such that checking
+        for newly finished runs does not fetch the whole sweep. Runs of reclaimed trials are left out, see `get_all`.
+
+        Args:
+            end_time: End time in milliseconds, e.g. the latest end time seen before.
 
-            metric_history_sorted = sorted(metric_history, key=lambda x: x.run_id)
+        """
+        runs = self._search(
+            f"tag.mlflow.parentRunId = '{self.sweep_id}' AND attributes.end_time >= {end_time - WATERMARK_SLACK_MS}"
+        )
+        runs = [run for run in runs if run.info.status not in ACTIVE_STATUSES and not is_reclaimed(run)]
+        self.ledger.read([sweep_run_key(run) for run in runs])
+        return [
+            self.convert_from_mlflow_runinfo_to_sweep_run(run, self.ledger.get(sweep_run_key(run)))
+            for run in runs
+            if sweep_run_key(run) in self.ledger  # skip runs not proposed by this sweep
+        ]
 
-        mlflow_runs_sorted = sorted(mlflow_runs, key=lambda run: run.data.tags.get("mlflow.sweepRunId"))
-        parameters_sorted = sorted(parameters, key=lambda x: x["sweep_run_id"])
+    def get_active(self) -> list[ExtendedSweepRun]:
+        """Retrieve the runs of the sweep that are still running or scheduled, without their metric histories."""
+        runs = [
+            run
+            for status in ACTIVE_STATUSES
+            for run in self._search(f"tag.mlflow.parentRunId = '{self.sweep_id}' AND attributes.status = '{status}'")
+        ]
+        self.ledger.read([sweep_run_key(run) for run in runs])
+        return [
+            self.convert_from_mlflow_runinfo_to_sweep_run(run, self.ledger.get(sweep_run_key(run)))
+            for run in runs
+            if sweep_run_key(run) in self.ledger  # skip runs not proposed by this sweep
+        ]
 
-        if with_metric != "":
-            return [
-                self.convert_from_mlflow_runinfo_to_sweep_run(run, params, metrics)
-                for run, params, metrics in zip(mlflow_runs_sorted, parameters_sorted, metric_history_sorted)
-            ]
+    def get_pending(self) -> list[SweepRun]:
+        """Retrieve proposals that do not have a child run in MLflow yet.
+
+        These are typically trials whose process was just launched, they are returned as pending runs such that
+        the sampler can take them into account.
+        """
         return [
-            self.convert_from_mlflow_runinfo_to_sweep_run(run, params)
-            for run, params in zip(mlflow_runs_sorted, parameters_sorted)
+            SweepRun(config=self.convert_parameters(proposal), state=RunState.pending)
+            for proposal in self.ledger
+            if proposal["sweep_run_id"] not in self._runs
         ]
 
+    def get_tag(self, key: str) -> str | None:
+        """Read a tag of the parent sweep run, returns None if the tag is not set."""
+        return self.client.get_run(self.sweep_id).data.tags.get(key)
+
+    def set_tag(self, key: str, value) -> None:
+        """Set a tag on the parent sweep run."""
+        self.client.set_tag(self.sweep_id, key, value)
+
+    def mark_pruned(self, run_id: str) -> None:
+        """Record that a child run was stopped early, its status is set to KILLED and it is tagged as pruned.
+
+        Args:
+            run_id: The MLflow run ID of the child run.
+
+        """
+        self.client.set_tag(run_id, PRUNED_TAG, "true")
+        self.client.set_terminated(run_id, status="KILLED")
+
+    def mark_timed_out(self, sweep_run_id: str) -> None:
+        """Record that a trial exceeded its timeout, its child run is set to KILLED and tagged as timed out.
+
+        Nothing is recorded if the trial was terminated before it started a run.
+
+        Args:
+            sweep_run_id: The sweep run ID of the trial.
+
+        """
+        runs = self._search(f"tag.mlflow.sweepRunId = '{sweep_run_id}'")
+        for run in runs:
+            self.client.set_tag(run.info.run_id, TIMED_OUT_TAG, "true")
+            self.client.set_terminated(run.info.run_id, status="KILLED")
+
+    def heartbeat(self, agent_id: str) -> None:
+        """Record that an agent is alive, as a tag with the current time on the parent sweep run."""
+        self.set_tag(HEARTBEAT_TAG_PREFIX + agent_id, f"{time.time():.3f}")
+
+    def remove_heartbeat(self, agent_id: str) -> None:
+        """Remove the heartbeat tag of an agent that exited without leaving trials behind."""
+        self.client.delete_tag(self.sweep_id, HEARTBEAT_TAG_PREFIX + agent_id)
+
+    def get_heartbeats(self, tags: dict[str, str] | None = None) -> dict[str, float]:
+        """Time of the last heartbeat of each agent of the sweep."""
+        tags = self.client.get_run(self.sweep_id).data.tags if tags is None else tags
+        return {
+            k.removeprefix(HEARTBEAT_TAG_PREFIX): float(v)
+            for k, v in tags.items()
+            if k.startswith(HEARTBEAT_TAG_PREFIX)
+        }
+
+    def get_reclaimed(self, tags: dict[str, str] | None = None) -> set[str]:
+        """Sweep run IDs of the trials that were reclaimed from dead agents."""
+        tags = self.client.get_run(self.sweep_id).data.tags if tags is None else tags
+        return {k.removeprefix(RECLAIMED_TAG_PREFIX) for k in tags if k.startswith(RECLAIMED_TAG_PREFIX)}
+
+    def reclaim_stale(self, timeout: float, agent_id: str | None = None) -> list[dict]:
+        """Kill the runs of agents that stopped sending heartbeats, such that their trials can be proposed again.
+
+        A running child run is stale if the last heartbeat of the agent that launched it is older than `timeout`
+        seconds. Stale runs are set to KILLED and tagged, and their trial is marked as reclaimed on the parent run,
+        such that it no longer counts towards the run cap. Runs of agents that never sent a heartbeat are left alone.
+
+        To avoid that several agents reclaim the same trial, only the live agent with the smallest ID acts if
+        `agent_id` is given. A single controller can pass None to always act.
+
+        Args:
+            timeout: Seconds without a heartbeat after which an agent is considered dead.
+            agent_id: ID of the calling agent.
+
+        Returns:
+            The proposals of the reclaimed trials.
+
+        """
+        tags = self.client.get_run(self.sweep_id).data.tags
+        heartbeats = self.get_heartbeats(tags)
+        deadline = time.time() - timeout
+        live = [agent for agent, last in heartbeats.items() if last >= deadline]
+        if agent_id is not None and agent_id != min([*live, agent_id]):
+            return []
+
+        self.refresh()
+        reclaimed = self.get_reclaimed(tags)
+        proposals = []
+        for key, run in self._runs.items():
+            last = heartbeats.get(run.data.tags.get("mlflow.agentId", ""))
+            if run.info.status not in ACTIVE_STATUSES or key in reclaimed or last is None or last >= deadline:
+                continue
+            self.ledger.read([key])
+            proposal = self.ledger.get(key)
+            self.client.set_tag(run.info.run_id, RECLAIMED_TAG, "true")
+            self.client.set_terminated(run.info.run_id, status="KILLED")
+            self.set_tag(RECLAIMED_TAG_PREFIX + key, proposal["run"] if proposal is not None else "")
+            if proposal is not None:
+                proposals.append(proposal)
+        return proposals
+
+    def _search(self, filter_string: str) -> list[Run]:
+        """Search runs across all experiments with the given filter."""
+        return mlflow.search_runs(  # ty: ignore[invalid-return-type]
+            search_all_experiments=True,
+            filter_string=filter_string,
+            output_format="list",
+        )
+
     def get(self, run_id: str) -> ExtendedSweepRun:
         """Retrieve a SweepRun by its run_id.
 
@@ -119,24 +510,25 @@ class SweepState:
             An ExtendedSweepRun object containing the run and parameter information.
 
         """
-        params = {k: {"value": v} for k, v in params.items() if k not in ["run", "sweep_run_id"]}
         return ExtendedSweepRun(
             id=mlflow_run.info.run_id,
             name=mlflow_run.info.run_name,
             summaryMetrics=mlflow_run.data.metrics,  # ty: ignore[unknown-argument]
-            history=[] if metrics is None else metrics.metrics,
-            config=params,
+            sampledHistory=[] if metrics is None else metrics.metrics,  # ty: ignore[unknown-argument]
+            config=SweepState.convert_parameters(params),
             state=status_mapping(mlflow_run.info.status),
             start_time=mlflow_run.info.start_time,
             end_time=mlflow_run.info.end_time,
+            sweep_run_id=sweep_run_key(mlflow_run),
+            pruned=mlflow_run.data.tags.get(PRUNED_TAG) == "true",
         )
 
-    def get_parameters(self):
-        """Retrieve the proposed parameters for previous runs."""
-        if "proposed_parameters.json" not in [a.path for a in self.client.list_artifacts(self.sweep_id)]:
-            return []
-        artifact_uri = self.client.get_run(self.sweep_id).info.artifact_uri.replace("file://", "")
-        table_path = Path(artifact_uri) / "proposed_parameters.json"
-        with Path.open(table_path) as file:
-            previous_runs: dict = json.load(file)
-        return [{previous_runs["columns"][i]: row[i] for i in range(len(row))} for row in previous_runs["data"]]
+    @staticmethod
+    def convert_parameters(params: dict) -> dict:
+        """Convert proposed parameters to the config format of a SweepRun."""
+        return {k: {"value": v} for k, v in params.items() if k not in ["run", "sweep_run_id"]}
+
+    def get_parameters(self) -> list[dict]:
+        """Retrieve the proposed parameters for previous runs, without the trials that were reclaimed."""
+        reclaimed = self.get_reclaimed()
+        return [proposal for proposal in self.ledger.read_all() if proposal["sweep_run_id"] not in reclaimed]
@@ -0,0 +1,144 @@
+import re
+import shlex
+from functools import cached_property
+
+# Matches a ${name} placeholder, where name may contain dots to refer to nested parameters
+PLACEHOLDER = re.compile(r"\$\{([^{}]+)\}")
+
+# Quote a value for the shell, depending on the quote character that encloses its placeholder in the template
+QUOTERS = {
+    "": shlex.quote,
+    "'": lambda value: value.replace("'", "'\\''"),
+    '"': lambda value: re.sub(r'([\\"$`])', r"\\\1", value),
+}
+
+
+def parameter_names(parameters: dict[str, dict], prefix: str = "") -> set[str]:
+    """Names that can be used as placeholders for the parameters of a sweep, nested parameters are joined by dots.
+
+    Examples:
+        >>> sorted(parameter_names({"lr": {"values": [0.1]}, "model": {"parameters": {"depth": {"value": 2}}}}))
+        ['lr', 'model', 'model.depth']
+    """
+    names = set()
+    for name, config in parameters.items():
+        names.add(prefix + name)
+        if isinstance(config, dict) and isinstance(config.get("parameters"), dict):
+            names |= parameter_names(config["parameters"], prefix=f"{prefix}{name}.")
+    return names
+
+
+class CommandTemplate:
+    """Command with ${parameter} placeholders that is compiled once and rendered in a single pass.
+
+    The template is split into literal text and placeholders when it is created, such that rendering a command is
+    a single join instead of one regex substitution per parameter. Placeholders can refer to nested parameters with
+    dots, e.g. `${model.depth}`. Values are quoted for the shell where needed, or the command can be rendered as an
+    argument list that can be executed without a shell. Placeholders that are already inside quotes in the template,
+    e.g. `"${name}"`, are only escaped for those quotes instead of being quoted again.
+
+    If the names of the parameters are given, placeholders that do not match any of them are left in the command as
+    they are, such that the shell can expand environment variables written as `${NAME}`. `validate` rejects them.
+
+    Args:
+        template (str): The command template.
+        parameters (list[str] | set[str] | None): Valid placeholder names, unknown placeholders are left unrendered.
+
+    Examples:
+        >>> template = CommandTemplate("python train.py --lr ${lr} --name ${name}")
+        >>> template.render({"lr": 0.01, "name": "my run"})
+        "python train.py --lr 0.01 --name 'my run'"
+        >>> template.render_argv({"lr": 0.01, "name": "my run"})
+        ['python', 'train.py', '--lr', '0.01', '--name', 'my run']
+        >>> CommandTemplate("python train.py --depth=${model.depth}").render({"model": {"depth": 3}})
+        'python train.py --depth=3'
+        >>> CommandTemplate('python train.py --name "${name}"').render({"name": "my run"})
+        'python train.py --name "my run"'
+        >>> CommandTemplate("python train.py --lr ${lr} --out ${HOME}", ["lr"]).render({"lr": 0.01})
+        'python train.py --lr 0.01 --out ${HOME}'
+    """
+
+    def __init__(self, template: str, parameters: list[str] | set[str] | None = None) -> None:
+        self.template = template
+        self.segments = self._compile(template)
+        self.placeholders = self.segments[1::2]
+        self.quote_contexts = self._quote_contexts(self.segments)
+        self.unknown = sorted(set(self.placeholders) - set(parameters)) if parameters is not None else []
+
+    def validate(self) -> None:
+        """Raise an error if the template contains placeholders that do not match any parameter."""
+        if self.unknown:
+            raise ValueError(
+                f"Command contains placeholders {self.unknown} that do not match any parameter of the sweep. "
+                "Environment variables can be referred to as $NAME instead of ${NAME}."
+            )
+
+    @staticmethod
+    def _compile(template: str) -> list[str]:
+        """Split a template into alternating literal text and placeholder names, starting with literal text."""
+        return PLACEHOLDER.split(template)
+
+    @staticmethod
+    def _quote_contexts(segments: list[str]) -> list[str]:
+        """Quote character of the shell that encloses each placeholder, empty if it is not inside quotes."""
+        contexts = []
+        quote = ""
+        escaped = False
+        for i, segment in enumerate(segments):
+            if i % 2:
+                contexts.append(quote)
+                continue
+            for char in segment:
+                if escaped:
+                    escaped = False
+                elif char == "\\" and quote != "'":
+                    escaped = True
+                elif quote and char == quote:
+                    quote = ""
+                elif not quote and char in "'\"":
+                    quote = char
+        return contexts
+
+    @cached_property
+    def argv_segments(self) -> list[list[str]]:
+        """Compiled segments of each shell word of the template."""
+        return [self._compile(word) for word in shlex.split(self.template)]
+
+    @staticmethod
+    def lookup(parameters: dict, name: str):
+        """Get the value of a placeholder, following dots into nested parameters."""
+        if name in parameters:
+            return parameters[name]
+        value = parameters
+        for key in name.split("."):
+            if not isinstance(value, dict) or key not in value:
+                raise KeyError(f"No value for placeholder ${{{name}}}")
+            value = value[key]
+        return value
+
+    def render(self, parameters: dict, quote: bool = True) -> str:
+        """Render the command as a string for the shell.
+
+        Args:
+            parameters: The values of the parameters.
+            quote: Whether to quote values that contain whitespace or shell metacharacters. Values of placeholders
+                inside quotes are escaped for the enclosing quotes instead.
+
+        Returns:
+            The rendered command.
+        """
+        converters = [QUOTERS[context] if quote else str for context in self.quote_contexts]
+        return self._render(self.segments, parameters, converters)
+
+    def render_argv(self, parameters: dict) -> list[str]:
+        """Render the command as a list of arguments, such that it can be executed without a shell."""
+        return [self._render(word, parameters, [str] * (len(word) // 2)) for word in self.argv_segments]
+
+    def _render(self, segments: list[str], parameters: dict, converters: list) -> str:
+        parts = segments.copy()
+        for i in range(1, len(parts), 2):
+            if parts[i] in self.unknown:
+                parts[i] = f"${{{parts[i]}}}"
+                continue
+            parts[i] = converters[i // 2](str(self.lookup(parameters, parts[i])))
+        return "".join(parts)
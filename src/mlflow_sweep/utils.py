@@ -1,25 +1,208 @@
 import datetime
+import math
+import time
+from typing import SupportsFloat
 
 import numpy as np
 from scipy.stats import pearsonr, spearmanr
+from sklearn.compose import ColumnTransformer
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.inspection import permutation_importance
+from sklearn.inspection import partial_dependence, permutation_importance
+from sklearn.linear_model import Ridge
+from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import OneHotEncoder
 
+# Number of metric quantile bins used to stratify subsamples of large sweeps
+SUBSAMPLE_STRATA = 10
+
+# Methods available to calculate parameter importance
+IMPORTANCE_METHODS = ("forest", "fanova", "linear")
+
+# Number of grid points at which the main effect of a parameter is evaluated by the fanova method
+FANOVA_GRID_RESOLUTION = 50
+
+# Number of runs that are timed to estimate how many runs fit in a time budget
+PILOT_ROWS = 500
+
+
+def stratified_subsample(metric_value: np.ndarray, size: int, seed: int | None = None) -> np.ndarray:
+    """Select a subsample of runs that preserves the distribution of the metric.
+
+    The runs are divided into quantile bins of the metric and each bin is sampled in proportion to its size, such that
+    both the best and the worst runs of a sweep remain represented in the subsample.
+
+    Args:
+        metric_value (np.ndarray): Array of metric values.
+        size (int): Number of runs to select.
+        seed (int | None): Seed of the random generator.
+
+    Returns:
+        np.ndarray: Sorted indices of the selected runs.
+
+    Examples:
+        >>> metric = np.arange(100.0)
+        >>> indices = stratified_subsample(metric, 10, seed=0)
+        >>> len(indices), len(np.unique(indices // 10))
+        (10, 10)
+    """
+    n = len(metric_value)
+    if size >= n:
+        return np.arange(n)
+    rng = np.random.default_rng(seed)
+    edges = np.quantile(metric_value, np.linspace(0, 1, SUBSAMPLE_STRATA + 1)[1:-1])
+    strata = np.searchsorted(edges, metric_value, side="right")
+    counts = np.bincount(strata, minlength=SUBSAMPLE_STRATA)
+
+    # Allocate the subsample proportionally, giving leftover rows to the strata with the largest remainders
+    quota = counts * size / n
+    allocation = np.floor(quota).astype(int)
+    leftover = size - allocation.sum()
+    allocation[np.argsort(allocation - quota)[:leftover]] += 1
+
+    selected = [
+        rng.choice(np.flatnonzero(strata == stratum), size=k, replace=False)
+        for stratum, k in enumerate(allocation)
+        if k > 0
+    ]
+    return np.sort(np.concatenate(selected))
+
+
+def _budget_rows(model, data: np.ndarray, metric_value: np.ndarray, time_budget: float, n_repeats: int) -> int:
+    """Estimate how many runs can be analyzed within a time budget by timing the analysis on a pilot sample."""
+    n = len(metric_value)
+    pilot = min(n, PILOT_ROWS)
+    start = time.perf_counter()
+    model.fit(data[:pilot], metric_value[:pilot])
+    fitted = time.perf_counter()
+    model.predict(data[:pilot])
+    predicted = time.perf_counter()
+
+    # Fitting and every permutation scale roughly linearly with the number of runs
+    estimate = (fitted - start) + n_repeats * data.shape[1] * (predicted - fitted)
+    return max(pilot, int(pilot * time_budget / max(estimate, 1e-9)))
 
-def calculate_feature_importance_and_correlation(
-    metric_value: np.ndarray, parameter_values: dict[str, np.ndarray]
-) -> dict:
-    """Calculate feature importance and correlation coefficients for hyperparameters.
+
+def _subsample_runs(
+    model,
+    data: np.ndarray,
+    metric_value: np.ndarray,
+    max_rows: int | None,
+    time_budget: float | None,
+    n_repeats: int,
+    seed: int | None,
+) -> np.ndarray:
+    """Indices of the runs to analyze, limited by the maximum number of runs and the time budget."""
+    rows = len(metric_value)
+    if max_rows is not None:
+        rows = min(rows, max_rows)
+    if time_budget is not None:
+        rows = min(rows, _budget_rows(model, data, metric_value, time_budget, n_repeats))
+    return stratified_subsample(metric_value, rows, seed=seed)
+
+
+def _group_columns(encoder: ColumnTransformer, n_params: int) -> list[slice]:
+    """Columns of the encoded data belonging to each parameter."""
+    return [encoder.output_indices_[f"p{i}"] for i in range(n_params)]
+
+
+def _forest_importance(
+    model: Pipeline, data: np.ndarray, target: np.ndarray, n_repeats: int, random_state: int | None
+) -> tuple[np.ndarray, np.ndarray]:
+    """Impurity and permutation importance of a random forest fitted on the encoded parameters."""
+    model.fit(data, target)
+    encoded_importances = model.named_steps["forest"].feature_importances_
+    columns = _group_columns(model.named_steps["encode"], data.shape[1])
+    importances = np.array([encoded_importances[c].sum() for c in columns])
+
+    # The forest predicts with all cores, permuting the parameters in worker processes would oversubscribe them
+    perm = permutation_importance(model, data, target, n_repeats=n_repeats, random_state=random_state)
+    return importances, perm["importances_mean"]
+
+
+def _fanova_importance(
+    forest: RandomForestRegressor, numeric: np.ndarray, target: np.ndarray
+) -> tuple[np.ndarray, None]:
+    """Fraction of the variance of a random forest explained by the main effect of each parameter.
+
+    As in functional ANOVA, the main effect of a parameter is its marginal prediction with the other parameters
+    integrated out, evaluated on an even grid over the range of the parameter. The marginals are computed by
+    traversing the trees, which does not depend on the number of runs. Permutation importance is not estimated.
+    """
+    forest.fit(numeric, target)
+    total_variance = forest.predict(numeric).var()
+    importances = np.zeros(numeric.shape[1])
+    for i in range(numeric.shape[1]):
+        marginal = partial_dependence(
+            forest, numeric, [i], percentiles=(0, 1), grid_resolution=FANOVA_GRID_RESOLUTION, method="recursion"
+        )
+        importances[i] = marginal["average"].var() / total_variance if total_variance > 0 else 0.0
+    return importances, None
+
+
+def _linear_importance(model: Pipeline, data: np.ndarray, target: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Importance from the standardized coefficients of a ridge regression.
+
+    The importance of a parameter is its share of the summed standard deviations of the contributions of all
+    parameters to the prediction. For a linear model the expected drop in R^2 when a parameter is permuted is twice the
+    variance of its contribution divided by the variance of the metric, which is reported as permutation importance.
+    """
+    encoded = model.named_steps["encode"].fit_transform(data).astype(float)
+    std = encoded.std(axis=0)
+    standardized = (encoded - encoded.mean(axis=0)) / np.where(std > 0, std, 1)
+    target_std = target.std() if target.std() > 0 else 1.0
+    ridge = model.named_steps["ridge"].fit(standardized, (target - target.mean()) / target_std)
+
+    columns = _group_columns(model.named_steps["encode"], data.shape[1])
+    contribution_variance = np.array([(standardized[:, c] @ ridge.coef_[c]).var() for c in columns])
+    contribution_std = np.sqrt(contribution_variance)
+    total = contribution_std.sum()
+    importances = contribution_std / total if total > 0 else np.zeros(len(columns))
+    return importances, 2 * contribution_variance
+
+
+def calculate_feature_importance_with_settings(
+    metric_value: np.ndarray,
+    parameter_values: dict[str, np.ndarray],
+    n_estimators: int = 100,
+    n_repeats: int = 30,
+    n_jobs: int | None = -1,
+    max_rows: int | None = None,
+    time_budget: float | None = None,
+    random_state: int | None = None,
+    method: str = "forest",
+) -> tuple[dict, dict]:
+    """Calculate feature importance and correlation coefficients for hyperparameters, and the settings used for it.
+
+    A random forest is fitted to predict the metric from the parameters, and both its impurity based importances and
+    permutation importances are reported. Categorical parameters are one-hot encoded for the forest, their importance
+    is the sum over their encoded columns and they are permuted as a whole. Correlations of categorical parameters are
+    calculated on the index of their sorted values. Scores that cannot be calculated are None, e.g. the correlations
+    of a parameter with a single value.
+
+    Two faster methods are available for very large sweeps. With `method="fanova"` the importance is the fraction of
+    the variance of the forest explained by each parameter on its own, as in functional ANOVA, and no permutation
+    importance is calculated. With `method="linear"` the importance follows from the standardized coefficients of a
+    ridge regression, for which the permutation importance has a closed form.
+
+    For large sweeps the analysis can be limited to a stratified subsample of the runs, either by giving the maximum
+    number of runs directly or by giving a time budget from which the number of runs is estimated.
 
     Args:
         metric_value (np.ndarray): Array of metric values (e.g., validation loss).
         parameter_values (dict[str, np.ndarray]): Dictionary where keys are parameter names and values are arrays of
             parameter values.
+        n_estimators (int): Number of trees in the random forest.
+        n_repeats (int): Number of times each parameter is permuted.
+        n_jobs (int | None): Number of cores used to fit and evaluate the forest, -1 uses all cores.
+        max_rows (int | None): Maximum number of runs to analyze, larger sweeps are subsampled.
+        time_budget (float | None): Approximate number of seconds the analysis may take, larger sweeps are subsampled.
+        random_state (int | None): Seed of the forest, the permutations and the subsampling.
+        method (str): Importance method, one of "forest", "fanova" or "linear".
 
     Returns:
-        dict: Dictionary with parameter names as keys and dictionaries containing importance,
-              permutation importance, and correlation metrics as values.
+        tuple[dict, dict]: Dictionary with parameter names as keys and dictionaries containing importance,
+              permutation importance, and correlation metrics as values, and a dictionary with the settings used,
+              including the number of runs analyzed.
 
     Examples:
         >>> import numpy as np
@@ -29,11 +212,12 @@ def calculate_feature_importance_and_correlation(
         ...     'learning_rate': np.array([0.01, 0.02, 0.01, 0.03, 0.02]),
         ...     'batch_size': np.array([32, 64, 32, 128, 64])
         ... }
-        >>> result = calculate_feature_importance_and_correlation(metric, params)
-        >>> sorted(result.keys())
-        ['batch_size', 'learning_rate']
-        >>> all(k in result['learning_rate'] for k in ['importance', 'permutation_importance', 'pearson', 'spearman'])
-        True
+        >>> _, settings = calculate_feature_importance_with_settings(metric, params, max_rows=4)
+        >>> settings["rows_used"], settings["rows_total"]
+        (4, 5)
+        >>> result, _ = calculate_feature_importance_with_settings(metric, params, method="linear")
+        >>> round(result["learning_rate"]["importance"] + result["batch_size"]["importance"], 6)
+        1.0
     """
     # Check for empty parameter set
     if not parameter_values:
@@ -46,44 +230,145 @@ def calculate_feature_importance_and_correlation(
                 f"Parameter '{param_name}' has {len(param_array)} values, but metric has {len(metric_value)} values"
             )
 
-    # Encode categorical parameters
-    encoded_params = {}
-    encoders = {}
+    start = time.perf_counter()
+    metric_value = np.asarray(metric_value, dtype=float)
+    names = list(parameter_values)
 
-    for param_name, param_array in parameter_values.items():
+    # Encode categorical parameters, one transformer per parameter keeps track of the columns of each parameter
+    transformers = []
+    numeric = np.empty((len(metric_value), len(names)))
+    for i, param_array in enumerate(parameter_values.values()):
         if param_array.dtype.kind in {"U", "S", "O"}:  # Check for string or object type
-            encoder = OneHotEncoder(handle_unknown="ignore", sparse_output=False)
-            encoded = encoder.fit_transform(param_array.reshape(-1, 1))
-            encoders[param_name] = encoder
-            for i, category in enumerate(encoder.categories_[0]):
-                encoded_params[f"{param_name}_{category}"] = encoded[:, i]
+            transformers.append((f"p{i}", OneHotEncoder(handle_unknown="ignore", sparse_output=False), [i]))
+            numeric[:, i] = np.unique(param_array.astype(str), return_inverse=True)[1]
         else:
-            encoded_params[param_name] = param_array
-
-    data = np.column_stack(list(encoded_params.values()))
-
-    model = RandomForestRegressor()
-    model.fit(data, metric_value)
-    importances = model.feature_importances_
+            transformers.append((f"p{i}", "passthrough", [i]))
+            numeric[:, i] = param_array
+    data = np.empty((len(metric_value), len(names)), dtype=object)
+    for i, param_array in enumerate(parameter_values.values()):
+        data[:, i] = param_array
 
-    perm = permutation_importance(model, data, metric_value, n_repeats=30)
-    perm_importances = perm["importances_mean"]
+    encoder = ColumnTransformer(transformers)
+    forest = RandomForestRegressor(n_estimators=n_estimators, n_jobs=n_jobs, random_state=random_state)
+    if method == "forest":
+        pipeline = Pipeline([("encode", encoder), ("forest", forest)])
+        indices = _subsample_runs(pipeline, data, metric_value, max_rows, time_budget, n_repeats, random_state)
+        importances, perm_importances = _forest_importance(
+            pipeline, data[indices], metric_value[indices], n_repeats, random_state
+        )
+    elif method == "fanova":
+        indices = _subsample_runs(forest, numeric, metric_value, max_rows, time_budget, 0, random_state)
+        importances, perm_importances = _fanova_importance(forest, numeric[indices], metric_value[indices])
+    elif method == "linear":
+        pipeline = Pipeline([("encode", encoder), ("ridge", Ridge())])
+        indices = _subsample_runs(pipeline, data, metric_value, max_rows, time_budget, 0, random_state)
+        importances, perm_importances = _linear_importance(pipeline, data[indices], metric_value[indices])
+    else:
+        raise ValueError(f"Unknown importance method '{method}', expected one of {IMPORTANCE_METHODS}")
+    target = metric_value[indices]
 
     correlations = {}
-    for i, param in enumerate(parameter_values.keys()):
-        pearson_corr, _ = pearsonr(data[:, i], metric_value)
-        spearman_corr, _ = spearmanr(data[:, i], metric_value)
+    for i, param in enumerate(names):
+        pearson_corr, _ = pearsonr(numeric[indices, i], target)
+        spearman_corr, _ = spearmanr(numeric[indices, i], target)
         correlations[param] = {"pearson": pearson_corr, "spearman": spearman_corr}
 
-    return {
+    results = {
         k: {
-            "importance": float(v),
-            "permutation_importance": float(perm_importances[i]),
-            "pearson": float(correlations[k]["pearson"]),
-            "spearman": float(correlations[k]["spearman"]),
+            "importance": _finite_or_none(importances[i]),
+            "permutation_importance": _finite_or_none(perm_importances[i]) if perm_importances is not None else None,
+            "pearson": _finite_or_none(correlations[k]["pearson"]),
+            "spearman": _finite_or_none(correlations[k]["spearman"]),
         }
-        for i, (k, v) in enumerate(zip(parameter_values.keys(), importances))
+        for i, k in enumerate(names)
     }
+    settings = {
+        "method": method,
+        "n_estimators": n_estimators,
+        "n_repeats": n_repeats,
+        "n_jobs": n_jobs,
+        "max_rows": max_rows,
+        "time_budget": time_budget,
+        "random_state": random_state,
+        "rows_total": len(metric_value),
+        "rows_used": len(indices),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    return results, settings
+
+
+def _finite_or_none(value: SupportsFloat) -> float | None:
+    """The value as a float, or None if it is NaN or infinite, which cannot be written to JSON."""
+    number = float(value)
+    return number if math.isfinite(number) else None
+
+
+def describe_importance_settings(settings: dict) -> str:
+    """Describe the analysis of `calculate_feature_importance_with_settings` from the settings it returned.
+
+    Examples:
+        >>> settings = {"method": "fanova", "n_estimators": 100, "n_repeats": 30}
+        >>> describe_importance_settings(settings | {"rows_used": 5, "rows_total": 5, "seconds": 1})
+        'Analyzed 5 of 5 runs with the fanova method (100 trees, no permutation importance) in 1.0s'
+    """
+    method = settings["method"]
+    if method == "forest":
+        details = f"{settings['n_estimators']} trees, {settings['n_repeats']} permutation repeats"
+    elif method == "fanova":
+        details = f"{settings['n_estimators']} trees, no permutation importance"
+    else:
+        details = "ridge regression, closed-form permutation importance"
+    return (
+        f"Analyzed {settings['rows_used']} of {settings['rows_total']} runs with the {method} method ({details}) "
+        f"in {settings['seconds']:.1f}s"
+    )
+
+
+def calculate_feature_importance_and_correlation(
+    metric_value: np.ndarray,
+    parameter_values: dict[str, np.ndarray],
+    n_estimators: int = 100,
+    n_repeats: int = 30,
+    n_jobs: int | None = -1,
+    max_rows: int | None = None,
+    time_budget: float | None = None,
+    random_state: int | None = None,
+    method: str = "forest",
+) -> dict:
+    """Calculate feature importance and correlation coefficients for hyperparameters.
+
+    See `calculate_feature_importance_with_settings` for the importance methods and the options of the analysis.
+
+    Returns:
+        dict: Dictionary with parameter names as keys and dictionaries containing importance,
+              permutation importance, and correlation metrics as values.
+
+    Examples:
+        >>> import numpy as np
+        >>> np.random.seed(42)  # For reproducibility
+        >>> metric = np.array([0.1, 0.2, 0.15, 0.25, 0.3])
+        >>> params = {
+        ...     'learning_rate': np.array([0.01, 0.02, 0.01, 0.03, 0.02]),
+        ...     'batch_size': np.array([32, 64, 32, 128, 64])
+        ... }
+        >>> result = calculate_feature_importance_and_correlation(metric, params)
+        >>> sorted(result.keys())
+        ['batch_size', 'learning_rate']
+        >>> all(k in result['learning_rate'] for k in ['importance', 'permutation_importance', 'pearson', 'spearman'])
+        True
+    """
+    results, _ = calculate_feature_importance_with_settings(
+        metric_value,
+        parameter_values,
+        n_estimators=n_estimators,
+        n_repeats=n_repeats,
+        n_jobs=n_jobs,
+        max_rows=max_rows,
+        time_budget=time_budget,
+        random_state=random_state,
+        method=method,
+    )
+    return results
 
 
 def current_time_convert(ts_ms: int) -> str:
@@ -0,0 +1,147 @@
+import json
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+
+from mlflow_sweep.coordinator import LOCK_TIMEOUT, get_coordinator_path
+
+# Tag on the parent sweep run marking that its proposals were materialized in a queue at init
+QUEUE_TAG = "sweep.queue"
+
+# States of the entries of a queue
+PENDING = "pending"
+CLAIMED = "claimed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    sweep_id TEXT NOT NULL,
+    run INTEGER NOT NULL,
+    command TEXT NOT NULL,
+    proposal TEXT NOT NULL,
+    status TEXT NOT NULL,
+    agent_id TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (sweep_id, run)
+);
+CREATE INDEX IF NOT EXISTS queue_status ON queue (sweep_id, status, run);
+"""
+
+
+class ProposalQueue:
+    """Queue of proposals computed up front, claimed by the agents of a sweep from a SQLite database.
+
+    Random and grid sweeps do not depend on the results of previous runs, such that all their proposals can be
+    materialized when the sweep is initialized. Agents then claim the next pending entries in a single write
+    transaction, which is an indexed lookup that neither consults the run history nor the tracking server, and mark
+    them with their final status when the trial has finished. The queue is stored in the same database as the
+    `SlotCoordinator`.
+
+    Args:
+        sweep_id: The ID of the parent sweep run.
+        agent_id: ID of the agent, recorded with the entries it claims.
+        path: Path of the database, see `get_coordinator_path` if not provided.
+
+    Examples:
+        >>> import tempfile
+        >>> queue = ProposalQueue("sweep", path=Path(tempfile.mkdtemp()) / "coordinator.db")
+        >>> queue.put([("echo 1", {"run": 1, "sweep_run_id": "a"}), ("echo 2", {"run": 2, "sweep_run_id": "b"})])
+        >>> queue.claim(1)
+        [('echo 1', {'run': 1, 'sweep_run_id': 'a'})]
+        >>> queue.counts()
+        {'claimed': 1, 'pending': 1}
+    """
+
+    def __init__(self, sweep_id: str, agent_id: str | None = None, path: Path | None = None) -> None:
+        self.sweep_id = sweep_id
+        self.agent_id = agent_id
+        self.path = Path(path) if path is not None else get_coordinator_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, isolation_level=None)
+
+    def put(self, proposals: list[tuple[str | list[str], dict]]) -> None:
+        """Materialize the proposals of the sweep, replacing any entries from an earlier call.
+
+        Args:
+            proposals: The (command, parameters) tuples, the parameters must contain a unique `run` number.
+
+        """
+        rows = [
+            (self.sweep_id, proposal["run"], json.dumps(command), json.dumps(proposal), PENDING, None, time.time())
+            for command, proposal in proposals
+        ]
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute("DELETE FROM queue WHERE sweep_id = ?", (self.sweep_id,))
+                connection.executemany("INSERT INTO queue VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def exists(self) -> bool:
+        """Whether the queue of the sweep has been materialized in the database."""
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT 1 FROM queue WHERE sweep_id = ? LIMIT 1", (self.sweep_id,)).fetchone()
+        return row is not None
+
+    def claim(self, k: int) -> list[tuple[str | list[str], dict]]:
+        """Claim the next k pending entries in order of their run number.
+
+        Returns:
+            The claimed (command, parameters) tuples, fewer than k if the queue is drained.
+
+        """
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")  # take the write lock before reading, so no entry is claimed twice
+            try:
+                rows = connection.execute(
+                    "SELECT run, command, proposal FROM queue WHERE sweep_id = ? AND status = ? ORDER BY run LIMIT ?",
+                    (self.sweep_id, PENDING, k),
+                ).fetchall()
+                connection.executemany(
+                    "UPDATE queue SET status = ?, agent_id = ?, updated_at = ? WHERE sweep_id = ? AND run = ?",
+                    [(CLAIMED, self.agent_id, time.time(), self.sweep_id, run) for run, _, _ in rows],
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return [(json.loads(command), json.loads(proposal)) for _, command, proposal in rows]
+
+    def complete(self, run: int, status: str) -> None:
+        """Mark a claimed entry with the final status of its trial, e.g. `finished`, `failed` or `pruned`."""
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE queue SET status = ?, updated_at = ? WHERE sweep_id = ? AND run = ?",
+                (status, time.time(), self.sweep_id, run),
+            )
+
+    def requeue(self, proposal: dict) -> bool:
+        """Put a claimed entry back in the queue with new parameters, e.g. a new sweep run ID after its agent died.
+
+        Returns:
+            Whether the entry was claimed and has been put back, False if another agent already did so.
+
+        """
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                "UPDATE queue SET status = ?, proposal = ?, agent_id = NULL, updated_at = ? "
+                "WHERE sweep_id = ? AND run = ? AND status = ?",
+                (PENDING, json.dumps(proposal), time.time(), self.sweep_id, proposal["run"], CLAIMED),
+            )
+        return cursor.rowcount > 0
+
+    def counts(self) -> dict[str, int]:
+        """Number of entries of the sweep per status."""
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT status, COUNT(*) FROM queue WHERE sweep_id = ? GROUP BY status ORDER BY status",
+                (self.sweep_id,),
+            ).fetchall()
+        return dict(rows)
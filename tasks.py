@@ -32,6 +32,12 @@ def tests(ctx: Context) -> None:
     ctx.run("uv run coverage report -i -m", echo=True, pty=True)
 
 
+@task(help={"sizes": "Comma separated number of child runs per benchmarked sweep"})
+def benchmark(ctx: Context, sizes: str = "100,1000,10000") -> None:
+    """Benchmark the agent and finalize overhead against a local sqlite tracking store."""
+    ctx.run(f"uv run python benchmarks/agent_overhead.py --sizes {sizes.replace(',', ' ')}", echo=True, pty=True)
+
+
 @task
 def check(ctx: Context) -> None:
     """Check code with pre-commit."""
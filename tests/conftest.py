@@ -0,0 +1,11 @@
+import pytest
+
+from mlflow_sweep.artifacts import CACHE_DIR_ENV
+
+
+@pytest.fixture(autouse=True)
+def artifact_cache_dir(tmp_path_factory, monkeypatch):
+    """Use a fresh artifact cache per test instead of the cache in the home directory."""
+    cache_dir = tmp_path_factory.mktemp("artifact_cache")
+    monkeypatch.setenv(CACHE_DIR_ENV, str(cache_dir))
+    return cache_dir
@@ -0,0 +1,32 @@
+import pytest
+from mlflow.exceptions import MlflowException
+
+from mlflow_sweep.artifacts import cache_path, load_text_artifact
+
+
+def test_load_text_artifact_caches_by_run_and_path(tmp_path, artifact_cache_dir):
+    (tmp_path / "config.yaml").write_text("a: 1")
+
+    assert load_text_artifact("run-a", "config.yaml", f"file://{tmp_path}", cache=True) == "a: 1"
+    assert cache_path("run-a", "config.yaml").is_relative_to(artifact_cache_dir)
+    assert cache_path("run-a", "config.yaml").read_text() == "a: 1"
+    assert not cache_path("run-b", "config.yaml").exists()
+
+    (tmp_path / "config.yaml").write_text("a: 2")
+    assert load_text_artifact("run-a", "config.yaml", f"file://{tmp_path}", cache=True) == "a: 1"
+    assert load_text_artifact("run-b", "config.yaml", f"file://{tmp_path}", cache=True) == "a: 2"
+
+
+def test_load_text_artifact_without_cache(tmp_path):
+    """Test that artifacts are read from the artifact store unless caching is asked for."""
+    (tmp_path / "table.json").write_text("1")
+    assert load_text_artifact("run-a", "table.json", f"file://{tmp_path}") == "1"
+
+    (tmp_path / "table.json").write_text("2")
+    assert load_text_artifact("run-a", "table.json", f"file://{tmp_path}") == "2"
+    assert not cache_path("run-a", "table.json").exists()
+
+
+def test_load_missing_artifact(tmp_path):
+    with pytest.raises(MlflowException, match="No such artifact"):
+        load_text_artifact("run-a", "missing.yaml", f"file://{tmp_path}")
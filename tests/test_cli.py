@@ -51,11 +51,16 @@ def mock_sweep_group():
 
     @sweep.command("init")
     @click.argument("config_path", type=click.Path(exists=True, dir_okay=False))
-    def init(config_path):
+    @click.option(
+        "--queue",
+        is_flag=True,
+        help="Compute all proposals of a random or grid sweep up front and let agents claim them from a queue",
+    )
+    def init(config_path, queue):
         """Initialize a new sweep configuration."""
         from mlflow_sweep.commands import init_command
 
-        init_command(config_path)
+        init_command(config_path, queue=queue)
 
     @sweep.command("run")
     @click.option(
@@ -64,11 +69,49 @@ def mock_sweep_group():
         type=str,
         help="ID of the sweep to run (optional if not specified will use the most recent initialized sweep)",
     )
-    def run(sweep_id):
+    @click.option(
+        "--parallel",
+        default=1,
+        type=click.IntRange(min=1),
+        help="Number of trials to run in parallel by this agent",
+    )
+    @click.option(
+        "--controller",
+        default=None,
+        type=str,
+        help="Address of a sweep controller (host:port or unix:/path) to request proposals from",
+    )
+    @click.option(
+        "--timeout",
+        default=None,
+        type=click.FloatRange(min=0, min_open=True),
+        help="Wall-clock seconds after which a trial is terminated, overrides the timeout of the sweep config",
+    )
+    def run(sweep_id, parallel, controller, timeout):
         """Start a sweep agent."""
         from mlflow_sweep.commands import run_command
 
-        run_command(sweep_id)
+        run_command(sweep_id, parallel=parallel, controller=controller, timeout=timeout)
+
+    @sweep.command("controller")
+    @click.option(
+        "--sweep-id",
+        default="",
+        type=str,
+        help="ID of the sweep to serve (optional if not specified will use the most recent initialized sweep)",
+    )
+    @click.option(
+        "--address",
+        default="127.0.0.1:5005",
+        type=str,
+        show_default=True,
+        help="Address to listen on, host:port or unix:/path/to/socket",
+    )
+    def controller(sweep_id, address):
+        """Serve proposals of a sweep to many agents."""
+        from mlflow_sweep.commands import controller_command
+
+        controller_command(sweep_id, address=address)
 
     @sweep.command("finalize")
     @click.option(
@@ -97,7 +140,7 @@ class TestCLI:
         assert result.exit_code == 0
 
         # Verify the init_command was called with correct arguments
-        mock_init_command.assert_called_once_with(temp_config_file)
+        mock_init_command.assert_called_once_with(temp_config_file, queue=False)
 
     @patch("mlflow_sweep.commands.run_command")
     def test_run_command_without_sweep_id(self, mock_run_command, cli_runner, mock_sweep_group):
@@ -109,7 +152,7 @@ class TestCLI:
         assert result.exit_code == 0
 
         # Verify run_command was called with empty sweep_id
-        mock_run_command.assert_called_once_with("")
+        mock_run_command.assert_called_once_with("", parallel=1, controller=None, timeout=None)
 
     @patch("mlflow_sweep.commands.run_command")
     def test_run_command_with_sweep_id(self, mock_run_command, cli_runner, mock_sweep_group):
@@ -121,7 +164,39 @@ class TestCLI:
         assert result.exit_code == 0
 
         # Verify run_command was called with provided sweep_id
-        mock_run_command.assert_called_once_with("test-sweep-id")
+        mock_run_command.assert_called_once_with("test-sweep-id", parallel=1, controller=None, timeout=None)
+
+    @patch("mlflow_sweep.commands.run_command")
+    def test_run_command_with_parallel(self, mock_run_command, cli_runner, mock_sweep_group):
+        """Test that the run command passes the number of parallel trials to the run_command function."""
+        result = cli_runner.invoke(mock_sweep_group, ["run", "--parallel", "4"])
+        assert result.exit_code == 0
+        mock_run_command.assert_called_once_with("", parallel=4, controller=None, timeout=None)
+
+        result = cli_runner.invoke(mock_sweep_group, ["run", "--parallel", "0"])
+        assert result.exit_code != 0
+
+    @patch("mlflow_sweep.commands.run_command")
+    def test_run_command_with_timeout(self, mock_run_command, cli_runner, mock_sweep_group):
+        """Test that the run command passes the trial timeout to the run_command function."""
+        result = cli_runner.invoke(mock_sweep_group, ["run", "--timeout", "90"])
+        assert result.exit_code == 0
+        mock_run_command.assert_called_once_with("", parallel=1, controller=None, timeout=90.0)
+
+        result = cli_runner.invoke(mock_sweep_group, ["run", "--timeout", "0"])
+        assert result.exit_code != 0
+
+    @patch("mlflow_sweep.commands.controller_command")
+    @patch("mlflow_sweep.commands.run_command")
+    def test_controller(self, mock_run_command, mock_controller_command, cli_runner, mock_sweep_group):
+        """Test that the controller is started on the given address and agents can connect to it."""
+        result = cli_runner.invoke(mock_sweep_group, ["controller", "--address", "unix:/tmp/sweep.sock"])
+        assert result.exit_code == 0
+        mock_controller_command.assert_called_once_with("", address="unix:/tmp/sweep.sock")
+
+        result = cli_runner.invoke(mock_sweep_group, ["run", "--controller", "unix:/tmp/sweep.sock"])
+        assert result.exit_code == 0
+        mock_run_command.assert_called_once_with("", parallel=1, controller="unix:/tmp/sweep.sock", timeout=None)
 
     @patch("mlflow_sweep.commands.finalize_command")
     def test_finalize_command_without_sweep_id(self, mock_finalize_command, cli_runner, mock_sweep_group):
@@ -1,13 +1,18 @@
+import io
 import os
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
+import pandas as pd
 import pytest
 import yaml
 from mlflow.entities import Run, RunData, RunInfo
+from mlflow.exceptions import MlflowException
+from plotly.graph_objects import Figure
 
-from mlflow_sweep.commands import determine_sweep, finalize_command, init_command, run_command
-from mlflow_sweep.models import SweepConfig
+from mlflow_sweep.commands import determine_sweep, finalize_command, init_command, open_queue, run_command
+from mlflow_sweep.models import FinalizeState, SweepConfig
+from mlflow_sweep.workqueue import QUEUE_TAG, ProposalQueue
 
 
 @pytest.fixture
@@ -54,44 +59,58 @@ def temp_config_file(tmp_path):
 
 class TestCommands:
     @patch("mlflow.search_runs")
-    def test_determine_sweep_with_id(self, mock_search_runs, mock_run):
+    @patch("mlflow.get_run")
+    def test_determine_sweep_with_id(self, mock_get_run, mock_search_runs, mock_run):
         """Test determine_sweep when a sweep_id is provided."""
-        mock_search_runs.return_value = [mock_run]
+        mock_get_run.return_value = mock_run
 
         result = determine_sweep("test-run-id")
 
-        mock_search_runs.assert_called_once_with(
-            search_all_experiments=True, filter_string="tag.sweep = 'True'", output_format="list"
-        )
-
+        mock_get_run.assert_called_once_with("test-run-id")
+        mock_search_runs.assert_not_called()  # no scan over all sweeps
         assert result == mock_run
 
     @patch("mlflow.search_runs")
     def test_determine_sweep_without_id(self, mock_search_runs, mock_run):
         """Test determine_sweep when no sweep_id is provided (use most recent)."""
-        run1 = MagicMock(spec=Run)
-        run1.info.start_time = 1609459200000  # 2021-01-01
-
-        run2 = mock_run  # 2022-01-01 (more recent)
-
-        mock_search_runs.return_value = [run1, run2]
+        mock_search_runs.return_value = [mock_run]
 
         result = determine_sweep("")
 
         mock_search_runs.assert_called_once_with(
-            search_all_experiments=True, filter_string="tag.sweep = 'True'", output_format="list"
+            search_all_experiments=True,
+            filter_string="tag.sweep = 'True'",
+            order_by=["attributes.start_time DESC"],
+            max_results=1,
+            output_format="list",
         )
 
-        assert result == run2  # Should select the most recent sweep
+        assert result == mock_run  # Should select the most recent sweep
 
     @patch("mlflow.search_runs")
-    def test_determine_sweep_with_invalid_id(self, mock_search_runs):
-        """Test determine_sweep with an invalid sweep_id."""
+    def test_determine_sweep_without_sweeps(self, mock_search_runs):
         mock_search_runs.return_value = []
 
+        with pytest.raises(ValueError, match="No sweeps found"):
+            determine_sweep("")
+
+    @patch("mlflow.get_run")
+    def test_determine_sweep_with_invalid_id(self, mock_get_run):
+        """Test determine_sweep with an invalid sweep_id."""
+        mock_get_run.side_effect = MlflowException("Run 'invalid-id' not found")
+
         with pytest.raises(ValueError, match="No sweep found with sweep_id: invalid-id"):
             determine_sweep("invalid-id")
 
+    @patch("mlflow.get_run")
+    def test_determine_sweep_with_id_of_other_run(self, mock_get_run, mock_run):
+        """Test determine_sweep with the id of a run that is not a sweep."""
+        mock_run.data.tags = {}
+        mock_get_run.return_value = mock_run
+
+        with pytest.raises(ValueError, match="No sweep found with sweep_id: test-run-id"):
+            determine_sweep("test-run-id")
+
     @patch("mlflow.set_experiment")
     @patch("mlflow.start_run")
     @patch("mlflow.set_tag")
@@ -109,13 +128,58 @@ class TestCommands:
         mock_set_tag.assert_called_once_with("sweep", True)
         mock_log_artifact.assert_called_once()  # The path will be a temp file
 
+    @patch("mlflow.start_run")
+    def test_init_command_rejects_unknown_placeholders(self, mock_start_run, temp_config_file):
+        """Test that new sweeps cannot refer to placeholders that do not match a parameter."""
+        config = yaml.safe_load(temp_config_file.read_text())
+        temp_config_file.write_text(yaml.dump({**config, "command": "python train.py --out=${OUT}"}))
+
+        with pytest.raises(ValueError, match=r"placeholders \['OUT'\]"):
+            init_command(temp_config_file)
+        mock_start_run.assert_not_called()
+
+    @patch("mlflow.set_experiment")
+    @patch("mlflow.start_run")
+    @patch("mlflow.set_tag")
+    @patch("mlflow.log_artifact")
+    @patch("mlflow_sweep.commands.SweepState")
+    def test_init_command_with_queue(
+        self,
+        mock_sweep_state,
+        mock_log_artifact,
+        mock_set_tag,
+        mock_start_run,
+        mock_set_experiment,
+        temp_config_file,
+        mock_run,
+    ):
+        """Test that init_command materializes the proposals of a random sweep in a queue."""
+        mock_start_run.return_value = mock_run
+
+        init_command(temp_config_file, queue=True)
+
+        mock_set_tag.assert_called_with(QUEUE_TAG, True)
+        queue = ProposalQueue("test-run-id")
+        assert queue.counts() == {"pending": 5}
+        shared = open_queue(MagicMock(info=mock_run.info, data=MagicMock(tags={QUEUE_TAG: "True"})), "agent")
+        assert shared is not None and shared.claim(1)
+        assert open_queue(mock_run, "agent") is None
+
+        with pytest.raises(ValueError, match="not found"):
+            open_queue(MagicMock(info=MagicMock(run_id="other"), data=MagicMock(tags={QUEUE_TAG: "True"})), "agent")
+
+        config = yaml.safe_load(Path(temp_config_file).read_text())
+        Path(temp_config_file).write_text(yaml.dump({**config, "method": "bayes"}))
+        with pytest.raises(ValueError, match="Only random and grid sweeps can be queued"):
+            init_command(temp_config_file, queue=True)
+
     @patch("mlflow_sweep.commands.determine_sweep")
     @patch("mlflow_sweep.commands.SweepConfig.from_sweep")
     @patch("mlflow_sweep.commands.SweepState")
     @patch("mlflow_sweep.commands.SweepSampler")
     @patch("mlflow.set_experiment")
     @patch("mlflow.start_run")
-    @patch("subprocess.run")
+    @patch("subprocess.Popen")
     @patch.dict(os.environ, {}, clear=True)
     def test_run_command(
         self,
@@ -134,19 +198,26 @@ class TestCommands:
 
         config = SweepConfig(
             command="python train.py --lr=${learning_rate} --batch=${batch_size}",
-            parameters={"learning_rate": {"distribution": "uniform", "min": 0.001, "max": 0.1}},
+            parameters={
+                "learning_rate": {"distribution": "uniform", "min": 0.001, "max": 0.1},
+                "batch_size": {"values": [16, 32, 64]},
+            },
         )
         mock_from_sweep.return_value = config
 
         mock_sampler_instance = MagicMock()
-        mock_sampler_instance.propose_next.side_effect = [
-            (
-                "python train.py --lr=0.01 --batch=32",
-                {"learning_rate": 0.01, "batch_size": 32, "run": 1, "sweep_run_id": "run-id-1"},
-            ),
-            None,  # Indicate we're done after one run
+        mock_sampler_instance.propose_batch.side_effect = [
+            [
+                (
+                    "python train.py --lr=0.01 --batch=32",
+                    {"learning_rate": 0.01, "batch_size": 32, "run": 1, "sweep_run_id": "run-id-1"},
+                )
+            ],
+            [],  # Indicate we're done after one run
         ]
         mock_sweep_sampler.return_value = mock_sampler_instance
+        mock_subprocess.return_value.poll.return_value = 0
+        mock_subprocess.return_value.returncode = 0
 
         # Run the command
         run_command("test-run-id")
@@ -172,26 +243,29 @@ class TestCommands:
     @patch("mlflow_sweep.commands.SweepState")
     @patch("mlflow.set_experiment")
     @patch("mlflow.start_run")
-    @patch("mlflow.log_artifact")
-    @patch("mlflow_sweep.commands.plot_trial_timeline")
-    @patch("mlflow_sweep.commands.plot_metric_vs_time")
-    @patch("mlflow_sweep.commands.plot_parameter_importance_and_correlation")
-    @patch("mlflow_sweep.commands.calculate_feature_importance_and_correlation")
+    @patch("mlflow.log_text")
+    @patch("mlflow_sweep.plotting.plot_trial_timeline")
+    @patch("mlflow_sweep.plotting.plot_metric_vs_time")
+    @patch("mlflow_sweep.plotting.plot_parameter_importance_and_correlation")
+    @patch("mlflow_sweep.utils.calculate_feature_importance_with_settings")
     def test_finalize_command(
         self,
         mock_calculate,
         mock_param_plot,
         mock_metric_plot,
         mock_timeline,
-        mock_log_artifact,
+        mock_log_text,
         mock_start_run,
         mock_set_experiment,
         mock_sweep_state,
         mock_from_sweep,
         mock_determine_sweep,
         mock_run,
+        tmp_path,
+        monkeypatch,
     ):
         """Test finalize_command."""
+        monkeypatch.chdir(tmp_path)
         # Setup mocks
         mock_determine_sweep.return_value = mock_run
 
@@ -208,26 +282,50 @@ class TestCommands:
         run1.id = "run1"
         run1.start_time = 1609459200000  # 2021-01-01
         run1.end_time = 1609462800000  # 2021-01-01 + 1 hour
-        run1.state = "FINISHED"
+        run1.pruned = False
+        run1.state = "finished"
         run1.summary_metrics = {"accuracy": 0.85}
         run1.config = {"learning_rate": {"value": 0.01}}
-
-        state_instance.get_all.return_value = [run1]
+        run2 = MagicMock()
+        run2.id = "run2"
+        run2.start_time = 1609462800000
+        run2.end_time = 1609466400000
+        run2.pruned = False
+        run2.state = "finished"
+        run2.summary_metrics = {"accuracy": 0.9}
+        run2.config = {"learning_rate": {"value": 0.02}}
+        running = MagicMock()
+        running.id = "run3"
+        running.start_time = 1609466400000
+        running.end_time = None
+        running.pruned = False
+        running.state = "running"
+        running.summary_metrics = {}
+        running.config = {"learning_rate": {"value": 0.03}}
+
+        state_instance.get_finished_since.side_effect = lambda watermark: [
+            run for run in (run1, run2, running) if run.state == "finished" and run.end_time >= watermark
+        ]
+        state_instance.get_active.side_effect = lambda: [run for run in (run1, run2, running) if run.state == "running"]
         mock_sweep_state.return_value = state_instance
 
         # Setup figure mocks
-        mock_timeline.return_value = MagicMock()
-        mock_metric_plot.return_value = MagicMock()
-        mock_param_plot.return_value = MagicMock()
+        mock_timeline.return_value = Figure()
+        mock_metric_plot.return_value = Figure()
+        mock_param_plot.return_value = Figure()
 
         # Setup importance calculation mock
-        mock_calculate.return_value = {
-            "learning_rate": {"importance": 1.0, "permutation_importance": 1.0, "pearson": 0.5, "spearman": 0.5}
-        }
+        mock_calculate.return_value = (
+            {"learning_rate": {"importance": 1.0, "permutation_importance": 1.0, "pearson": 0.5, "spearman": 0.5}},
+            {"method": "linear", "n_estimators": 10, "n_repeats": 30, "rows_used": 2, "rows_total": 2, "seconds": 0.1},
+        )
 
         # Run the command
-        with patch("pathlib.Path.unlink"):  # Mock file deletion
-            finalize_command("test-run-id")
+        with (
+            patch("mlflow.log_dict") as mock_log_dict,
+            patch("mlflow_sweep.commands.FinalizeState.load", return_value=FinalizeState()),
+        ):
+            finalize_command("test-run-id", n_estimators=10, max_rows=1000, method="linear")
 
         # Verify method calls
         mock_determine_sweep.assert_called_once_with("test-run-id")
@@ -240,4 +338,67 @@ class TestCommands:
         assert mock_calculate.call_count == 1
         assert mock_metric_plot.call_count == 1
         assert mock_param_plot.call_count == 1
-        assert mock_log_artifact.call_count == 3  # Three plots should be logged
+        # All plots are logged in a single report that includes plotly.js once, without files in the working directory
+        artifacts = {c.args[1]: c.args[0] for c in mock_log_text.call_args_list}
+        assert set(artifacts) == {"sweep_report.html", "sweep_runs.csv"}
+        report = artifacts["sweep_report.html"]
+        assert report.count("<section>") == 3
+        assert report.count("plotly.js v") == 1
+        assert "with the linear method (ridge regression" in report
+        assert list(tmp_path.iterdir()) == []
+
+        # The data of all runs is exported next to the report
+        runs = pd.read_csv(io.StringIO(artifacts["sweep_runs.csv"]))
+        assert runs.columns.tolist() == ["run", "status", "start_time", "end_time", "accuracy", "learning_rate"]
+        assert runs["run"].tolist() == ["run1", "run2", "run3"]
+        assert runs["end_time"].isna().tolist() == [False, False, True]
+        assert mock_calculate.call_args.kwargs["n_estimators"] == 10
+        assert mock_calculate.call_args.kwargs["max_rows"] == 1000
+        assert mock_calculate.call_args.kwargs["method"] == "linear"
+        assert mock_calculate.call_args.args[0].tolist() == [0.85, 0.9]  # the running run is not analyzed
+        assert [c.args[1] for c in mock_log_dict.call_args_list] == ["parameter_importance.json", "finalize_state.json"]
+
+        # The state records the finished runs and the statistics of the metric
+        state = FinalizeState.model_validate(mock_log_dict.call_args.args[0])
+        assert state.processed == ["run1", "run2"]
+        assert state.statistics.best_run == "run2"
+        assert state.settings["method"] == "linear"
+        assert state.importance["parameters"]["learning_rate"]["importance"] == 1.0
+
+        # Finalizing again without newly finished runs does no work
+        mock_start_run.reset_mock()
+        mock_calculate.reset_mock()
+        with patch("mlflow_sweep.commands.FinalizeState.load", return_value=state):
+            finalize_command("test-run-id", n_estimators=10, max_rows=1000, method="linear")
+        mock_start_run.assert_not_called()
+        mock_calculate.assert_not_called()
+        state_instance.get_finished_since.assert_called_with(1609466400000)  # only runs ended since are fetched
+        state_instance.get_all.assert_not_called()
+
+        # Other report settings redraw the report, but the parameter importance is not refit
+        with (
+            patch("mlflow.log_dict") as mock_log_dict,
+            patch("mlflow_sweep.commands.FinalizeState.load", return_value=state),
+        ):
+            finalize_command("test-run-id", n_estimators=10, max_rows=1000, method="linear", large_sweep_threshold=5)
+        mock_start_run.assert_called_once()
+        mock_calculate.assert_not_called()
+        assert [c.args[1] for c in mock_log_dict.call_args_list] == ["finalize_state.json"]
+        state = FinalizeState.model_validate(mock_log_dict.call_args.args[0])
+        assert state.settings["large_sweep_threshold"] == 5
+
+        # A newly finished run is added to the state and triggers a new analysis
+        running.state = "finished"
+        running.end_time = 1609470000000
+        running.summary_metrics = {"accuracy": 0.7}
+        with (
+            patch("mlflow.log_dict") as mock_log_dict,
+            patch("mlflow_sweep.commands.FinalizeState.load", return_value=state),
+        ):
+            finalize_command("test-run-id", n_estimators=10, max_rows=1000, method="linear", large_sweep_threshold=5)
+        assert mock_calculate.call_count == 1
+        assert mock_calculate.call_args.args[0].tolist() == [0.85, 0.9, 0.7]  # processed runs are not fetched again
+        state = FinalizeState.model_validate(mock_log_dict.call_args.args[0])
+        assert state.processed == ["run1", "run2", "run3"]
+        assert state.statistics.count == 3
+        assert state.watermark == 1609470000000
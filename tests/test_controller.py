@@ -0,0 +1,103 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import pytest
+
+from mlflow_sweep.controller import ControllerClient, RemoteRun, SweepController, parse_address
+
+
+@pytest.fixture
+def sampler():
+    """Mock sampler that proposes numbered runs until the run cap of 5 is reached."""
+    proposed = []
+
+    def propose_batch(k):
+        batch = [(f"echo {i}", {"run": i, "sweep_run_id": f"run-{i}"}) for i in range(len(proposed) + 1, 6)][:k]
+        proposed.extend(batch)
+        return batch
+
+    sampler = MagicMock()
+    sampler.config.early_terminate.check_interval = 10.0
+    sampler.config.timeout = 60.0
+    sampler.config.timeout_parameter = None
+    sampler.propose_batch.side_effect = propose_batch
+    sampler.propose_stops.return_value = [MagicMock(id="mlflow-run-1", sweep_run_id="run-1")]
+    return sampler
+
+
+@pytest.fixture
+def address(tmp_path):
+    return f"unix:{tmp_path / 'sweep.sock'}"
+
+
+@pytest.fixture
+def controller(sampler, address):
+    """Controller on a Unix socket, served by an event loop in a background thread."""
+    sweepstate = MagicMock(sweep_id="sweep")
+    controller = SweepController(sampler, sweepstate, batch_window=0.2)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    server = asyncio.run_coroutine_threadsafe(controller.start(address), loop).result()
+    yield controller
+    loop.call_soon_threadsafe(server.close)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+def test_parse_address():
+    assert parse_address("localhost:80") == ("localhost", 80)
+    with pytest.raises(ValueError, match="Invalid controller address"):
+        parse_address("localhost")
+
+
+def test_concurrent_requests_share_one_batch(controller, sampler, address):
+    """Test that requests of several agents within the batch window are served by one proposal batch."""
+    clients = [ControllerClient(address, agent_id=str(i)) for i in range(3)]
+    assert clients[0].sweep_id == "sweep"
+    assert clients[0].prune_interval == 10.0
+    assert clients[0].trial_timeout == 60.0
+    assert clients[0].timeout_parameter is None
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        batches = list(pool.map(lambda client: client.propose_batch(2), clients))
+
+    sampler.propose_batch.assert_called_once_with(6)
+    assert sorted(len(batch) for batch in batches) == [1, 2, 2]  # the run cap is reached after 5 proposals
+    assert sorted(p["run"] for batch in batches for _, p in batch) == [1, 2, 3, 4, 5]
+    assert controller.sweepstate.ledger.append.call_count == 5  # recorded by the controller, not by the agents
+    assert clients[0].propose_batch(1) == []
+
+
+def test_stops_and_reports(controller, sampler, address):
+    """Test that the trials to stop are computed once per interval and pruned trials are marked by the controller."""
+    client = ControllerClient(address)
+
+    assert client.propose_stops() == [RemoteRun("mlflow-run-1", "run-1")]
+    assert client.propose_stops() == [RemoteRun("mlflow-run-1", "run-1")]
+    sampler.propose_stops.assert_called_once()
+
+    controller.sweepstate.reclaim_stale.return_value = [{"run": 1, "sweep_run_id": "run-1"}]
+    client.heartbeat("agent")
+    assert client.reclaim_stale(60.0, "agent") == [{"run": 1, "sweep_run_id": "run-1"}]
+    client.requeue({"run": 1, "sweep_run_id": "run-1"})
+    controller.sweepstate.heartbeat.assert_called_once_with("agent")
+    controller.sweepstate.reclaim_stale.assert_called_once_with(60.0, "agent")
+    sampler.requeue.assert_called_once_with({"run": 1, "sweep_run_id": "run-1"})
+    client.remove_heartbeat("agent")
+    controller.sweepstate.remove_heartbeat.assert_called_once_with("agent")
+
+    client.record_launch({"sweep_run_id": "run-1"})
+    client.mark_pruned("mlflow-run-1")
+    controller.sweepstate.mark_pruned.assert_called_once_with("mlflow-run-1")
+    client.mark_timed_out("run-2")
+    controller.sweepstate.mark_timed_out.assert_called_once_with("run-2")
+
+
+def test_errors_are_returned_to_the_agent(controller, address):
+    client = ControllerClient(address)
+    with pytest.raises(RuntimeError, match="Unknown operation 'unknown'"):
+        client.call("unknown")
+    assert client.call("hello")["sweep_id"] == "sweep"  # the connection stays usable
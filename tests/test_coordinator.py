@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from mlflow_sweep.artifacts import CACHE_DIR_ENV
+from mlflow_sweep.coordinator import COORDINATOR_DB_ENV, SlotCoordinator, get_coordinator_path
+
+
+def test_coordinator_path(monkeypatch, tmp_path):
+    """Test that the database is stored in the cache unless overridden."""
+    monkeypatch.setenv(CACHE_DIR_ENV, str(tmp_path / "cache"))
+    assert get_coordinator_path() == tmp_path / "cache" / "coordinator.db"
+    monkeypatch.setenv(COORDINATOR_DB_ENV, str(tmp_path / "shared.db"))
+    assert get_coordinator_path() == tmp_path / "shared.db"
+
+
+def test_concurrent_agents_never_overshoot(tmp_path):
+    """Test that agents reserving at the same time get unique run numbers and exactly run_cap slots in total."""
+    path = tmp_path / "coordinator.db"
+    agents = [SlotCoordinator("sweep", run_cap=50, agent_id=str(i), path=path) for i in range(16)]
+
+    def reserve_all(coordinator):
+        runs = []
+        while batch := coordinator.reserve(3):
+            runs += batch
+        return runs
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        runs = [run for batch in pool.map(reserve_all, agents) for run in batch]
+
+    assert sorted(runs) == list(range(1, 51))
+    assert agents[0].reserved() == 50
+
+
+def test_sweeps_are_independent(tmp_path):
+    path = tmp_path / "coordinator.db"
+    assert SlotCoordinator("a", run_cap=2, path=path).reserve(5) == [1, 2]
+    assert SlotCoordinator("b", run_cap=2, path=path).reserve(5) == [1, 2]
+
+
+def test_used_runs_and_release(tmp_path):
+    """Test that run numbers used in the ledger count towards the cap and released slots free up capacity."""
+    coordinator = SlotCoordinator("sweep", run_cap=5, path=tmp_path / "coordinator.db")
+    assert coordinator.reserve(2, used=[1, 2]) == [3, 4]
+    assert coordinator.reserve(2, used=[1, 2]) == [5]
+
+    coordinator.release([5])
+    assert coordinator.reserved() == 4
+    assert coordinator.reserve(2, used=[1, 2, 3, 4]) == [5]
+    coordinator.release([3])
+    assert coordinator.reserve(2) == [3]  # the run number of a released slot is handed out again
+
+
+def test_unused_reservations_expire(tmp_path):
+    """Test that slots of agents that stopped before launching their trial are handed out again after the timeout."""
+    coordinator = SlotCoordinator("sweep", run_cap=3, path=tmp_path / "coordinator.db", reservation_timeout=0.0)
+    assert coordinator.reserve(3) == [1, 2, 3]
+    assert coordinator.reserve(3, used=[1]) == [2, 3]  # only run 1 was launched
+    assert coordinator.reserve(3, used=[1, 3]) == [2]  # recorded runs never expire
@@ -0,0 +1,184 @@
+import subprocess
+import sys
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from mlflow_sweep.executor import TrialExecutor
+
+# Trials that start background processes or trap signals need a POSIX shell
+posix_only = pytest.mark.skipif(sys.platform == "win32", reason="requires a POSIX shell and process groups")
+
+
+def make_sampler(commands: list[str]) -> MagicMock:
+    """Create a mock sampler that proposes the given commands and then stops."""
+    proposals = [(command, {"run": i + 1, "sweep_run_id": f"run-{i + 1}"}) for i, command in enumerate(commands)]
+
+    def propose_batch(k):
+        batch = proposals[:k]
+        del proposals[:k]
+        return batch
+
+    sampler = MagicMock()
+    sampler.propose_batch.side_effect = propose_batch
+    return sampler
+
+
+def test_invalid_parallel():
+    with pytest.raises(ValueError, match="at least 1"):
+        TrialExecutor(MagicMock(), env={}, parallel=0)
+
+
+def test_runs_trials_in_parallel(tmp_path, monkeypatch):
+    """Test that the executor keeps several trials in flight and sets a run id per trial."""
+    script = "import os, time; time.sleep(0.3); open(os.environ['SWEEP_RUN_ID'], 'w').close()"
+    command = f'cd {tmp_path} && {sys.executable} -c "{script}"'
+    sampler = make_sampler([command] * 4)
+
+    executor = TrialExecutor(sampler, env={"PATH": ""}, parallel=4, poll_interval=0.05)
+    original_launch = executor.launch
+    in_flight = []
+
+    def recording_launch(command, proposal):
+        trial = original_launch(command, proposal)
+        in_flight.append(len(executor.trials))
+        return trial
+
+    monkeypatch.setattr(executor, "launch", recording_launch)
+    executor.run()
+
+    assert max(in_flight) == 4
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["run-1", "run-2", "run-3", "run-4"]
+    assert sampler.record_launch.call_count == 4
+    assert sampler.propose_batch.call_args_list[0].args == (4,)  # all slots were filled from one batch
+
+
+@posix_only
+def test_failure_stops_launching_and_raises():
+    """Test that a failing trial stops new trials from being launched and is raised after the others finished."""
+    sampler = make_sampler(["exit 3", "sleep 0.2", "exit 0"])
+    executor = TrialExecutor(sampler, env={}, parallel=2, poll_interval=0.05)
+
+    with pytest.raises(subprocess.CalledProcessError, match="exit status 3"):
+        executor.run()
+
+    assert sorted(c.args[1] for c in sampler.complete.call_args_list) == ["failed", "finished"]
+    assert [c.args[0] for c in sampler.propose_batch.call_args_list] == [2]  # nothing launched after the failure
+    assert executor.trials == {}
+
+
+def test_failed_launch_releases_remaining_proposals():
+    """Test that proposals which could not be launched are given back to the sampler."""
+    sampler = make_sampler(["exit 0", "exit 0", "exit 0"])
+    sampler.record_launch.side_effect = [None, RuntimeError("tracking server unavailable")]
+    executor = TrialExecutor(sampler, env={}, parallel=3, poll_interval=0.05)
+
+    with pytest.raises(RuntimeError, match="tracking server unavailable"):
+        executor.run()
+
+    sampler.release.assert_called_once_with([{"run": 2, "sweep_run_id": "run-2"}, {"run": 3, "sweep_run_id": "run-3"}])
+
+
+def test_argv_command_runs_without_shell(tmp_path):
+    """Test that commands rendered as argument lists are executed without a shell."""
+    target = tmp_path / "name with spaces; $HOME"
+    sampler = make_sampler([[sys.executable, "-c", "import sys; open(sys.argv[1], 'w').close()", str(target)]])
+    executor = TrialExecutor(sampler, env={}, parallel=1, poll_interval=0.05)
+
+    executor.run()
+
+    assert target.exists()
+
+
+@posix_only
+def test_prune_terminates_process_group(tmp_path):
+    """Test that a trial proposed to stop is terminated together with its children and recorded as pruned."""
+    marker = tmp_path / "marker"
+    sampler = make_sampler([f"(sleep 1 && touch {marker}) & sleep 30", "exit 0"])
+    sampler.propose_stops.return_value = [MagicMock(id="mlflow-run-1", sweep_run_id="run-1")]
+    executor = TrialExecutor(sampler, env={}, parallel=2, poll_interval=0.05, prune_interval=0.1)
+
+    start = time.monotonic()
+    executor.run()
+
+    assert time.monotonic() - start < 5
+    sampler.mark_pruned.assert_called_once_with("mlflow-run-1")
+    assert [c.args[1] for c in sampler.complete.call_args_list] == ["finished", "pruned"]
+    time.sleep(1.5)
+    assert not marker.exists()  # the background child of the trial was terminated as well
+
+
+@posix_only
+def test_prune_kills_trials_ignoring_sigterm():
+    """Test that a terminated trial that does not shut down is killed after the kill timeout."""
+    sampler = make_sampler(["trap '' TERM; sleep 30"])
+    sampler.propose_stops.return_value = [MagicMock(id="mlflow-run-1", sweep_run_id="run-1")]
+    executor = TrialExecutor(sampler, env={}, parallel=1, poll_interval=0.05, prune_interval=0.1, kill_timeout=0.5)
+
+    start = time.monotonic()
+    executor.run()
+
+    assert time.monotonic() - start < 5
+
+
+def test_heartbeat_requeues_reclaimed_trials():
+    """Test that the executor publishes heartbeats and runs the trials it reclaimed, also after being exhausted."""
+    sampler = make_sampler(["exit 0"])
+    reclaimed = {"run": 7, "sweep_run_id": "dead"}
+    sampler.reclaim_stale.side_effect = [[], [reclaimed], []]
+
+    def requeue(proposal):
+        sampler.propose_batch.side_effect = [[("exit 0", {**proposal, "sweep_run_id": "retry"})], []]
+
+    sampler.requeue.side_effect = requeue
+    executor = TrialExecutor(sampler, env={}, parallel=1, poll_interval=0.05, agent_id="agent", heartbeat_interval=0.0)
+
+    executor.run()
+
+    sampler.heartbeat.assert_called_with("agent")
+    sampler.reclaim_stale.assert_called_with(executor.stale_timeout, "agent")
+    sampler.requeue.assert_called_once_with(reclaimed)
+    sampler.remove_heartbeat.assert_called_once_with("agent")  # no trials are left to reclaim
+    assert [c.args[0]["sweep_run_id"] for c in sampler.record_launch.call_args_list] == ["run-1", "retry"]
+
+
+@posix_only
+def test_timeout_terminates_hung_trial(tmp_path):
+    """Test that a trial exceeding the timeout is terminated with its children and the agent moves on."""
+    marker = tmp_path / "marker"
+    sampler = make_sampler([f"(sleep 1 && touch {marker}) & sleep 30", "exit 0"])
+    executor = TrialExecutor(sampler, env={}, parallel=1, poll_interval=0.05, timeout=0.3)
+
+    start = time.monotonic()
+    executor.run()  # the timed out trial is not raised as a failure
+
+    assert time.monotonic() - start < 5
+    sampler.mark_timed_out.assert_called_once_with("run-1")
+    assert [c.args[1] for c in sampler.complete.call_args_list] == ["timeout", "finished"]
+    assert sampler.record_launch.call_count == 2
+    time.sleep(1.5)
+    assert not marker.exists()
+
+
+def test_timeout_parameter_overrides_timeout():
+    """Test that the value of the timeout parameter in a proposal is the timeout of its trial."""
+    executor = TrialExecutor(MagicMock(), env={}, timeout=10.0, timeout_parameter="budget")
+
+    assert executor.trial_timeout({"budget": 60, "run": 1}) == 60.0
+    assert executor.trial_timeout({"run": 2}) == 10.0  # e.g. proposals from before the parameter was added
+    with pytest.raises(ValueError, match="must be positive"):
+        executor.trial_timeout({"budget": 0})
+    assert TrialExecutor(MagicMock(), env={}, timeout=10.0).trial_timeout({"budget": 60}) == 10.0
+
+
+def test_windows_terminates_trial_process(monkeypatch):
+    """Test that trials are terminated and killed through their process on Windows, where killpg does not exist."""
+    monkeypatch.setattr(sys, "platform", "win32")
+    trial = MagicMock()
+
+    TrialExecutor.terminate(trial)
+    TrialExecutor.kill(trial)
+
+    trial.process.terminate.assert_called_once_with()
+    trial.process.kill.assert_called_once_with()
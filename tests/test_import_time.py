@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+import time
+
+# Modules only needed by `mlflow sweep finalize` that should not be loaded by other commands
+ANALYSIS_MODULES = ("plotly", "sklearn", "mlflow_sweep.plotting", "mlflow_sweep.utils")
+
+# Budget for `mlflow sweep run --help` relative to importing the plain mlflow CLI
+RELATIVE_BUDGET = 1.5
+ABSOLUTE_SLACK_SECONDS = 1.0
+
+
+def run_python(code: str) -> tuple[float, str]:
+    """Run code in a fresh interpreter and return the wall time and stdout."""
+    env = {**os.environ, "MLFLOW_DISABLE_AGENT_HINT": "1"}
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, env=env)
+    return time.perf_counter() - start, result.stdout
+
+
+CLI_HELP = "import sys; sys.argv = ['mlflow', 'sweep', 'run', '--help']; from mlflow_sweep import cli; cli()"
+
+# Prints the loaded modules of interest when the interpreter exits
+PRINT_LOADED = (
+    "import atexit, sys; "
+    "atexit.register(lambda: print('LOADED', sorted(m for m in sys.modules if m.startswith(('plotly', 'sklearn', "
+    "'mlflow_sweep'))))); "
+)
+
+
+def test_run_help_does_not_import_commands():
+    """Test that `mlflow sweep run --help` does not load the sweep commands or the analysis stack."""
+    _, stdout = run_python(PRINT_LOADED + CLI_HELP)
+    loaded = stdout.split("LOADED")[-1]
+
+    assert "--parallel" in stdout
+    assert "mlflow_sweep.commands" not in loaded
+    for module in ANALYSIS_MODULES:
+        assert f"'{module}" not in loaded
+
+
+def test_run_command_does_not_import_analysis_stack():
+    """Test that the modules needed by `mlflow sweep run` do not load the analysis stack used by finalize."""
+    _, stdout = run_python(PRINT_LOADED + "import mlflow_sweep.commands")
+    loaded = stdout.split("LOADED")[-1]
+
+    assert "mlflow_sweep.commands" in loaded
+    for module in ANALYSIS_MODULES:
+        assert f"'{module}" not in loaded
+
+
+def test_run_help_import_budget():
+    """Test that `mlflow sweep run --help` stays within a budget relative to the plain mlflow CLI."""
+    baseline, _ = run_python("from mlflow.cli import cli")
+    duration, _ = run_python(CLI_HELP)
+
+    assert duration < RELATIVE_BUDGET * baseline + ABSOLUTE_SLACK_SECONDS
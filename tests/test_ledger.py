@@ -0,0 +1,82 @@
+import json
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+from mlflow.entities import FileInfo
+
+from mlflow_sweep.ledger import LEDGER_DIR, ProposalLedger
+
+
+@pytest.fixture
+def mock_client(tmp_path):
+    """Create a mock MLflow client that stores artifacts of the sweep run in a temporary directory."""
+    client = MagicMock()
+    client.get_run.return_value.info.artifact_uri = f"file://{tmp_path}"
+
+    def log_text(run_id, text, artifact_file):
+        path = tmp_path / artifact_file
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+
+    def list_artifacts(run_id, path=None):
+        directory = tmp_path / path if path else tmp_path
+        if not directory.exists():
+            return []
+        return [FileInfo(str(p.relative_to(tmp_path)), p.is_dir(), None) for p in sorted(directory.iterdir())]
+
+    client.log_text.side_effect = log_text
+    client.list_artifacts.side_effect = list_artifacts
+    return client
+
+
+def test_append_writes_one_record_per_proposal(mock_client, tmp_path):
+    """Test that each proposal is written as its own artifact."""
+    ledger = ProposalLedger("sweep-id", mock_client)
+    ledger.append({"learning_rate": np.float64(0.01), "batch_size": np.int64(32), "run": 1, "sweep_run_id": "a"})
+    ledger.append({"learning_rate": 0.02, "batch_size": 64, "run": 2, "sweep_run_id": "b"})
+
+    assert sorted(p.name for p in (tmp_path / LEDGER_DIR).iterdir()) == ["a.json", "b.json"]
+    assert json.loads((tmp_path / LEDGER_DIR / "a.json").read_text())["batch_size"] == 32
+    assert len(ledger) == 2
+    assert "a" in ledger
+
+
+def test_read_new_only_returns_unseen_records(mock_client):
+    """Test that readers only load records they have not seen before."""
+    writer = ProposalLedger("sweep-id", mock_client)
+    reader = ProposalLedger("sweep-id", mock_client)
+
+    writer.append({"learning_rate": 0.01, "run": 1, "sweep_run_id": "a"})
+    assert [p["sweep_run_id"] for p in reader.read_new()] == ["a"]
+    assert reader.read_new() == []
+
+    writer.append({"learning_rate": 0.02, "run": 2, "sweep_run_id": "b"})
+    assert [p["sweep_run_id"] for p in reader.read_new()] == ["b"]
+    assert [p["run"] for p in reader.read_all()] == [1, 2]
+    assert reader.get("b") == {"learning_rate": 0.02, "run": 2, "sweep_run_id": "b"}
+
+
+def test_read_loads_records_without_listing(mock_client):
+    """Test that records of known sweep run ids are loaded by their path, without listing the ledger."""
+    ProposalLedger("sweep-id", mock_client).append({"learning_rate": 0.01, "run": 1, "sweep_run_id": "a"})
+    reader = ProposalLedger("sweep-id", mock_client)
+    mock_client.list_artifacts.reset_mock()
+
+    assert reader.read(["a", "unknown"]) == [{"learning_rate": 0.01, "run": 1, "sweep_run_id": "a"}]
+    assert reader.read(["a"]) == []
+    assert "unknown" not in reader
+    assert [c.args[1:] for c in mock_client.list_artifacts.call_args_list] == [()]  # only the legacy table check
+
+
+def test_read_legacy_table(mock_client, tmp_path):
+    """Test that proposals written by older versions as a single table are still loaded."""
+    table = {"columns": ["learning_rate", "run", "sweep_run_id"], "data": [[0.01, 1, "a"], [0.02, 2, "b"]]}
+    (tmp_path / "proposed_parameters.json").write_text(json.dumps(table))
+
+    ledger = ProposalLedger("sweep-id", mock_client)
+
+    assert ledger.read_all() == [
+        {"learning_rate": 0.01, "run": 1, "sweep_run_id": "a"},
+        {"learning_rate": 0.02, "run": 2, "sweep_run_id": "b"},
+    ]
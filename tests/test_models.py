@@ -1,10 +1,11 @@
-from pathlib import Path
 from unittest.mock import MagicMock, patch
 
 import pytest
+import yaml
+from mlflow.store.artifact.artifact_repository_registry import get_artifact_repository
 from pydantic import ValidationError
 
-from mlflow_sweep.models import GoalEnum, MetricConfig, SweepConfig, SweepMethodEnum
+from mlflow_sweep.models import BayesConfig, EarlyTerminateConfig, GoalEnum, MetricConfig, SweepConfig, SweepMethodEnum
 
 
 class TestMetricConfig:
@@ -14,6 +15,17 @@ class TestMetricConfig:
         assert config.name == "accuracy"
         assert config.goal == "maximize"
 
+    def test_unknown_command_placeholders_are_left_unrendered(self):
+        """Test that existing sweeps referring to environment variables as ${NAME} can still be loaded."""
+        config = SweepConfig(command="python train.py --lr ${lr} --out ${OUT}", parameters={"lr": {"values": [0.1]}})
+        assert config.template.unknown == ["OUT"]
+        assert config.template.render({"lr": 0.1}) == "python train.py --lr 0.1 --out ${OUT}"
+        with pytest.raises(ValueError, match="do not match any parameter"):
+            config.template.validate()
+
+        config = SweepConfig(command="python train.py --lr ${lr}", parameters={"lr": {"values": [0.1]}})
+        assert config.template.render({"lr": 0.1}) == "python train.py --lr 0.1"
+
     def test_missing_required_fields(self):
         # Test that ValidationError is raised when required fields are missing
         with pytest.raises(ValidationError):
@@ -97,15 +109,13 @@ class TestSweepConfig:
         assert config.method == SweepMethodEnum.grid
         assert config.metric.goal == GoalEnum.maximize
 
-    @patch("pathlib.Path.open")
-    def test_from_sweep(self, mock_open):
-        # Test the from_sweep class method
-        # Mock the MLflow Run object
+    def test_from_sweep(self, tmp_path):
+        # Test the from_sweep class method with a local artifact store
         mock_run = MagicMock()
-        mock_run.info.artifact_uri = "file:///path/to/artifacts"
+        mock_run.info.run_id = "sweep-run-id"
+        mock_run.info.artifact_uri = f"file://{tmp_path}"
 
-        # Mock the YAML file content
-        mock_config = {
+        config = {
             "command": "python train.py",
             "experiment_name": "test_experiment",
             "sweep_name": "test_sweep",
@@ -114,25 +124,67 @@ class TestSweepConfig:
             "parameters": {"learning_rate": {"type": "float", "min": 0.001, "max": 0.1}},
             "run_cap": 15,
         }
+        (tmp_path / "sweep_config.yaml").write_text(yaml.safe_dump(config))
+
+        config = SweepConfig.from_sweep(mock_run)
+
+        # Assert that the config was loaded correctly
+        assert config.command == "python train.py"
+        assert config.experiment_name == "test_experiment"
+        assert config.sweep_name == "test_sweep"
+        assert config.method == "grid"
+        assert config.metric.name == "accuracy"
+        assert config.metric.goal == "maximize"
+        assert config.parameters["learning_rate"]["type"] == "float"
+        assert config.run_cap == 15
+
+    def test_timeout(self):
+        assert SweepConfig(command="python train.py", parameters={}).timeout is None
+        assert SweepConfig(command="python train.py", parameters={}, timeout=3600).timeout == 3600
+        with pytest.raises(ValidationError, match="greater than 0"):
+            SweepConfig(command="python train.py", parameters={}, timeout=0)
+
+    def test_timeout_parameter(self):
+        config = SweepConfig(
+            command="python train.py", parameters={"budget": {"value": 60}}, timeout_parameter="budget"
+        )
+        assert config.timeout_parameter == "budget"
+        with pytest.raises(ValidationError, match="Timeout parameter 'budget' is not a parameter"):
+            SweepConfig(command="python train.py", parameters={}, timeout_parameter="budget")
+
+    def test_from_sweep_is_cached(self, tmp_path):
+        """Test that the config is only downloaded once from the artifact store."""
+        mock_run = MagicMock()
+        mock_run.info.run_id = "sweep-run-id"
+        mock_run.info.artifact_uri = f"file://{tmp_path}"
+        (tmp_path / "sweep_config.yaml").write_text(yaml.safe_dump({"command": "python train.py", "parameters": {}}))
+
+        with patch("mlflow_sweep.artifacts.get_artifact_repository", wraps=get_artifact_repository) as mock_repository:
+            first = SweepConfig.from_sweep(mock_run)
+            (tmp_path / "sweep_config.yaml").unlink()
+            second = SweepConfig.from_sweep(mock_run)
+
+        assert mock_repository.call_count == 1
+        assert first.command == second.command == "python train.py"
+
+
+class TestEarlyTerminateConfig:
+    def test_requires_brackets(self):
+        with pytest.raises(ValidationError, match="min_iter, or max_iter and s"):
+            EarlyTerminateConfig(max_iter=27)
+        assert EarlyTerminateConfig(max_iter=27, s=2).eta == 3.0
+
+    def test_requires_metric(self):
+        with pytest.raises(ValidationError, match="Early termination requires a metric"):
+            SweepConfig(command="python train.py", parameters={}, early_terminate={"min_iter": 1})  # ty: ignore
+
+    def test_unknown_type(self):
+        with pytest.raises(ValidationError):
+            EarlyTerminateConfig(type="median", min_iter=1)  # ty: ignore
+
 
-        # Configure the mock to return the YAML data
-        mock_file = MagicMock()
-        mock_open.return_value.__enter__.return_value = mock_file
-        mock_yaml = MagicMock()
-        mock_yaml.return_value = mock_config
-
-        with patch("yaml.safe_load", mock_yaml):
-            config = SweepConfig.from_sweep(mock_run)
-
-            # Assert that the correct file was opened
-            mock_open.assert_called_once_with(Path("/path/to/artifacts/sweep_config.yaml"))
-
-            # Assert that the config was loaded correctly
-            assert config.command == "python train.py"
-            assert config.experiment_name == "test_experiment"
-            assert config.sweep_name == "test_sweep"
-            assert config.method == "grid"
-            assert config.metric.name == "accuracy"
-            assert config.metric.goal == "maximize"
-            assert config.parameters["learning_rate"]["type"] == "float"
-            assert config.run_cap == 15
+class TestBayesConfig:
+    def test_unsupported_nu(self):
+        with pytest.raises(ValidationError, match="one of 0.5, 1.5 or 2.5"):
+            BayesConfig(nu=1.0)
+        assert BayesConfig(nu=2.5).nu == 2.5
@@ -1,11 +1,14 @@
+import numpy as np
 import pandas as pd
 import pytest
 from plotly.graph_objects import Figure
 
 from mlflow_sweep.plotting import (
+    pack_lanes,
     plot_metric_vs_time,
     plot_parameter_importance_and_correlation,
     plot_trial_timeline,
+    render_report,
 )
 
 
@@ -122,3 +125,64 @@ class TestPlotting:
         # This is more difficult to test directly since the colors are applied in px.timeline
         # but we can verify the function runs without errors with a custom color map
         assert isinstance(fig, Figure)
+
+    def test_render_report(self, sample_metric_data, sample_importance_data, sample_timeline_data):
+        """Test that the report contains all figures and embeds plotly.js only once."""
+        figures = {
+            "Timeline": plot_trial_timeline(sample_timeline_data),
+            "Metric": plot_metric_vs_time(sample_metric_data),
+            "Importance": plot_parameter_importance_and_correlation(sample_importance_data),
+        }
+        report = render_report(figures, title="Sweep <1>", notes=["10 runs"])
+        single = render_report({"Timeline": figures["Timeline"]})
+
+        assert report.startswith("<!DOCTYPE html>")
+        assert "<h1>Sweep &lt;1&gt;</h1>" in report
+        assert "<p>10 runs</p>" in report
+        assert report.count("<section>") == 3
+        assert report.count("plotly.js v") == 1
+        assert len(report) < 2 * len(single)  # additional figures do not add another copy of plotly.js
+
+    def test_plot_metric_vs_time_uses_webgl_for_large_sweeps(self, sample_metric_data):
+        """Test that the metric plot switches to WebGL above the threshold."""
+        assert {trace.type for trace in plot_metric_vs_time(sample_metric_data).data} == {"scatter"}
+        fig = plot_metric_vs_time(sample_metric_data, large_sweep_threshold=2)
+        assert {trace.type for trace in fig.data} == {"scattergl"}
+        assert fig.data[1].name == "Best so far"
+
+    def test_plot_trial_timeline_packs_lanes_for_large_sweeps(self):
+        """Test that large sweeps are drawn with one WebGL trace per status and runs packed into lanes."""
+        starts = pd.date_range("2023-01-01 10:00", periods=6, freq="10min")
+        df = pd.DataFrame(
+            {
+                "start": starts.astype(str),
+                "end": (starts + pd.Timedelta(minutes=15)).astype(str),
+                "run": [f"Run {i}" for i in range(6)],
+                "status": ["finished", "failed", "finished", "finished", "running", "finished"],
+            }
+        )
+
+        fig = plot_trial_timeline(df, large_sweep_threshold=5)
+
+        assert {trace.type for trace in fig.data} == {"scattergl"}
+        assert sorted(trace.name for trace in fig.data) == ["failed", "finished", "running"]
+        finished = next(trace for trace in fig.data if trace.name == "finished")
+        assert finished.line.color == "blue"
+        assert list(finished.text[::3]) == ["Run 0", "Run 2", "Run 3", "Run 5"]
+        lanes = {lane for trace in fig.data for lane in trace.y if lane is not None}
+        assert lanes == {0, 1}  # at most two runs overlap
+
+    def test_pack_lanes(self):
+        """Test that overlapping intervals never share a lane and that free lanes are reused."""
+        rng = np.random.default_rng(0)
+        starts = rng.uniform(0, 100, size=200)
+        ends = starts + rng.uniform(1, 10, size=200)
+
+        lanes = pack_lanes(starts, ends)
+
+        for lane in np.unique(lanes):
+            order = np.argsort(starts[lanes == lane])
+            assert np.all(starts[lanes == lane][order][1:] >= ends[lanes == lane][order][:-1])
+        # The number of lanes equals the largest number of overlapping intervals
+        events = sorted([(s, 1) for s in starts] + [(e, -1) for e in ends])
+        assert lanes.max() + 1 == max(np.cumsum([delta for _, delta in events]))
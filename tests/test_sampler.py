@@ -1,17 +1,29 @@
 import uuid
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import MagicMock, patch
 
 import pytest
 
-from mlflow_sweep.models import SweepConfig
+from mlflow_sweep.coordinator import SlotCoordinator
+from mlflow_sweep.models import ExtendedSweepRun, SweepConfig
 from mlflow_sweep.sampler import SweepSampler
 from mlflow_sweep.sweepstate import SweepState
+from mlflow_sweep.workqueue import ProposalQueue
+
+with warnings.catch_warnings():
+    warnings.filterwarnings("ignore", category=UserWarning, message="Valid config keys have changed in V2.*")
+    import sweeps
 
 
 @pytest.fixture
 def mock_sweepstate():
     mock_state = MagicMock(spec=SweepState)
     mock_state.get_all.return_value = []
+    mock_state.get_pending.return_value = []
+    mock_state.get_parameters.return_value = []
+    mock_state.ledger = MagicMock()
+    mock_state.ledger.read_all.return_value = []
     return mock_state
 
 
@@ -38,7 +50,7 @@ class TestSweepSampler:
         mock_config.config = {"learning_rate": {"value": 0.01}, "batch_size": {"value": 32}}
 
         with (
-            patch("sweeps.next_run", return_value=mock_config),
+            patch("sweeps.next_runs", return_value=[mock_config]),
             patch("uuid.uuid4", return_value=uuid.UUID("12345678-1234-5678-1234-567812345678")),
         ):
             sampler = SweepSampler(sweep_config, mock_sweepstate)
@@ -51,8 +63,8 @@ class TestSweepSampler:
             assert params["sweep_run_id"] == "12345678-1234-5678-1234-567812345678"
 
     def test_propose_next_at_cap(self, sweep_config, mock_sweepstate):
-        # Create 4 mock runs (equal to run cap)
-        mock_sweepstate.get_all.return_value = [MagicMock() for _ in range(4)]
+        # Create 4 mock proposals (equal to run cap)
+        mock_sweepstate.get_parameters.return_value = [MagicMock() for _ in range(4)]
 
         sampler = SweepSampler(sweep_config, mock_sweepstate)
         result = sampler.propose_next()
@@ -60,12 +72,23 @@ class TestSweepSampler:
         assert result is None  # Should return None when run cap is reached
 
     def test_propose_next_exhausted(self, sweep_config, mock_sweepstate):
-        # Test when the sweep module returns None (e.g., grid search exhausted)
-        with patch("sweeps.next_run", return_value=None):
-            sampler = SweepSampler(sweep_config, mock_sweepstate)
-            result = sampler.propose_next()
+        """Test that grid search stops once the run numbers have passed the last grid point."""
+        sweep_config.run_cap = 10
+        mock_sweepstate.get_parameters.return_value = [MagicMock() for _ in range(4)]
+        sampler = SweepSampler(sweep_config, mock_sweepstate)
+
+        assert sampler.propose_next() is None
+
+    def test_propose_batch_grid_continues(self, sweep_config, mock_sweepstate):
+        """Test that grid search continues after the points of the previous runs and stops at the end of the grid."""
+        sweep_config.run_cap = 10
+        mock_sweepstate.get_parameters.return_value = [MagicMock() for _ in range(2)]
+        sampler = SweepSampler(sweep_config, mock_sweepstate)
+
+        proposals = sampler.propose_batch(5)
 
-            assert result is None
+        assert [(p["batch_size"], p["learning_rate"]) for _, p in proposals] == [(64, 0.01), (64, 0.1)]
+        assert [p["run"] for _, p in proposals] == [3, 4]
 
     def test_replace_dollar_signs(self):
         parameters = {"learning_rate": 0.01, "batch_size": 32}
@@ -74,3 +97,243 @@ class TestSweepSampler:
 
         result = SweepSampler.replace_dollar_signs(template, parameters)
         assert result == expected
+
+    @pytest.mark.parametrize("method", ["random", "grid"])
+    def test_propose_batch(self, method, sweep_config, mock_sweepstate):
+        """Test that a batch of distinct proposals is drawn from a single state snapshot."""
+        sweep_config.method = method
+        sampler = SweepSampler(sweep_config, mock_sweepstate)
+
+        proposals = sampler.propose_batch(3)
+
+        assert len(proposals) == 3
+        assert [params["run"] for _, params in proposals] == [1, 2, 3]
+        assert len({params["sweep_run_id"] for _, params in proposals}) == 3
+        mock_sweepstate.get_all.assert_not_called()  # random and grid search do not need the run history
+        if method == "grid":
+            assert len({(params["learning_rate"], params["batch_size"]) for _, params in proposals}) == 3
+
+    def test_propose_batch_respects_run_cap(self, sweep_config, mock_sweepstate):
+        mock_sweepstate.get_parameters.return_value = [MagicMock() for _ in range(3)]
+        sampler = SweepSampler(sweep_config, mock_sweepstate)
+
+        proposals = sampler.propose_batch(3)
+
+        assert [params["run"] for _, params in proposals] == [4]
+
+    def test_propose_batch_reserves_slots(self, sweep_config, mock_sweepstate, tmp_path):
+        """Test that agents sharing a coordinator get unique run numbers and unused slots are released."""
+        path = tmp_path / "coordinator.db"
+        sweep_config.run_cap = 10
+        samplers = [
+            SweepSampler(sweep_config, mock_sweepstate, SlotCoordinator("sweep", sweep_config.run_cap, path=path))
+            for _ in range(2)
+        ]
+
+        first = samplers[0].propose_batch(2)
+        second = samplers[1].propose_batch(3)  # only two grid points are left
+
+        assert [params["run"] for _, params in first + second] == [1, 2, 3, 4]
+        assert samplers[0].coordinator.reserved() == 4
+
+    def test_propose_batch_releases_slots_on_error(self, sweep_config, mock_sweepstate, tmp_path):
+        """Test that the slots reserved for a batch are given back if it fails, such that no grid point is lost."""
+        coordinator = SlotCoordinator("sweep", sweep_config.run_cap, path=tmp_path / "coordinator.db")
+        sampler = SweepSampler(sweep_config, mock_sweepstate, coordinator)
+
+        with patch.object(sampler, "_to_proposals", side_effect=RuntimeError("crash")), pytest.raises(RuntimeError):
+            sampler.propose_batch(2)
+        assert coordinator.reserved() == 0
+
+        proposals = sampler.propose_batch(4)
+        assert [p["run"] for _, p in proposals] == [1, 2, 3, 4]
+        sampler.release([proposals[1][1]])  # e.g. the trial could not be launched
+        assert [(p["run"], p["learning_rate"]) for _, p in sampler.propose_batch(4)] == [(2, 0.1)]
+
+    def test_propose_batch_grid_concurrent_agents(self, mock_sweepstate, tmp_path):
+        """Test that agents proposing a grid at the same time run every grid point exactly once."""
+        config = SweepConfig(
+            method="grid",  # ty: ignore
+            parameters={"lr": {"values": [0.001, 0.01, 0.1]}, "opt": {"values": ["adam", "sgd", "rmsprop", "adamw"]}},
+            command="python train.py --lr ${lr} --opt ${opt}",
+            run_cap=12,
+        )
+        path = tmp_path / "coordinator.db"
+
+        def agent(k: int) -> list[dict]:
+            sampler = SweepSampler(config, mock_sweepstate, SlotCoordinator("sweep", config.run_cap, path=path))
+            proposed = []
+            while batch := sampler.propose_batch(k):
+                proposed += [p for _, p in batch]
+            return proposed
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            proposed = [p for batch in pool.map(agent, [1, 2, 3, 1]) for p in batch]
+
+        assert sorted(p["run"] for p in proposed) == list(range(1, 13))
+        assert len({(p["lr"], p["opt"]) for p in proposed}) == 12
+
+    def test_propose_batch_grid_skips_points_in_ledger(self, sweep_config, mock_sweepstate):
+        """Test that grid points already in the ledger are not proposed again, also under another run number."""
+        proposed = {"learning_rate": 0.01, "batch_size": 64, "run": 1, "sweep_run_id": "other"}  # point of run 3
+        mock_sweepstate.get_parameters.return_value = [proposed]
+        mock_sweepstate.ledger.__iter__.side_effect = lambda: iter([proposed])
+        sampler = SweepSampler(sweep_config, mock_sweepstate)
+
+        proposals = sampler.propose_batch(3)
+
+        assert [(p["run"], p["learning_rate"], p["batch_size"]) for _, p in proposals] == [
+            (2, 0.1, 32),
+            (3, 0.01, 32),  # the first point that was not proposed yet
+            (4, 0.1, 64),
+        ]
+
+    def test_propose_batch_separate_coordinators_share_ledger(self, sweep_config, mock_sweepstate, tmp_path):
+        """Test that agents with their own coordinator database skip the run numbers already in the ledger."""
+        ledger = []
+        mock_sweepstate.ledger.read_all.side_effect = lambda: list(ledger)
+        samplers = [
+            SweepSampler(sweep_config, mock_sweepstate, SlotCoordinator("sweep", 4, path=tmp_path / f"{i}.db"))
+            for i in range(2)
+        ]
+
+        proposed = []
+        while batch := samplers[len(proposed) % 2].propose_batch(1):
+            ledger += [p for _, p in batch]  # launched trials are recorded in the ledger
+            proposed += batch
+
+        assert [p["run"] for _, p in proposed] == [1, 2, 3, 4]
+
+    def test_propose_batch_bayes(self, mock_sweepstate):
+        """Test that bayesian search keeps its surrogate between calls and only adds newly finished runs."""
+        config = SweepConfig(
+            method="bayes",  # ty: ignore
+            metric={"name": "accuracy", "goal": "maximize"},  # ty: ignore
+            parameters={"learning_rate": {"min": 0.0, "max": 1.0}},
+            command="python train.py --lr=${learning_rate}",
+            run_cap=10,
+            seed=0,
+        )
+        runs = [
+            ExtendedSweepRun(
+                id=f"run-{i}",
+                start_time=0,
+                end_time=0,
+                config={"learning_rate": {"value": lr}},
+                state=sweeps.RunState.finished,
+                summaryMetrics={"accuracy": acc},  # ty: ignore[unknown-argument]
+            )
+            for i, (lr, acc) in enumerate([(0.1, 0.5), (0.5, 0.9), (0.9, 0.2)])
+        ]
+        mock_sweepstate.get_all.return_value = runs
+        sampler = SweepSampler(config, mock_sweepstate)
+
+        proposals = sampler.propose_batch(3)
+
+        assert len(proposals) == 3
+        assert len({params["learning_rate"] for _, params in proposals}) == 3
+        assert sampler.bayes.observed == {"run-0", "run-1", "run-2"}  # ty: ignore[possibly-unbound-attribute]
+        assert sampler.bayes.y.tolist() == [-0.5, -0.9, -0.2]  # ty: ignore[possibly-unbound-attribute]
+
+        mock_sweepstate.get_all.return_value = [*runs, runs[0].model_copy(update={"id": "run-3"})]
+        sampler.propose_batch(1)
+        assert len(sampler.bayes.y) == 4  # ty: ignore[possibly-unbound-attribute]
+
+    def test_propose_batch_random_seed(self, sweep_config, mock_sweepstate):
+        """Test that seeded random search proposes the same parameters for a run independent of the batching."""
+        sweep_config.method = "random"
+        sweep_config.parameters = {"learning_rate": {"distribution": "log_uniform_values", "min": 1e-4, "max": 1e-1}}
+        sweep_config.command = "python train.py --lr=${learning_rate}"
+        sweep_config.seed = 42
+
+        in_one_batch = SweepSampler(sweep_config, mock_sweepstate).propose_batch(4)
+        mock_sweepstate.get_parameters.return_value = [MagicMock() for _ in range(2)]
+        in_two_batches = SweepSampler(sweep_config, mock_sweepstate).propose_batch(2)
+
+        assert [c for c, _ in in_two_batches] == [c for c, _ in in_one_batch[2:]]
+        assert all(1e-4 <= p["learning_rate"] <= 1e-1 for _, p in in_one_batch)
+
+    @pytest.mark.parametrize(("method", "size"), [("grid", 4), ("random", 6)])
+    def test_materialize_and_claim_from_queue(self, method, size, sweep_config, mock_sweepstate, tmp_path):
+        """Test that the proposals of grid and random sweeps are computed up front and claimed without any state."""
+        sweep_config.method = method
+        sweep_config.run_cap = 6
+        sweep_config.seed = 0
+        proposals = SweepSampler(sweep_config, mock_sweepstate).materialize()
+        assert [p["run"] for _, p in proposals] == list(range(1, size + 1))  # the grid has only 4 points
+        if method == "random":
+            assert [c for c, _ in proposals] == [c for c, _ in SweepSampler(sweep_config, MagicMock()).propose_batch(6)]
+
+        queue = ProposalQueue("sweep", path=tmp_path / "coordinator.db")
+        queue.put(proposals)
+        state = MagicMock(spec=[])  # any access to the sweep state would fail
+        sampler = SweepSampler(sweep_config, state, queue=queue)
+        claimed = sampler.propose_batch(3)
+        assert claimed == [(c, p) for c, p in proposals[:3]]
+
+        sampler.complete(claimed[0][1], "finished")
+        assert queue.counts() == {"claimed": 2, "finished": 1, "pending": size - 3}
+
+    def test_requeue(self, sweep_config, mock_sweepstate, tmp_path):
+        """Test that reclaimed trials are proposed again before new ones, under their slot and a new sweep run ID."""
+        sweep_config.method = "random"
+        sampler = SweepSampler(sweep_config, mock_sweepstate)
+        sampler.requeue({"learning_rate": 0.5, "batch_size": 8, "run": 2, "sweep_run_id": "dead"})
+        mock_sweepstate.get_parameters.return_value = [{"run": 1}]  # the reclaimed trial no longer counts
+
+        proposals = sampler.propose_batch(2)
+
+        assert proposals[0][0] == "python train.py --lr=0.5 --batch=8"
+        assert proposals[0][1]["run"] == 2
+        assert proposals[0][1]["sweep_run_id"] != "dead"
+        assert [p["run"] for _, p in proposals] == [2, 3]
+        assert sampler.retries == []
+
+        queue = ProposalQueue("sweep", path=tmp_path / "coordinator.db")
+        queue.put(proposals)
+        queued = SweepSampler(sweep_config, mock_sweepstate, queue=queue)
+        [(_, claimed)] = queued.propose_batch(1)
+        queued.requeue(claimed)
+        assert queued.propose_batch(1)[0][1]["sweep_run_id"] not in (claimed["sweep_run_id"], "dead")
+
+    def test_materialize_bayes(self, mock_sweepstate):
+        config = SweepConfig(
+            method="bayes",  # ty: ignore
+            metric={"name": "accuracy", "goal": "maximize"},  # ty: ignore
+            parameters={"learning_rate": {"min": 0.0, "max": 1.0}},
+            command="python train.py --lr=${learning_rate}",
+        )
+        with pytest.raises(ValueError, match="cannot be queued"):
+            SweepSampler(config, mock_sweepstate).materialize()
+
+    def test_propose_stops(self, mock_sweepstate):
+        """Test that running trials below the hyperband threshold of their bracket are proposed to stop."""
+        config = SweepConfig(
+            method="random",  # ty: ignore
+            metric={"name": "loss", "goal": "minimize"},  # ty: ignore
+            parameters={"learning_rate": {"min": 0.0, "max": 1.0}},
+            command="python train.py --lr=${learning_rate}",
+            early_terminate={"min_iter": 1, "eta": 2},  # ty: ignore
+        )
+        histories = {"a": [10, 5, 4], "b": [10, 6, 5], "c": [10, 9], "d": [10, 4]}
+        runs = [
+            ExtendedSweepRun(
+                id=f"run-{name}",
+                sweep_run_id=name,
+                start_time=0,
+                config={"learning_rate": {"value": 0.1}},
+                state=sweeps.RunState.finished if name in "ab" else sweeps.RunState.running,
+                sampledHistory=[{"loss": value} for value in history],  # ty: ignore[unknown-argument]
+            )
+            for name, history in histories.items()
+        ]
+        mock_sweepstate.get_all.return_value = runs
+
+        stops = SweepSampler(config, mock_sweepstate).propose_stops()
+
+        assert [run.sweep_run_id for run in stops] == ["c"]
+        mock_sweepstate.get_all.assert_called_once_with(with_metric="loss")
+
+    def test_propose_stops_without_early_terminate(self, sweep_config, mock_sweepstate):
+        assert SweepSampler(sweep_config, mock_sweepstate).propose_stops() == []
+        mock_sweepstate.get_all.assert_not_called()
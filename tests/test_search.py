@@ -0,0 +1,209 @@
+import itertools
+import warnings
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from sweeps import RunState
+
+from mlflow_sweep.models import ExtendedSweepRun
+from mlflow_sweep.search import GAUSSIAN_PROCESS_NUGGET, BayesSearch, GridSearch, RandomSearch, matern
+
+with warnings.catch_warnings():
+    warnings.filterwarnings("ignore", category=UserWarning, message="Valid config keys have changed in V2.*")
+    import sweeps
+
+
+PARAMETERS = {
+    "optimizer": {"values": ["adam", "sgd", "rmsprop"]},
+    "layers": {"min": 1, "max": 4},
+    "dropout": {"min": 0.0, "max": 0.5, "q": 0.1, "distribution": "q_uniform"},
+    "epochs": {"value": 10},
+}
+
+
+def test_grid_matches_sweeps_order():
+    """Test that grid points are enumerated in the same order as the sweeps library proposes them."""
+    grid = GridSearch(PARAMETERS)
+    config = {"method": "grid", "parameters": PARAMETERS}
+
+    runs = []
+    while (run := sweeps.next_run(config, runs)) is not None:
+        run.state = sweeps.RunState.finished
+        runs.append(run)
+
+    assert len(grid) == len(runs) == 3 * 4 * 5
+    assert [grid[i] for i in range(len(grid))] == [run.config for run in runs]
+
+
+def test_grid_is_lazy():
+    """Test that very large grids are not materialized."""
+    grid = GridSearch({"a": {"min": 0, "max": 999_999}, "b": {"min": 0, "max": 999}})
+
+    assert len(grid) == 1_000_000_000
+    assert grid[len(grid) - 1] == {"a": {"value": 999_999}, "b": {"value": 999}}
+    assert grid[1_234_567] == {"a": {"value": 1234}, "b": {"value": 567}}
+
+
+def test_grid_nested_parameters():
+    grid = GridSearch({"model": {"parameters": {"depth": {"values": [1, 2]}, "width": {"values": [8, 16]}}}})
+
+    points = [grid[i] for i in range(len(grid))]
+
+    assert [p["model"]["value"] for p in points] == [
+        {"depth": d, "width": w} for d, w in itertools.product([1, 2], [8, 16])
+    ]
+
+
+def test_grid_out_of_range():
+    grid = GridSearch({"a": {"values": [1, 2]}})
+    with pytest.raises(IndexError):
+        grid[2]
+
+
+def test_grid_disallowed_type():
+    with pytest.raises(ValueError, match="disallowed type with grid search"):
+        GridSearch({"lr": {"min": 0.0, "max": 1.0}})
+
+
+def test_random_search_distributions():
+    """Test that all distributions are sampled in one call and produce builtin values within their bounds."""
+    parameters = {
+        "optimizer": {"values": ["adam", "sgd"]},
+        "layers": {"min": 1, "max": 4},
+        "dropout": {"min": 0.0, "max": 0.5},
+        "lr": {"distribution": "log_uniform_values", "min": 1e-5, "max": 1e-1},
+        "batch": {"distribution": "q_log_uniform_values", "min": 16, "max": 256, "q": 16},
+        "momentum": {"distribution": "beta", "a": 2, "b": 5},
+        "noise": {"distribution": "normal", "mu": 0, "sigma": 1},
+        "weights": {"values": [1, 2], "probabilities": [0.0, 1.0]},
+        "epochs": {"value": 10},
+    }
+    configs = RandomSearch(parameters, seed=0).sample(1000)
+
+    assert len(configs) == 1000
+    values = {name: [c[name]["value"] for c in configs] for name in parameters}
+    assert set(values["optimizer"]) == {"adam", "sgd"}
+    assert set(values["layers"]) == {1, 2, 3, 4}
+    assert all(0.0 <= v <= 0.5 and isinstance(v, float) for v in values["dropout"])
+    assert all(1e-5 <= v <= 1e-1 for v in values["lr"])
+    assert all(v % 16 == 0 and isinstance(v, int) for v in values["batch"])
+    assert all(0.0 <= v <= 1.0 for v in values["momentum"])
+    assert set(values["weights"]) == {2}
+    assert set(values["epochs"]) == {10}
+
+
+def test_random_search_seed():
+    parameters = {"lr": {"min": 0.0, "max": 1.0}, "model": {"parameters": {"depth": {"min": 1, "max": 10}}}}
+
+    assert RandomSearch(parameters, seed=1).sample(5) == RandomSearch(parameters, seed=1).sample(5)
+    assert RandomSearch(parameters, seed=1).sample(5) != RandomSearch(parameters, seed=2).sample(5)
+    assert RandomSearch(parameters).sample(5) != RandomSearch(parameters).sample(5)
+    assert set(RandomSearch(parameters).sample(1)[0]["model"]["value"]) == {"depth"}
+
+
+def make_run(
+    run_id: str, config: dict, state: RunState = RunState.finished, metrics: dict | None = None
+) -> ExtendedSweepRun:
+    return ExtendedSweepRun(
+        id=run_id,
+        start_time=0,
+        end_time=0,
+        config=config,
+        state=state,
+        summaryMetrics=metrics or {},  # ty: ignore[unknown-argument]
+    )
+
+
+def test_bayes_incremental_cholesky_matches_full_factorization():
+    """Test that adding observations one at a time gives the same factor as factorizing the kernel matrix."""
+    search = BayesSearch({"a": {"min": 0.0, "max": 1.0}, "b": {"min": 0.0, "max": 1.0}}, "loss", "minimize", seed=0)
+    points = np.random.default_rng(0).random((20, 2))
+    for x in points:
+        search.observe(x, float(x.sum()))
+
+    K = matern(points, points, search.length_scale, search.nu) + GAUSSIAN_PROCESS_NUGGET * np.eye(len(points))
+    np.testing.assert_allclose(search.L, np.linalg.cholesky(K), atol=1e-8)
+
+
+def test_bayes_refit_schedule():
+    """Test that the kernel is only re-optimized every refit_every observations."""
+    search = BayesSearch({"a": {"min": 0.0, "max": 1.0}}, "loss", "minimize", refit_every=3, seed=0)
+    for i, x in enumerate([0.1, 0.4, 0.8]):
+        search.update([make_run(f"run-{i}", {"a": {"value": x}}, metrics={"loss": (x - 0.5) ** 2})])
+
+    with patch.object(search, "refit", wraps=search.refit) as refit:
+        search.propose(1)
+        search.observe(np.array([0.3]), 0.04)
+        search.propose(1)
+        assert refit.call_count == 1
+        search.observe(np.array([0.6]), 0.01)
+        search.observe(np.array([0.7]), 0.04)
+        search.propose(1)
+        assert refit.call_count == 2
+
+
+def test_bayes_update_imputes_failed_runs():
+    """Test that failed runs and runs without the metric get the worst observed value, running runs are skipped."""
+    search = BayesSearch({"a": {"min": 0.0, "max": 1.0}}, "accuracy", "maximize", seed=0)
+    search.update(
+        [
+            make_run("a", {"a": {"value": 0.2}}, metrics={"accuracy": 0.9}),
+            make_run("b", {"a": {"value": 0.4}}, metrics={"accuracy": 0.6}),
+            make_run("c", {"a": {"value": 0.6}}, state=RunState.failed),
+            make_run("d", {"a": {"value": 0.8}}),
+            make_run("e", {"a": {"value": 0.9}}, state=RunState.running),
+        ]
+    )
+
+    assert search.y.tolist() == [-0.9, -0.6, -0.6, -0.6]
+    assert search.observed == {"a", "b", "c", "d"}
+
+
+def test_bayes_failed_first_run_is_imputed_with_current_worst():
+    """Test that a failed run is imputed with the worst value of all runs observed so far, also later ones."""
+    search = BayesSearch({"a": {"min": 0.0, "max": 1.0}}, "loss", "minimize", seed=0)
+    search.update([make_run("a", {"a": {"value": 0.2}}, state=RunState.failed)])
+    assert np.isnan(search.y).all()
+    assert len(search.propose(2)) == 2  # nothing to fit yet, proposals are random
+
+    search.update(
+        [
+            make_run("b", {"a": {"value": 0.4}}, metrics={"loss": 5.0}),
+            make_run("c", {"a": {"value": 0.6}}, metrics={"loss": 3.0}),
+        ]
+    )
+    assert search.y.tolist() == [5.0, 5.0, 3.0]
+
+    search.update([make_run("d", {"a": {"value": 0.8}}, metrics={"loss": 7.0})])
+    assert search.y.tolist() == [7.0, 5.0, 3.0, 7.0]
+
+
+def test_bayes_normalize_none_category():
+    """Test that None is encoded at its position among the values of a categorical parameter."""
+    search = BayesSearch({"max_features": {"values": ["sqrt", "log2", None]}}, "loss", "minimize", seed=0)
+
+    encoded = [search.normalize({"max_features": {"value": value}})[0] for value in ["sqrt", "log2", None]]
+
+    assert encoded[0] < encoded[1] < encoded[2]
+    assert search._decode(np.array([encoded[2]]))["max_features"]["value"] is None
+
+
+def test_bayes_proposals():
+    parameters = {
+        "lr": {"distribution": "log_uniform_values", "min": 1e-4, "max": 1e-1},
+        "layers": {"min": 1, "max": 8},
+        "optimizer": {"values": ["adam", "sgd"]},
+        "epochs": {"value": 5},
+    }
+    search = BayesSearch(parameters, "loss", "minimize", seed=0)
+    search.update([make_run(str(i), c, metrics={"loss": float(i)}) for i, c in enumerate(search.propose(5))])
+
+    proposals = search.propose(3, pending=[search.propose(1)[0]])
+
+    assert len(proposals) == 3
+    for config in proposals:
+        assert 1e-4 <= config["lr"]["value"] <= 1e-1
+        assert config["layers"]["value"] in range(1, 9)
+        assert config["optimizer"]["value"] in ("adam", "sgd")
+        assert config["epochs"]["value"] == 5
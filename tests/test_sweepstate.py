@@ -0,0 +1,329 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from mlflow import MlflowClient
+from mlflow.entities import Metric, Run, RunData, RunInfo
+from mlflow.entities.metric import MetricWithRunId
+from mlflow.utils.search_utils import SearchUtils
+
+from mlflow_sweep.sweepstate import MetricHistoryCursor, SweepState, load_metric_histories, status_mapping
+
+
+def make_run(run_id: str, sweep_run_id: str, status: str = "FINISHED", start_time: int = 1000) -> Run:
+    """Create a mock MLflow Run that belongs to a sweep."""
+    run_info = MagicMock(spec=RunInfo)
+    run_info.run_id = run_id
+    run_info.run_name = run_id
+    run_info.status = status
+    run_info.start_time = start_time
+    run_info.end_time = start_time + 10
+
+    run_data = MagicMock(spec=RunData)
+    run_data.tags = {"mlflow.sweepRunId": sweep_run_id}
+    run_data.metrics = {"accuracy": 0.5}
+
+    run = MagicMock(spec=Run)
+    run.info = run_info
+    run.data = run_data
+    return run
+
+
+@pytest.fixture
+def sweepstate():
+    with patch("mlflow_sweep.sweepstate.MlflowClient"):
+        state = SweepState(sweep_id="sweep-id")
+    state.ledger._entries = {
+        "a": {"learning_rate": 0.01, "run": 1, "sweep_run_id": "a"},
+        "b": {"learning_rate": 0.02, "run": 2, "sweep_run_id": "b"},
+    }
+    with patch.object(state.ledger, "read_new", return_value=[]), patch.object(state.ledger, "read", return_value=[]):
+        yield state
+
+
+def test_status_mapping():
+    assert status_mapping("RUNNING") == "running"
+    assert status_mapping("SCHEDULED") == "pending"
+    assert status_mapping("FINISHED") == "finished"
+    assert status_mapping("FAILED") == "failed"
+    assert status_mapping("KILLED") == "killed"
+
+
+@patch("mlflow.search_runs")
+def test_get_all_joins_parameters(mock_search_runs, sweepstate):
+    """Test that runs are joined with their proposed parameters by sweep run id."""
+    mock_search_runs.return_value = [make_run("run-b", "b", start_time=2000), make_run("run-a", "a")]
+
+    runs = sweepstate.get_all()
+
+    assert [run.id for run in runs] == ["run-a", "run-b"]
+    assert runs[0].config == {"learning_rate": {"value": 0.01}}
+    assert runs[1].config == {"learning_rate": {"value": 0.02}}
+    mock_search_runs.assert_called_once_with(
+        search_all_experiments=True,
+        filter_string="tag.mlflow.parentRunId = 'sweep-id'",
+        output_format="list",
+    )
+
+
+@patch("mlflow.search_runs")
+def test_get_all_skips_runs_without_proposal(mock_search_runs, sweepstate):
+    """Test that child runs without a recorded proposal are not part of the sweep state."""
+    mock_search_runs.return_value = [make_run("run-a", "a"), make_run("run-x", "x")]
+
+    runs = sweepstate.get_all()
+
+    assert [run.id for run in runs] == ["run-a"]
+    sweepstate.ledger.read.assert_called_once_with(["x"])  # looked up the proposal of the unknown run only
+    sweepstate.ledger.read_new.assert_not_called()
+
+
+@patch("mlflow.search_runs")
+def test_refresh_uses_watermark_and_refetches_active_runs(mock_search_runs, sweepstate):
+    """Test that later refreshes only fetch new runs and runs that were still active."""
+    mock_search_runs.return_value = [
+        make_run("run-a", "a", status="FINISHED", start_time=1000),
+        make_run("run-b", "b", status="RUNNING", start_time=200_000),
+    ]
+    sweepstate.get_all()
+
+    mock_search_runs.reset_mock()
+    mock_search_runs.side_effect = [[], [make_run("run-b", "b", status="FINISHED", start_time=200_000)]]
+    runs = sweepstate.get_all()
+
+    filters = [call.kwargs["filter_string"] for call in mock_search_runs.call_args_list]
+    assert filters == [
+        "tag.mlflow.parentRunId = 'sweep-id' AND attributes.start_time >= 140000",
+        "attributes.run_id IN ('run-b')",
+    ]
+    assert [run.state for run in runs] == ["finished", "finished"]
+
+
+@patch("mlflow.search_runs")
+def test_get_finished_since(mock_search_runs, sweepstate):
+    """Test that only runs that ended after the watermark are fetched, and only those in a final state returned."""
+    mock_search_runs.return_value = [make_run("run-a", "a"), make_run("run-b", "b", status="RUNNING")]
+
+    runs = sweepstate.get_finished_since(100_000)
+
+    assert [(run.id, run.state) for run in runs] == [("run-a", "finished")]
+    assert mock_search_runs.call_args.kwargs["filter_string"] == (
+        "tag.mlflow.parentRunId = 'sweep-id' AND attributes.end_time >= 40000"
+    )
+
+
+@patch("mlflow.search_runs")
+def test_get_all_caches_metric_history(mock_search_runs, sweepstate):
+    """Test that metric histories are only fetched for runs that changed."""
+    mock_search_runs.return_value = [make_run("run-a", "a"), make_run("run-b", "b", status="RUNNING")]
+    sweepstate.client._tracking_client.store = MagicMock(spec=[])  # store without bulk interface
+    sweepstate.client.get_metric_history.return_value = [MagicMock(value=0.1), MagicMock(value=0.2)]
+
+    runs = sweepstate.get_all(with_metric="accuracy")
+    assert runs[0].history == [{"accuracy": 0.1}, {"accuracy": 0.2}]
+    assert sweepstate.client.get_metric_history.call_count == 2
+
+    mock_search_runs.return_value = []
+    sweepstate.get_all(with_metric="accuracy")
+    assert sweepstate.client.get_metric_history.call_count == 2
+
+    # Runs that changed again are read incrementally from the store, starting at the last point already read
+    sweepstate.client._tracking_client.store = MagicMock(spec=["get_metric_history"])
+    store = sweepstate.client._tracking_client.store
+    store.get_metric_history.return_value = [sweepstate.client.get_metric_history.return_value[1]]
+    mock_search_runs.side_effect = [[], [make_run("run-b", "b", status="FINISHED")]]
+    runs = sweepstate.get_all(with_metric="accuracy")
+    assert runs[1].history == [{"accuracy": 0.1}, {"accuracy": 0.2}]
+    assert sweepstate.client.get_metric_history.call_count == 2
+    assert store.get_metric_history.call_args.kwargs["page_token"] == SearchUtils.create_page_token(1)
+    sweepstate.ledger.read_new.assert_not_called()
+
+
+@patch("mlflow.search_runs")
+def test_get_all_summary_only(mock_search_runs, sweepstate):
+    """Test that summary-only mode builds the history from the run summary without extra requests."""
+    mock_search_runs.return_value = [make_run("run-a", "a")]
+
+    runs = sweepstate.get_all(with_metric="accuracy", summary_only=True)
+
+    assert runs[0].history == [{"accuracy": 0.5}]
+    sweepstate.client.get_metric_history.assert_not_called()
+
+
+def test_load_metric_histories_bulk():
+    """Test that database-backed stores are queried in bulk and truncated responses are continued."""
+    client = MagicMock()
+    store = client._tracking_client.store
+
+    def metric(run_id, value):
+        return MetricWithRunId(Metric("loss", value, 0, 0), run_id)
+
+    store.get_metric_history_bulk.side_effect = [
+        [metric("r1", 1.0), metric("r1", 1.5), metric("r2", 2.0)],  # truncated, r2 may be incomplete
+        [metric("r2", 2.0), metric("r3", 3.0)],
+    ]
+
+    with patch("mlflow_sweep.sweepstate.MAX_HISTORY_RESULTS", 3):
+        histories = load_metric_histories(client, ["r3", "r1", "r2"], "loss")
+
+    assert {k: [m.value for m in v] for k, v in histories.items()} == {"r1": [1.0, 1.5], "r2": [2.0], "r3": [3.0]}
+    assert [c.kwargs["run_ids"] for c in store.get_metric_history_bulk.call_args_list] == [
+        ["r1", "r2", "r3"],
+        ["r2", "r3"],
+    ]
+    client.get_metric_history.assert_not_called()
+
+
+@patch("mlflow.search_runs")
+def test_get_pending(mock_search_runs, sweepstate):
+    """Test that proposals without a child run are returned as pending runs."""
+    mock_search_runs.return_value = [make_run("run-a", "a")]
+    sweepstate.get_all()
+
+    pending = sweepstate.get_pending()
+
+    assert len(pending) == 1
+    assert pending[0].state == "pending"
+    assert pending[0].config == {"learning_rate": {"value": 0.02}}
+
+
+@patch("mlflow.search_runs")
+def test_pruned_runs(mock_search_runs, sweepstate):
+    """Test that pruned runs are marked as killed and tagged, and are recognized when loaded."""
+    sweepstate.mark_pruned("run-a")
+    sweepstate.client.set_tag.assert_called_once_with("run-a", "sweep.pruned", "true")
+    sweepstate.client.set_terminated.assert_called_once_with("run-a", status="KILLED")
+
+    pruned = make_run("run-a", "a", status="KILLED")
+    pruned.data.tags["sweep.pruned"] = "true"
+    mock_search_runs.return_value = [pruned, make_run("run-b", "b")]
+
+    runs = sweepstate.get_all()
+
+    assert [(run.sweep_run_id, run.state, run.pruned) for run in runs] == [
+        ("a", "killed", True),
+        ("b", "finished", False),
+    ]
+
+
+@patch("mlflow.search_runs")
+def test_mark_timed_out(mock_search_runs, sweepstate):
+    """Test that the run of a timed out trial is found by its sweep run id, killed and tagged."""
+    mock_search_runs.return_value = [make_run("run-a", "a", status="RUNNING")]
+    sweepstate.mark_timed_out("a")
+    assert "tag.mlflow.sweepRunId = 'a'" in mock_search_runs.call_args.kwargs["filter_string"]
+    sweepstate.client.set_tag.assert_called_once_with("run-a", "sweep.timedOut", "true")
+    sweepstate.client.set_terminated.assert_called_once_with("run-a", status="KILLED")
+
+    mock_search_runs.return_value = []
+    sweepstate.mark_timed_out("b")  # the trial did not start a run before it was terminated
+    sweepstate.client.set_terminated.assert_called_once()
+
+
+@patch("mlflow.search_runs")
+@patch("mlflow_sweep.sweepstate.time.time", return_value=1000.0)
+def test_reclaim_stale(mock_time, mock_search_runs, sweepstate):
+    """Test that running trials of agents without a recent heartbeat are killed and no longer count as proposed."""
+    sweepstate.heartbeat("alive")
+    sweepstate.client.set_tag.assert_called_once_with("sweep-id", "sweep.heartbeat.alive", "1000.000")
+    sweepstate.remove_heartbeat("gone")
+    sweepstate.client.delete_tag.assert_called_once_with("sweep-id", "sweep.heartbeat.gone")
+
+    tags = {"sweep": "True", "sweep.heartbeat.alive": "990.0", "sweep.heartbeat.dead": "100.0"}
+    sweepstate.client.get_run.return_value.data.tags = tags
+    runs = [make_run("run-a", "a", status="RUNNING"), make_run("run-b", "b", status="RUNNING")]
+    runs[0].data.tags["mlflow.agentId"] = "dead"
+    runs[1].data.tags["mlflow.agentId"] = "alive"
+    mock_search_runs.return_value = runs
+
+    assert sweepstate.reclaim_stale(timeout=60, agent_id="zzz") == []  # only the live agent with the smallest ID acts
+    sweepstate.client.reset_mock()
+    assert sweepstate.reclaim_stale(timeout=60, agent_id="alive") == [sweepstate.ledger.get("a")]
+    sweepstate.client.set_terminated.assert_called_once_with("run-a", status="KILLED")
+    sweepstate.client.set_tag.assert_any_call("run-a", "sweep.reclaimed", "true")
+    sweepstate.client.set_tag.assert_any_call("sweep-id", "sweep.reclaimed.a", 1)
+
+    tags["sweep.reclaimed.a"] = "1"
+    assert [p["sweep_run_id"] for p in sweepstate.get_parameters()] == ["b"]
+    assert sweepstate.reclaim_stale(timeout=60) == []  # not reclaimed twice
+
+
+@patch("mlflow.search_runs")
+def test_get_all_skips_reclaimed_runs(mock_search_runs, sweepstate):
+    """Test that killed runs of reclaimed trials are not passed on to the sampler or to early termination."""
+    runs = [make_run("run-a", "a", status="KILLED"), make_run("run-b", "b", status="KILLED", start_time=2000)]
+    runs[0].data.tags["sweep.reclaimed"] = "true"
+    mock_search_runs.return_value = runs
+
+    assert [run.id for run in sweepstate.get_all()] == ["run-b"]
+    assert [run.id for run in sweepstate.get_finished_since(0)] == ["run-b"]
+
+
+@patch("mlflow.search_runs")
+def test_get_active(mock_search_runs, sweepstate):
+    """Test that only the running and scheduled runs of the sweep are fetched."""
+    mock_search_runs.side_effect = [[make_run("run-a", "a", status="RUNNING")], [make_run("run-c", "c", "SCHEDULED")]]
+
+    assert [(run.id, run.state) for run in sweepstate.get_active()] == [("run-a", "running")]  # c is not in the ledger
+    filters = [c.kwargs["filter_string"] for c in mock_search_runs.call_args_list]
+    assert filters == [
+        "tag.mlflow.parentRunId = 'sweep-id' AND attributes.status = 'RUNNING'",
+        "tag.mlflow.parentRunId = 'sweep-id' AND attributes.status = 'SCHEDULED'",
+    ]
+
+
+@patch("mlflow.search_runs")
+def test_get_all_sees_changes_of_other_refreshes(mock_search_runs, sweepstate):
+    """Test that runs refreshed while reclaiming stale trials are not served from the cache of get_all."""
+    mock_search_runs.return_value = [make_run("run-a", "a", status="RUNNING")]
+    assert [run.state for run in sweepstate.get_all()] == ["running"]
+
+    sweepstate.client.get_run.return_value.data.tags = {}
+    mock_search_runs.side_effect = [[make_run("run-b", "b", start_time=2000)], [make_run("run-a", "a")], [], []]
+    sweepstate.reclaim_stale(timeout=60)
+
+    assert [(run.id, run.state) for run in sweepstate.get_all()] == [("run-a", "finished"), ("run-b", "finished")]
+
+
+def test_metric_history_cursor_reads_new_points(tmp_path):
+    """Test that the cursor only returns points logged since the previous poll, against a real tracking store."""
+    client = MlflowClient(tracking_uri=f"sqlite:///{tmp_path / 'mlflow.db'}")
+    experiment_id = client.create_experiment("cursor", artifact_location=str(tmp_path / "artifacts"))
+    run_ids = [client.create_run(experiment_id).info.run_id for _ in range(2)]
+    for step in range(3):
+        client.log_metric(run_ids[0], "loss", 1.0 / (step + 1), step=step)
+
+    cursor = MetricHistoryCursor(client, "loss")
+    new = cursor.poll(run_ids)
+    assert [m.value for m in new[run_ids[0]]] == [1.0, 0.5, 1 / 3]
+    assert new[run_ids[1]] == []
+
+    client.log_metric(run_ids[0], "loss", 0.25, step=3)
+    client.log_metric(run_ids[1], "loss", 2.0, step=0)
+    new = cursor.poll(run_ids)
+    assert [m.value for m in new[run_ids[0]]] == [0.25]
+    assert [m.value for m in new[run_ids[1]]] == [2.0]
+    assert [m.step for m in cursor.histories[run_ids[0]]] == [0, 1, 2, 3]
+
+    assert cursor.poll(run_ids) == {run_ids[0]: [], run_ids[1]: []}
+
+
+def test_metric_history_cursor_falls_back_to_full_history():
+    """Test that the full history is used if the store ignores the offset or earlier points changed."""
+    client = MagicMock()
+    store = client._tracking_client.store
+    points = [
+        Metric("loss", value, timestamp, step) for step, (value, timestamp) in enumerate([(3, 1), (2, 2), (1, 3)])
+    ]
+    cursor = MetricHistoryCursor(client, "loss")
+    cursor.histories["run"] = points[:2]
+
+    store.get_metric_history.return_value = points  # offset ignored
+    assert cursor.poll(["run"]) == {"run": points[2:]}
+    assert cursor.histories["run"] == points
+    client.get_metric_history.assert_not_called()
+
+    changed = [Metric("loss", 5, 0, 0), *points]
+    store.get_metric_history.return_value = changed[2:]  # a point was inserted before the cursor
+    client.get_metric_history.return_value = changed
+    assert cursor.poll(["run"]) == {"run": changed[3:]}
+    assert cursor.histories["run"] == changed
@@ -0,0 +1,62 @@
+import shlex
+import subprocess
+import sys
+
+import pytest
+
+from mlflow_sweep.template import CommandTemplate, parameter_names
+
+
+def test_render_single_pass():
+    """Test that values are not substituted again when they contain placeholders themselves."""
+    template = CommandTemplate("python train.py --a ${a} --b ${b}")
+    assert template.render({"a": "${b}", "b": 2}, quote=False) == "python train.py --a ${b} --b 2"
+
+
+def test_render_quotes_values_for_the_shell():
+    template = CommandTemplate(f"{sys.executable} -c 'import sys; print(sys.argv[1:])' ${{name}} ${{lr}}")
+    command = template.render({"name": "my run; rm -rf /", "lr": 0.01})
+
+    assert command.endswith("'my run; rm -rf /' 0.01")
+    output = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == str(["my run; rm -rf /", "0.01"])
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="requires a POSIX shell")
+def test_render_placeholders_inside_quotes():
+    """Test that placeholders the template already quotes are escaped for their quotes instead of quoted again."""
+    script = "import sys; print(sys.argv[1:])"
+    template = CommandTemplate(f'{sys.executable} -c \'{script}\' "${{a}}" \'${{b}}\' --c="x ${{c}}" \\"${{d}}')
+    values = {"a": "a b", "b": "it's", "c": 'say "$HOME" `id`', "d": "d e"}
+    command = template.render(values)
+
+    assert '"a b"' in command  # not quoted a second time as "'a b'"
+    output = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == str(["a b", "it's", '--c=x say "$HOME" `id`', '"d e'])
+
+
+def test_render_argv():
+    template = CommandTemplate("python 'my script.py' --name=${name} --depth ${model.depth}")
+    argv = template.render_argv({"name": "a b", "model": {"depth": 3}})
+
+    assert argv == ["python", "my script.py", "--name=a b", "--depth", "3"]
+    assert shlex.split(template.render({"name": "a b", "model": {"depth": 3}})) == argv
+
+
+def test_dotted_keys():
+    template = CommandTemplate("--depth=${model.depth} --model=${model} --lr=${opt.lr}")
+    rendered = template.render({"model": {"depth": 3}, "opt.lr": 0.1}, quote=False)
+    assert rendered == "--depth=3 --model={'depth': 3} --lr=0.1"
+
+
+def test_validate_placeholders():
+    parameters = parameter_names({"lr": {"min": 0.0, "max": 1.0}, "model": {"parameters": {"depth": {"value": 2}}}})
+
+    CommandTemplate("python train.py ${lr} ${model.depth}", parameters).validate()
+    with pytest.raises(ValueError, match=r"placeholders \['epochs', 'model.width'\]"):
+        CommandTemplate("python train.py ${lr} ${epochs} ${model.width}", parameters).validate()
+
+
+def test_missing_value():
+    with pytest.raises(KeyError, match="model.depth"):
+        CommandTemplate("${model.depth}").render({"model": {}})
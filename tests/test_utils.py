@@ -1,7 +1,13 @@
+import json
+
 import numpy as np
 import pytest
 
-from mlflow_sweep.utils import calculate_feature_importance_and_correlation
+from mlflow_sweep.utils import (
+    calculate_feature_importance_and_correlation,
+    calculate_feature_importance_with_settings,
+    describe_importance_settings,
+)
 
 
 @pytest.fixture
@@ -118,3 +124,96 @@ def test_current_time_convert():
     # Test case 3: Another specific timestamp
     # 1640995200000 ms = January 1, 2022 00:00:00 UTC
     assert current_time_convert(1640995200000) == "2022-01-01 00:00:00"
+
+
+def test_categorical_parameter_is_aggregated():
+    """Test that the encoded columns of a categorical parameter are reported as a single parameter."""
+    rng = np.random.default_rng(0)
+    optimizer = rng.choice(["adam", "sgd", "rmsprop"], size=200)
+    learning_rate = rng.uniform(0, 1, size=200)
+    metric = (optimizer == "adam") * 1.0 + 0.01 * learning_rate
+    params = {"learning_rate": learning_rate, "optimizer": optimizer}
+
+    result = calculate_feature_importance_and_correlation(metric, params, n_estimators=20, n_repeats=3, random_state=0)
+
+    assert set(result.keys()) == {"learning_rate", "optimizer"}
+    assert np.isclose(result["learning_rate"]["importance"] + result["optimizer"]["importance"], 1.0)
+    assert result["optimizer"]["importance"] > 0.9
+    assert result["optimizer"]["permutation_importance"] > result["learning_rate"]["permutation_importance"]
+
+
+def test_row_budget_subsamples_and_reports_settings():
+    """Test that a row budget limits the analysis to a stratified subsample and that the settings are reported."""
+    rng = np.random.default_rng(0)
+    params = {"learning_rate": rng.uniform(0, 1, size=1000)}
+    metric = params["learning_rate"] ** 2
+
+    _, settings = calculate_feature_importance_with_settings(
+        metric, params, n_estimators=10, n_repeats=2, max_rows=100, random_state=0
+    )
+
+    assert settings["rows_total"] == 1000
+    assert settings["rows_used"] == 100
+    assert settings["n_estimators"] == 10
+    assert settings["n_repeats"] == 2
+
+
+def test_time_budget_limits_rows():
+    """Test that a small time budget analyzes fewer runs than the sweep contains."""
+    rng = np.random.default_rng(0)
+    params = {"learning_rate": rng.uniform(0, 1, size=20000), "momentum": rng.uniform(0, 1, size=20000)}
+    metric = params["learning_rate"] + params["momentum"]
+
+    _, settings = calculate_feature_importance_with_settings(
+        metric, params, n_estimators=10, n_repeats=2, time_budget=0.01, random_state=0
+    )
+
+    assert settings["rows_used"] < settings["rows_total"]
+
+
+def test_stratified_subsample_keeps_metric_range():
+    """Test that the subsample covers the whole range of the metric."""
+    from mlflow_sweep.utils import stratified_subsample
+
+    metric = np.random.default_rng(0).normal(size=5000)
+    indices = stratified_subsample(metric, 50, seed=0)
+
+    assert len(indices) == len(np.unique(indices)) == 50
+    assert metric[indices].min() < np.quantile(metric, 0.1)
+    assert metric[indices].max() > np.quantile(metric, 0.9)
+    assert len(stratified_subsample(metric[:10], 50)) == 10
+
+
+@pytest.mark.parametrize("method", ["fanova", "linear"])
+def test_fast_methods_rank_parameters(method):
+    """Test that the fast importance methods return the same shape and rank an informative parameter first."""
+    rng = np.random.default_rng(0)
+    params = {
+        "learning_rate": rng.uniform(0, 1, size=500),
+        "optimizer": rng.choice(["adam", "sgd"], size=500),
+        "noise": rng.uniform(0, 1, size=500),
+    }
+    metric = 3 * params["learning_rate"] + (params["optimizer"] == "adam") + 0.01 * rng.normal(size=500)
+
+    result, settings = calculate_feature_importance_with_settings(
+        metric, params, n_estimators=20, method=method, random_state=0
+    )
+
+    assert settings["method"] == method
+    assert set(result) == set(params)
+    assert all(
+        set(stats) == {"importance", "permutation_importance", "pearson", "spearman"} for stats in result.values()
+    )
+    assert result["learning_rate"]["importance"] > result["optimizer"]["importance"] > result["noise"]["importance"]
+    assert result["noise"]["importance"] < 0.05
+    # Scores that are not calculated are written as null instead of NaN, which is not valid JSON
+    json.dumps(result, allow_nan=False)
+    assert (result["noise"]["permutation_importance"] is None) == (method == "fanova")
+    assert f"{method} method" in describe_importance_settings(settings)
+    assert "permutation repeats" not in describe_importance_settings(settings)
+
+
+def test_unknown_method():
+    """Test that an unknown importance method raises an error."""
+    with pytest.raises(ValueError, match="Unknown importance method"):
+        calculate_feature_importance_and_correlation(np.arange(3.0), {"x": np.arange(3.0)}, method="shap")
@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from mlflow_sweep.workqueue import ProposalQueue
+
+
+def make_proposals(n: int) -> list[tuple[str | list[str], dict]]:
+    return [(f"echo {i}", {"run": i, "sweep_run_id": f"run-{i}"}) for i in range(1, n + 1)]
+
+
+def test_concurrent_claims_are_unique(tmp_path):
+    """Test that agents claiming at the same time never receive the same entry and drain the queue in order."""
+    path = tmp_path / "coordinator.db"
+    ProposalQueue("sweep", path=path).put(make_proposals(40))
+    agents = [ProposalQueue("sweep", agent_id=str(i), path=path) for i in range(8)]
+
+    def claim_all(queue):
+        claimed = []
+        while batch := queue.claim(3):
+            assert [p["run"] for _, p in batch] == sorted(p["run"] for _, p in batch)
+            claimed += batch
+        return claimed
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        claimed = [entry for batch in pool.map(claim_all, agents) for entry in batch]
+
+    assert sorted(p["run"] for _, p in claimed) == list(range(1, 41))
+    assert agents[0].counts() == {"claimed": 40}
+
+
+def test_complete_and_put(tmp_path):
+    """Test that completed entries are not claimed again and that materializing replaces the old entries."""
+    queue = ProposalQueue("sweep", path=tmp_path / "coordinator.db")
+    assert not queue.exists()
+    queue.put(make_proposals(3))
+    assert queue.exists()
+
+    [(command, proposal)] = queue.claim(1)
+    assert command == "echo 1"
+    queue.complete(proposal["run"], "finished")
+    queue.complete(queue.claim(1)[0][1]["run"], "failed")
+    assert queue.counts() == {"failed": 1, "finished": 1, "pending": 1}
+
+    queue.put([(["echo", "argv"], {"run": 1, "sweep_run_id": "new"})])
+    assert queue.claim(5) == [(["echo", "argv"], {"run": 1, "sweep_run_id": "new"})]
+    assert ProposalQueue("other", path=queue.path).claim(1) == []
+
+
+def test_requeue(tmp_path):
+    """Test that a claimed entry is put back once with its new parameters."""
+    queue = ProposalQueue("sweep", path=tmp_path / "coordinator.db")
+    queue.put(make_proposals(2))
+    [(_, proposal)] = queue.claim(1)
+
+    assert queue.requeue({**proposal, "sweep_run_id": "retry"})
+    assert not queue.requeue({**proposal, "sweep_run_id": "other"})  # already put back by another agent
+    assert [p["sweep_run_id"] for _, p in queue.claim(2)] == ["retry", "run-2"]